@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Compare the packets per second of the pysnmp engine and the SNMPv2c fast
+path when receiving traps.
+
+    benchmarks/decoder.py [count]
+"""
+import os
+import sys
+import time
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../test')))
+
+from pysnmp.entity.rfc3413 import ntfrcv
+from pysnmp.carrier.asynsock.dgram import udp
+from pysnmp.proto import api
+
+from sensu.snmp.mib import MibResolver
+from sensu.snmp.resolver import HostnameResolver
+from sensu.snmp.receiver import TrapReceiver
+from sensu.snmp.ber import SNMP_TRAP_OID
+
+from test_ber import encode_notification
+
+TRAP_SOURCE = ('127.0.0.1', 16200)
+
+def create_config(fast_path):
+    return {
+        "snmp": {
+            "transport": {
+                "listen_address": "127.0.0.1",
+                "listen_port": 0,
+                "listen": [],
+                "udp": {"enabled": True, "rcvbuf": None, "stats_interval": 0},
+                "tcp": {"enabled": False}
+            },
+            "fast_path": {"enabled": fast_path},
+            "capture": {"enabled": False},
+            "auth": {
+                "version2": {"enabled": True, "community": "public"},
+                "version3": {"enabled": False, "users": {}}
+            }
+        }
+    }
+
+def create_message():
+    v2c = api.protoModules[api.protoVersion2c]
+    var_binds = [((1, 3, 6, 1, 2, 1, 1, 3, 0), v2c.TimeTicks(123456)),
+                 (SNMP_TRAP_OID, v2c.ObjectIdentifier((1, 3, 6, 1, 6, 3, 1, 1, 5, 1))),
+                 ((1, 3, 6, 1, 2, 1, 1, 5, 0), v2c.OctetString("bench-host"))]
+    return encode_notification(api.protoVersion2c, 'TrapPDU', 'public', var_binds)
+
+def benchmark(name, mibs, resolver, message, count, fast_path):
+    traps = []
+    receiver = TrapReceiver(create_config(fast_path), mibs, traps.append, resolver)
+    ntfrcv.NotificationReceiver(receiver._snmp_engine, receiver._notification_callback)
+    transport_dispatcher = receiver._snmp_engine.transportDispatcher
+    transport = transport_dispatcher.getTransport(udp.domainName)
+
+    start = time.time()
+    for i in xrange(count):
+        # feed the datagram to the transport dispatcher as if it was read
+        # from the socket
+        transport_dispatcher._cbFun(transport, TRAP_SOURCE, message)
+    elapsed = time.time() - start
+    transport_dispatcher.closeDispatcher()
+
+    assert len(traps) == count, "%s: received %d of %d traps" % (name, len(traps), count)
+    print "%-8s %8d traps %8.3fs %10.0f traps/s" % (name, count, elapsed, count / elapsed)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    # keep reverse DNS out of the measurement
+    hosts_file = tempfile.NamedTemporaryFile()
+    hosts_file.write("%s bench-host.example.com\n" % (TRAP_SOURCE[0]))
+    hosts_file.flush()
+    resolver = HostnameResolver()
+    resolver.load_hosts_file(hosts_file.name)
+
+    mibs = MibResolver()
+    message = create_message()
+    benchmark("engine", mibs, resolver, message, count, False)
+    benchmark("fastpath", mibs, resolver, message, count, True)
+
+if __name__ == '__main__':
+    main()
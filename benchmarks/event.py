@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Measure the memory held per TrapEvent and the time spent serializing events
+the way the daemon does (once for the events log, once for sending and once
+more for a retry).
+
+    benchmarks/event.py [count]
+"""
+import os
+import sys
+import gc
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.event import TrapEvent
+
+def resident_memory():
+    # resident set size in bytes
+    fh = open('/proc/self/statm')
+    try:
+        return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    finally:
+        fh.close()
+
+def create_events(count):
+    handlers = ["default", "pagerduty"]
+    return [TrapEvent("host-%d.example.com Link Down" % (i % 1000),
+                      "Interface %d on host-%d.example.com went down" % (i % 48, i % 1000),
+                      2,
+                      list(handlers),
+                      time.time())
+            for i in xrange(count)]
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    gc.collect()
+    before = resident_memory()
+    start = time.time()
+    events = create_events(count)
+    created = time.time() - start
+    gc.collect()
+    memory = resident_memory() - before
+
+    start = time.time()
+    for event in events:
+        # events log, send and a retry
+        event.to_json()
+        event.to_json()
+        event.to_json()
+    serialized = time.time() - start
+    gc.collect()
+    serialized_memory = resident_memory() - before
+
+    print "%d events: %.0f bytes/event (%.0f once serialized), create %.2f us/event, serialize x3 %.2f us/event" % (
+        count, float(memory) / count, float(serialized_memory) / count, created * 1e6 / count,
+        serialized * 1e6 / count)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmark of sensu-trapd. Starts a SensuTrapServer against a fake
+Sensu client, sends traps at a fixed rate and reports the sustained
+throughput, the drop rate and the latency from sending a trap to the Sensu
+client receiving its event.
+
+    benchmarks/throughput.py [options]
+
+The results are printed as a single JSON object so runs can be compared.
+SNMPv3 traps are encoded (and encrypted) up front, which takes a moment for
+large counts.
+"""
+import os
+import sys
+import time
+import json
+import socket
+import logging
+import optparse
+import tempfile
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../test')))
+
+from pysnmp.entity.rfc3413.oneliner import ntforg
+
+from sensu.snmp.config import DEFAULT_CONFIG
+from sensu.snmp.config import _merge_config
+from sensu.snmp.log import log
+from sensu.snmp.log import events_log
+from sensu.snmp.server import SensuTrapServer
+
+from helpers.sensu import FakeSensuClient
+
+V3_USER = ('bench-user', 'benchAuthSecret', 'benchPrivSecret')
+
+# sequence numbers are sent as fixed width sysName values
+SEQUENCE_FORMAT = '%010d'
+
+def free_udp_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def create_trap_file(handlers):
+    # every handler matches the same trap and reports its sequence number
+    trap_handlers = dict()
+    for i in range(handlers):
+        trap_handlers["bench-handler-%d" % (i)] = {
+            "trap": {
+                "type": ["SNMPv2-MIB", "coldStart"],
+                "args": {"sequence": ["SNMPv2-MIB", "sysName"]}
+            },
+            "event": {
+                "name": "bench-event-%d" % (i),
+                "output": "{sequence}",
+                "handlers": ["default"],
+                "severity": "WARNING"
+            }
+        }
+    trap_file = tempfile.NamedTemporaryFile(suffix='.json')
+    json.dump(trap_handlers, trap_file)
+    trap_file.flush()
+    return trap_file
+
+def create_config(options, listen_port, trap_file, sensu):
+    return _merge_config(DEFAULT_CONFIG, {
+        "daemon": {
+            "trap_file": trap_file,
+            "trap_match": options.match,
+            "workers": options.workers,
+            "io_mode": options.io_mode
+        },
+        "dispatcher": {
+            "host": sensu.host,
+            "port": sensu.port,
+            "check_response": options.ack,
+            "batch_size": options.batch_size
+        },
+        "resolver": {
+            "enabled": False
+        },
+        "snmp": {
+            "transport": {
+                "listen_address": "127.0.0.1",
+                "listen_port": listen_port
+            },
+            "fast_path": {
+                "enabled": options.fast_path
+            },
+            "auth": {
+                "version2": {"enabled": True, "community": "public"},
+                "version3": {
+                    "enabled": True,
+                    "users": {
+                        V3_USER[0]: {
+                            "authentication": {"protocol": "MD5", "password": V3_USER[1]},
+                            "privacy": {"protocol": "DES", "password": V3_USER[2]}
+                        }
+                    }
+                }
+            }
+        }
+    })
+
+class TrapEncoder(object):
+    """
+    Encodes traps with the pysnmp notification originator by capturing what
+    it sends to a local socket.
+    """
+
+    def __init__(self, version):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(('127.0.0.1', 0))
+        self._target = ntforg.UdpTransportTarget(self._socket.getsockname())
+        if version == 'v3':
+            self._auth = ntforg.UsmUserData(*V3_USER)
+        else:
+            self._auth = ntforg.CommunityData('public')
+        self._notifier = ntforg.NotificationOriginator()
+
+    def encode(self, sequence):
+        error = self._notifier.sendNotification(self._auth, self._target, 'trap',
+                                                ntforg.MibVariable('SNMPv2-MIB', 'coldStart'),
+                                                (ntforg.MibVariable('SNMPv2-MIB', 'sysName'),
+                                                 SEQUENCE_FORMAT % (sequence)))
+        if error:
+            raise RuntimeError("Failed to encode trap: %s" % (error))
+        return self._socket.recv(65535)
+
+    def close(self):
+        self._socket.close()
+
+def create_messages(version, count):
+    encoder = TrapEncoder(version)
+    try:
+        if version == 'v3':
+            # authenticated and encrypted, so every trap is encoded
+            return [encoder.encode(i) for i in xrange(count)]
+        # patch the sequence number into a single encoded trap
+        template = encoder.encode(0)
+        placeholder = SEQUENCE_FORMAT % (0)
+        return [template.replace(placeholder, SEQUENCE_FORMAT % (i)) for i in xrange(count)]
+    finally:
+        encoder.close()
+
+def send_traps(messages, address, rate):
+    """
+    Sends the messages at rate traps per second (as fast as possible if rate
+    is 0). Returns the time every message was sent at.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sent = []
+    start = time.time()
+    for i, message in enumerate(messages):
+        if rate > 0:
+            delay = start + float(i) / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        sent.append(time.time())
+        sock.sendto(message, address)
+    sock.close()
+    return sent
+
+def wait_for_events(sensu, expected, idle_timeout):
+    # wait until all events arrived or none arrived for idle_timeout seconds
+    count = len(sensu.events)
+    idle_since = time.time()
+    while count < expected and time.time() - idle_since < idle_timeout:
+        sensu.wait_for_events(expected, min(idle_timeout, 0.5))
+        if len(sensu.events) > count:
+            count = len(sensu.events)
+            idle_since = time.time()
+
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+def summarize(options, sent, sensu, expected):
+    latencies = []
+    sequences = set()
+    for event, received in zip(sensu.events, sensu.timestamps):
+        try:
+            sequence = int(event['output'])
+        except (KeyError, ValueError):
+            # not an event for a trap
+            continue
+        sequences.add(sequence)
+        latencies.append(received - sent[sequence])
+    latencies.sort()
+
+    delivered = len(sequences)
+    elapsed = (max(sensu.timestamps) - sent[0]) if sensu.timestamps else 0
+    return {
+        'version': options.version,
+        'rate': options.rate,
+        'handlers': options.handlers,
+        'match': options.match,
+        'io_mode': options.io_mode,
+        'workers': options.workers,
+        'fast_path': options.fast_path,
+        'ack': options.ack,
+        'batch_size': options.batch_size,
+        'sent': len(sent),
+        'send_rate': len(sent) / max(sent[-1] - sent[0], 1e-9),
+        'delivered': delivered,
+        'events': len(latencies),
+        'expected_events': expected,
+        'drop_rate': 1 - float(delivered) / len(sent),
+        'traps_per_second': delivered / elapsed if elapsed else 0.0,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p99': percentile(latencies, 99),
+        'latency_max': latencies[-1] if latencies else None,
+    }
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--count", dest="count", type="int", default=10000,
+                      help="number of traps to send")
+    parser.add_option("-r", "--rate", dest="rate", type="float", default=1000,
+                      help="traps per second to send (0 sends as fast as possible)")
+    parser.add_option("-v", "--version", dest="version", choices=['v2c', 'v3'], default='v2c',
+                      help="SNMP version of the traps (v2c or v3)")
+    parser.add_option("--handlers", dest="handlers", type="int", default=1,
+                      help="number of trap handlers matching every trap")
+    parser.add_option("--match", dest="match", choices=['first', 'all'], default='first',
+                      help="trap handler matching (first or all)")
+    parser.add_option("--io-mode", dest="io_mode", default='threads',
+                      help="io mode of the daemon (threads or event-loop)")
+    parser.add_option("--workers", dest="workers", type="int", default=1,
+                      help="number of receiver worker processes")
+    parser.add_option("--fast-path", dest="fast_path", action="store_true", default=False,
+                      help="enable the SNMPv2c fast path")
+    parser.add_option("--batch-size", dest="batch_size", type="int", default=1,
+                      help="events per write to the Sensu client")
+    parser.add_option("--no-ack", dest="ack", action="store_false", default=True,
+                      help="don't acknowledge events from the fake Sensu client")
+    parser.add_option("--idle-timeout", dest="idle_timeout", type="float", default=5,
+                      help="seconds to wait for further events before giving up")
+    parser.add_option("-o", "--output", dest="output", default=None,
+                      help="write the results to this file instead of stdout")
+    (options, args) = parser.parse_args()
+
+    # only report problems of the daemon
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter('[%(asctime)s] [%(levelname)s] [%(name)s] %(message)s'))
+    log.addHandler(handler)
+    log.setLevel(logging.ERROR)
+    events_log.addHandler(logging.NullHandler())
+    events_log.setLevel(logging.ERROR)
+
+    print >> sys.stderr, "Encoding %d %s traps" % (options.count, options.version)
+    messages = create_messages(options.version, options.count)
+
+    sensu = FakeSensuClient(respond=options.ack)
+    sensu.start()
+    listen_port = free_udp_port()
+    trap_file = create_trap_file(options.handlers)
+    server = SensuTrapServer(create_config(options, listen_port, trap_file.name, sensu))
+    server_thread = threading.Thread(target=server.run, name="SensuTrapServer")
+    server_thread.start()
+    try:
+        # give the receivers a moment to bind
+        time.sleep(1)
+        print >> sys.stderr, "Sending %d traps at %s traps/s" % (options.count, options.rate or "max")
+        sent = send_traps(messages, ('127.0.0.1', listen_port), options.rate)
+
+        expected = options.count
+        if options.match == 'all':
+            expected *= options.handlers
+        wait_for_events(sensu, expected, options.idle_timeout)
+        results = summarize(options, sent, sensu, expected)
+        results['stats'] = server.stats()
+    finally:
+        server.stop()
+        server_thread.join()
+        sensu.stop()
+        trap_file.close()
+
+    if options.output:
+        fh = open(options.output, 'w')
+        try:
+            json.dump(results, fh, sort_keys=True, indent=4)
+        finally:
+            fh.close()
+    else:
+        print json.dumps(results, sort_keys=True, indent=4)
+
+if __name__ == '__main__':
+    main()
@@ -39,7 +39,7 @@ setup(
     description='SNMP Trap Receiver for Sensu',
     package_dir={'': 'src'},
     packages=['sensu', 'sensu.snmp'],
-    scripts=['src/bin/sensu-trapd'],
+    scripts=['src/bin/sensu-trapd', 'src/bin/sensu-trapd-replay'],
     data_files=data_files,
     #install_requires=install_requires,
     #test_suite='test.main',
@@ -0,0 +1,190 @@
+import os
+import sys
+
+from sensu.snmp.log import log
+
+# BER tags used in SNMPv2c messages (RFC 3416)
+TAG_INTEGER = 0x02
+TAG_OCTET_STRING = 0x04
+TAG_NULL = 0x05
+TAG_OBJECT_IDENTIFIER = 0x06
+TAG_SEQUENCE = 0x30
+TAG_IP_ADDRESS = 0x40
+TAG_COUNTER32 = 0x41
+TAG_GAUGE32 = 0x42
+TAG_TIME_TICKS = 0x43
+TAG_OPAQUE = 0x44
+TAG_COUNTER64 = 0x46
+TAG_NO_SUCH_OBJECT = 0x80
+TAG_NO_SUCH_INSTANCE = 0x81
+TAG_END_OF_MIB_VIEW = 0x82
+TAG_SNMPV2_TRAP = 0xa7
+
+SNMP_VERSION_2C = 1
+
+# SNMPv2-MIB::snmpTrapOID.0
+SNMP_TRAP_OID = (1, 3, 6, 1, 6, 3, 1, 1, 4, 1, 0)
+
+class BerDecodeError(ValueError):
+    pass
+
+def _decode_header(data, offset, end):
+    """
+    Decode the tag and length at offset. Returns the tag and the start and
+    end offsets of the contents.
+    """
+    if offset + 2 > end:
+        raise BerDecodeError("Truncated header at offset %d" % (offset))
+    tag = ord(data[offset])
+    length = ord(data[offset + 1])
+    offset += 2
+    if length & 0x80:
+        # long form length
+        count = length & 0x7f
+        if count == 0 or count > 4 or offset + count > end:
+            raise BerDecodeError("Invalid length at offset %d" % (offset))
+        length = 0
+        for c in data[offset:offset + count]:
+            length = (length << 8) | ord(c)
+        offset += count
+    if offset + length > end:
+        raise BerDecodeError("Truncated contents at offset %d" % (offset))
+    return tag, offset, offset + length
+
+def _decode_integer(data, start, stop):
+    if start == stop:
+        raise BerDecodeError("Empty integer at offset %d" % (start))
+    value = ord(data[start])
+    if value & 0x80:
+        value -= 0x100
+    for c in data[start + 1:stop]:
+        value = (value << 8) | ord(c)
+    return value
+
+def _decode_unsigned(data, start, stop):
+    value = 0
+    for c in data[start:stop]:
+        value = (value << 8) | ord(c)
+    return value
+
+def _decode_oid(data, start, stop):
+    if start == stop:
+        raise BerDecodeError("Empty object identifier at offset %d" % (start))
+    oid = []
+    subid = 0
+    for c in data[start:stop]:
+        c = ord(c)
+        subid = (subid << 7) | (c & 0x7f)
+        if not c & 0x80:
+            oid.append(subid)
+            subid = 0
+    if data[stop - 1] > '\x7f':
+        raise BerDecodeError("Truncated object identifier at offset %d" % (start))
+    # the first sub-identifier encodes the first two arcs
+    first = oid[0]
+    if first < 80:
+        return (first // 40, first % 40) + tuple(oid[1:])
+    return (2, first - 80) + tuple(oid[1:])
+
+def _decode_value(data, tag, start, stop):
+    if tag == TAG_OCTET_STRING or tag == TAG_IP_ADDRESS or tag == TAG_OPAQUE:
+        return data[start:stop]
+    if tag == TAG_INTEGER:
+        return _decode_integer(data, start, stop)
+    if tag == TAG_OBJECT_IDENTIFIER:
+        return _decode_oid(data, start, stop)
+    if tag in (TAG_COUNTER32, TAG_GAUGE32, TAG_TIME_TICKS, TAG_COUNTER64):
+        return _decode_unsigned(data, start, stop)
+    if tag in (TAG_NULL, TAG_NO_SUCH_OBJECT, TAG_NO_SUCH_INSTANCE, TAG_END_OF_MIB_VIEW):
+        return None
+    raise BerDecodeError("Unsupported value type 0x%02x at offset %d" % (tag, start))
+
+def message_length(data, offset=0):
+    """
+    Returns the length of the SNMP message starting at offset of a stream
+    (RFC 3430 framing: every message is a BER SEQUENCE) or None if the
+    stream doesn't hold its complete header yet.
+    """
+    if offset + 2 > len(data):
+        return None
+    if ord(data[offset]) != TAG_SEQUENCE:
+        raise BerDecodeError("Not a SNMP message at offset %d" % (offset))
+    length = ord(data[offset + 1])
+    header = 2
+    if length & 0x80:
+        # long form length
+        count = length & 0x7f
+        if count == 0 or count > 4:
+            raise BerDecodeError("Invalid length at offset %d" % (offset + 2))
+        if offset + 2 + count > len(data):
+            return None
+        length = 0
+        for c in data[offset + 2:offset + 2 + count]:
+            length = (length << 8) | ord(c)
+        header += count
+    return header + length
+
+def decode_version(data):
+    """
+    Returns the version field of a SNMP message (0 for SNMPv1, 1 for SNMPv2c
+    and 3 for SNMPv3).
+    """
+    tag, offset, end = _decode_header(data, 0, len(data))
+    if tag != TAG_SEQUENCE:
+        raise BerDecodeError("Not a SNMP message")
+    tag, start, stop = _decode_header(data, offset, end)
+    if tag != TAG_INTEGER:
+        raise BerDecodeError("Invalid version at offset %d" % (start))
+    return _decode_integer(data, start, stop)
+
+def decode_v2c_trap(data):
+    """
+    Decode a SNMPv2c message carrying a SNMPv2-Trap-PDU. Returns the community
+    and a list of (oid, value) varbinds with the OIDs as tuples and the values
+    as plain python objects, or None if the message isn't a v2c trap.
+    """
+    end = len(data)
+    tag, offset, end = _decode_header(data, 0, end)
+    if tag != TAG_SEQUENCE:
+        return None
+
+    # version
+    tag, start, offset = _decode_header(data, offset, end)
+    if tag != TAG_INTEGER or _decode_integer(data, start, offset) != SNMP_VERSION_2C:
+        return None
+
+    # community
+    tag, start, offset = _decode_header(data, offset, end)
+    if tag != TAG_OCTET_STRING:
+        raise BerDecodeError("Invalid community at offset %d" % (start))
+    community = data[start:offset]
+
+    # PDU
+    tag, offset, end = _decode_header(data, offset, end)
+    if tag != TAG_SNMPV2_TRAP:
+        return None
+
+    # skip request-id, error-status and error-index
+    for i in range(3):
+        tag, start, offset = _decode_header(data, offset, end)
+        if tag != TAG_INTEGER:
+            raise BerDecodeError("Invalid PDU header at offset %d" % (start))
+
+    # variable-bindings
+    tag, offset, end = _decode_header(data, offset, end)
+    if tag != TAG_SEQUENCE:
+        raise BerDecodeError("Invalid variable-bindings at offset %d" % (offset))
+
+    varbinds = []
+    while offset < end:
+        tag, start, offset = _decode_header(data, offset, end)
+        if tag != TAG_SEQUENCE:
+            raise BerDecodeError("Invalid variable-binding at offset %d" % (start))
+        tag, start, stop = _decode_header(data, start, offset)
+        if tag != TAG_OBJECT_IDENTIFIER:
+            raise BerDecodeError("Invalid variable-binding name at offset %d" % (start))
+        oid = _decode_oid(data, start, stop)
+        tag, start, stop = _decode_header(data, stop, offset)
+        varbinds.append((oid, _decode_value(data, tag, start, stop)))
+
+    return community, varbinds
@@ -0,0 +1,114 @@
+import os
+import hashlib
+import simplejson as json
+import pysnmp.proto.rfc1902
+
+from sensu.snmp.log import log
+
+# identifies trap handler bundle files (and the version of their format)
+BUNDLE_VERSION = 1
+
+def trap_files(trap_file=None, trap_dir=None):
+    """
+    Returns the trap files to load: the trap file followed by the *.json
+    files of the trap directory in name order.
+    """
+    files = []
+    if trap_file:
+        files.append(trap_file)
+    if trap_dir:
+        for name in sorted(os.listdir(trap_dir)):
+            path = os.path.join(trap_dir, name)
+            if name.endswith('.json') and os.path.isfile(path):
+                files.append(path)
+    return files
+
+def read_trap_files(files):
+    """
+    Reads and merges the trap handler definitions of trap files. Returns the
+    definitions along with the SHA-1 digest of every file. A trap handler id
+    defined by more than one file is an error.
+    """
+    trap_handler_configs = dict()
+    sources = dict()
+    digests = dict()
+    for path in files:
+        log.debug("read_trap_files: Parsing trap handler file: %s" % (path))
+        fh = open(path, 'r')
+        try:
+            data = fh.read()
+        finally:
+            fh.close()
+        digests[path] = hashlib.sha1(data).hexdigest()
+        try:
+            trap_file_data = json.loads(data)
+        except ValueError, e:
+            raise ValueError("Invalid trap file %s: %s" % (path, e))
+        if not isinstance(trap_file_data, dict):
+            raise ValueError("Invalid trap file %s: not a JSON object" % (path))
+        for trap_handler_id, trap_handler_config in trap_file_data.items():
+            if trap_handler_id in sources:
+                raise ValueError("Duplicate trap handler %s in %s and %s" % (trap_handler_id,
+                                                                             sources[trap_handler_id],
+                                                                             path))
+            sources[trap_handler_id] = path
+            trap_handler_configs[trap_handler_id] = trap_handler_config
+    return trap_handler_configs, digests
+
+def bundle_key(digests, mib_sources):
+    """
+    What a bundle is valid for: the digests of the trap files and the
+    sources of the MIBs the symbols were resolved with.
+    """
+    return {'version': BUNDLE_VERSION,
+            'files': digests,
+            'mibs': mib_sources}
+
+def load_bundle(path, key):
+    """
+    Returns the resolved trap handlers of a bundle as a dict of
+    (trap type OID, {trap arg OID: trap arg}) tuples keyed by trap handler
+    id, or None if the bundle is missing or out of date.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        fh = open(path, 'r')
+        try:
+            bundle = json.load(fh)
+        finally:
+            fh.close()
+        if bundle.get('key') != key:
+            log.info("load_bundle: Trap handler bundle %s is out of date" % (path))
+            return None
+        resolved = dict()
+        for trap_handler_id, (trap_type, trap_args) in bundle['handlers'].items():
+            resolved[trap_handler_id] = (pysnmp.proto.rfc1902.ObjectName(trap_type),
+                                         dict((pysnmp.proto.rfc1902.ObjectName(trap_arg_type), trap_arg)
+                                              for trap_arg_type, trap_arg in trap_args))
+    except (EnvironmentError, ValueError, TypeError, KeyError), e:
+        log.warning("load_bundle: Ignoring unreadable trap handler bundle %s: %s" % (path, str(e)))
+        return None
+    log.debug("load_bundle: Loaded %d trap handlers from %s" % (len(resolved), path))
+    return resolved
+
+def save_bundle(path, key, resolved):
+    """
+    Writes the resolved trap handlers (as returned by load_bundle) to a
+    bundle.
+    """
+    handlers = dict()
+    for trap_handler_id, (trap_type, trap_args) in resolved.items():
+        handlers[trap_handler_id] = [list(trap_type),
+                                     sorted([list(trap_arg_type), trap_arg]
+                                            for trap_arg_type, trap_arg in trap_args.items())]
+
+    # replace the bundle atomically, workers may save it at the same time
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    fh = open(temp_path, 'w')
+    try:
+        json.dump({'key': key, 'handlers': handlers}, fh, sort_keys=True)
+    finally:
+        fh.close()
+    os.rename(temp_path, path)
+    log.debug("save_bundle: Saved %d trap handlers to %s" % (len(handlers), path))
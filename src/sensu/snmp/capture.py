@@ -0,0 +1,168 @@
+import os
+import socket
+import struct
+import time
+
+from sensu.snmp.log import log
+
+# identifies capture files (and the version of the record format)
+CAPTURE_MAGIC = "SNMPTRAPCAP\x01"
+
+# timestamp, transport, address length, port, message length
+RECORD_HEADER = struct.Struct('!dBBHH')
+
+TRANSPORT_UDP = 0
+TRANSPORT_TCP = 1
+
+class CaptureFormatError(ValueError):
+    pass
+
+def _pack_address(address):
+    host, port = address[:2]
+    try:
+        return socket.inet_pton(socket.AF_INET, host), port
+    except socket.error:
+        return socket.inet_pton(socket.AF_INET6, host), port
+
+def _unpack_address(packed, port):
+    if len(packed) == 4:
+        return socket.inet_ntop(socket.AF_INET, packed), port
+    return socket.inet_ntop(socket.AF_INET6, packed), port
+
+class TrapCaptureWriter(object):
+    """
+    Writes raw datagrams along with their source address and receive time to
+    a capture file.
+
+    Records are length prefixed and buffered, so capturing a trap costs a
+    copy rather than a write syscall. Once the file reaches max_size it is
+    rotated like a RotatingFileHandler does (capture.1 is the newest rotated
+    file) and at most max_files rotated files are kept.
+    """
+
+    BUFFER_SIZE = 65536
+
+    def __init__(self, path, max_size=0, max_files=0):
+        self.path = path
+        self.max_size = int(max_size)
+        self.max_files = int(max_files)
+        self.records = 0
+        self._fh = None
+        self._open()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        if os.path.exists(self.path):
+            self._repair()
+        self._fh = open(self.path, 'ab', self.BUFFER_SIZE)
+        if self._fh.tell() == 0:
+            self._fh.write(CAPTURE_MAGIC)
+        log.debug("TrapCaptureWriter: Capturing to %s" % (self.path))
+
+    def _repair(self):
+        # drop a partially written record at the end of an existing capture
+        fh = open(self.path, 'rb+')
+        try:
+            size = os.fstat(fh.fileno()).st_size
+            if fh.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+                raise CaptureFormatError("Not a trap capture file: %s" % (self.path))
+            end = fh.tell()
+            while end + RECORD_HEADER.size <= size:
+                header = RECORD_HEADER.unpack(fh.read(RECORD_HEADER.size))
+                record_end = end + RECORD_HEADER.size + header[2] + header[4]
+                if record_end > size:
+                    break
+                end = record_end
+                fh.seek(end)
+            if end < size:
+                log.warning("TrapCaptureWriter: Truncating partial record in %s" % (self.path))
+                fh.truncate(end)
+        finally:
+            fh.close()
+
+    def _rotate(self):
+        self._fh.close()
+        if self.max_files > 0:
+            for i in range(self.max_files - 1, 0, -1):
+                source = "%s.%d" % (self.path, i)
+                if os.path.exists(source):
+                    os.rename(source, "%s.%d" % (self.path, i + 1))
+            os.rename(self.path, "%s.1" % (self.path))
+        else:
+            os.unlink(self.path)
+        self._open()
+
+    def write(self, timestamp, transport, address, message):
+        packed_address, port = _pack_address(address)
+        self._fh.write(RECORD_HEADER.pack(timestamp, transport, len(packed_address), port, len(message)))
+        self._fh.write(packed_address)
+        self._fh.write(message)
+        self.records += 1
+        if self.max_size > 0 and self._fh.tell() >= self.max_size:
+            self._rotate()
+
+    def flush(self):
+        self._fh.flush()
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+def capture_files(path):
+    """
+    Returns the capture file and its rotated files, oldest first.
+    """
+    files = []
+    i = 1
+    while os.path.exists("%s.%d" % (path, i)):
+        files.insert(0, "%s.%d" % (path, i))
+        i += 1
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+def read_capture(path):
+    """
+    Yields the (timestamp, transport, address, message) records of a capture
+    file. A record cut short at the end of the file (by a crash) is ignored.
+    """
+    fh = open(path, 'rb')
+    try:
+        if fh.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise CaptureFormatError("Not a trap capture file: %s" % (path))
+        while True:
+            header = fh.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            timestamp, transport, address_length, port, message_length = RECORD_HEADER.unpack(header)
+            packed_address = fh.read(address_length)
+            message = fh.read(message_length)
+            if len(packed_address) < address_length or len(message) < message_length:
+                log.warning("read_capture: Ignoring truncated record at the end of %s" % (path))
+                break
+            yield timestamp, transport, _unpack_address(packed_address, port), message
+    finally:
+        fh.close()
+
+def replay(records, send, speed=1.0):
+    """
+    Calls send(record) for every capture record, keeping the original gaps
+    between records divided by speed. A speed of 0 replays as fast as
+    possible. Returns the number of records replayed.
+    """
+    count = 0
+    start = None
+    for record in records:
+        if speed > 0:
+            if start is None:
+                start = (time.time(), record[0])
+            delay = start[0] + (record[0] - start[1]) / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        send(record)
+        count += 1
+    return count
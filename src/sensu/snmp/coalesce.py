@@ -0,0 +1,117 @@
+import time
+import threading
+from collections import OrderedDict
+
+from sensu.snmp.log import log
+from sensu.snmp.event import TrapEvent
+
+class TrapEventCoalescer(object):
+    """
+    Collapses repeated events within a time window.
+
+    The first event for a check name is dispatched right away. Further
+    events with the same name and status within the window of the first one
+    are only counted. Once the window expired a single summary event with the
+    occurrence count and the first and last seen times is dispatched.
+
+    An event with another status than the pending one ends the window early
+    (after its summary), so Sensu always sees status changes in order. The
+    table holds at most max_entries check names; when it is full the oldest
+    window is ended early.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = int(max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = dict((name, 0) for name in ('received', 'dispatched', 'suppressed',
+                                                     'summaries', 'evicted'))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        self._lock.acquire()
+        try:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            if stats['received']:
+                stats['dedup_ratio'] = float(stats['suppressed']) / stats['received']
+            else:
+                stats['dedup_ratio'] = 0.0
+            return stats
+        finally:
+            self._lock.release()
+
+    def coalesce(self, event, window, now=None):
+        """
+        Returns the events to dispatch for event (none if it was coalesced).
+        """
+        if now is None:
+            now = time.time()
+        seen = event.received or now
+        events = []
+
+        self._lock.acquire()
+        try:
+            self._counters['received'] += 1
+            entry = self._entries.get(event.name)
+            if entry is not None:
+                if entry['status'] == event.status and now < entry['expires']:
+                    # repeated event within the window
+                    entry['event'] = event
+                    entry['count'] += 1
+                    entry['last_seen'] = seen
+                    self._counters['suppressed'] += 1
+                    return events
+                # window expired or status changed
+                del self._entries[event.name]
+                self._summarize(entry, events)
+            elif len(self._entries) >= self.max_entries > 0:
+                name, oldest = self._entries.popitem(last=False)
+                self._counters['evicted'] += 1
+                self._summarize(oldest, events)
+
+            self._entries[event.name] = {'event': event,
+                                         'status': event.status,
+                                         'count': 1,
+                                         'first_seen': seen,
+                                         'last_seen': seen,
+                                         'expires': now + window}
+            self._counters['dispatched'] += 1
+            events.append(event)
+            return events
+        finally:
+            self._lock.release()
+
+    def flush(self, now=None, force=False):
+        """
+        Ends all expired windows (all windows if force is set) and returns
+        their summary events.
+        """
+        if now is None:
+            now = time.time()
+        events = []
+
+        self._lock.acquire()
+        try:
+            expired = [name for name, entry in self._entries.iteritems() if force or entry['expires'] <= now]
+            for name in expired:
+                self._summarize(self._entries.pop(name), events)
+            return events
+        finally:
+            self._lock.release()
+
+    def _summarize(self, entry, events):
+        # must be called with the lock held
+        if entry['count'] <= 1:
+            # nothing was coalesced
+            return
+        event = entry['event']
+        summary = TrapEvent(event.name, event.output, event.status, event.handlers, event.received)
+        summary.trap_count = entry['count']
+        summary.trap_first_seen = int(entry['first_seen'])
+        summary.trap_last_seen = int(entry['last_seen'])
+        self._counters['summaries'] += 1
+        log.debug("TrapEventCoalescer: Coalesced %d events: %r" % (entry['count'], event))
+        events.append(summary)
@@ -8,31 +8,114 @@ DEFAULT_CONFIG = {
             "pid_file":     "sensu-trapd.pid",
             "user":         "nobody",
             "group":        "nogroup",
-            "trap_file":    "conf/traps.json"
+            "trap_file":    "conf/traps.json",
+            "trap_dir":     None,
+            "trap_bundle":  None,
+            "trap_match":   "first",
+            "workers":      1,
+            "worker_dispatch": "shared",
+            "worker_stats_interval": 10,
+            "worker_shutdown_timeout": 10,
+            "io_mode":      "threads"
         },
         "dispatcher": {
             "host":             "127.0.0.1",
             "port":             3030,
+            "endpoints":        [],
+            "balance":          "round-robin",
+            "standby":          1,
             "timeout":          5,
             "backoff":          10,
+            "max_backoff":      300,
+            "failure_threshold": 1,
             "check_response":   False,
+            "batch_size":       1,
+            "batch_linger":     0,
+            "max_queue":        10000,
+            "overflow":         "drop-oldest",
+            "spool_dir":        None,
+            "spool_segment_size": 16777216,
+            "drain_timeout":    5,
             "events_log":       "sensu-trapd-events.log"
         },
+        "async_log": {
+            "events":       True,
+            "main":         False,
+            "queue_size":   10000,
+            "batch_size":   256,
+            "flush_interval": 0.5
+        },
+        "coalesce": {
+            "window":       0,
+            "max_entries":  10000
+        },
+        "rate_limit": {
+            "enabled":      False,
+            "rate":         100,
+            "burst":        200,
+            "per_trap":     False,
+            "max_sources":  10000,
+            "summary_interval": 60,
+            "summary_name": "sensu-trapd-rate-limit",
+            "summary_handlers": ["default"],
+            "summary_severity": "WARNING"
+        },
+        "reload": {
+            "event_name":     "sensu-trapd-reload",
+            "event_handlers": ["default"],
+            "event_severity": "WARNING"
+        },
+        "stats": {
+            "enabled":      False,
+            "listen_address": "127.0.0.1",
+            "listen_port":  1621,
+            "metrics_interval": 0,
+            "metrics_name": "sensu-trapd-metrics",
+            "metrics_handlers": ["metrics"],
+            "metrics_prefix": None
+        },
+        "resolver": {
+            "enabled":      True,
+            "threads":      4,
+            "max_pending":  256,
+            "timeout":      0.25,
+            "ttl":          3600,
+            "negative_ttl": 300,
+            "cache_size":   10000,
+            "hosts_file":   None
+        },
         "mibs": {
             "paths": [],
-            "mibs":  []
+            "mibs":  [],
+            "cache_size": 10000,
+            "table": None
         },
         "snmp": {
             "transport": {
                 "listen_address":   "127.0.0.1",
                 "listen_port":      1610,
+                "listen":           [],
                 "udp": {
-                    "enabled": True
+                    "enabled":          True,
+                    "rcvbuf":           None,
+                    "stats_interval":   10
                 },
                 "tcp": {
-                    "enabled": False
+                    "enabled":          False,
+                    "max_connections":  1024,
+                    "idle_timeout":     300,
+                    "max_message_size": 65535
                 }
             },
+            "fast_path": {
+                "enabled": False
+            },
+            "capture": {
+                "enabled":  False,
+                "path":     "sensu-trapd.capture",
+                "max_size": 67108864,
+                "max_files": 4
+            },
             "auth": {
                 "version2": {
                     "enabled": False,
@@ -2,144 +2,652 @@ import os
 import sys
 import threading
 import socket
+import select
 import time
+import random
 from collections import deque
 
 from sensu.snmp.log import log
 from sensu.snmp.log import events_log
+from sensu.snmp.spool import EventSpool
+from sensu.snmp.metrics import metrics
+
+def parse_endpoints(dispatcher_config):
+    """
+    Returns the (host, port) tuples of the Sensu endpoints in the dispatcher
+    config.
+    """
+    endpoints = []
+    for endpoint in dispatcher_config['endpoints']:
+        if isinstance(endpoint, dict):
+            endpoints.append((endpoint['host'], int(endpoint['port'])))
+        else:
+            host, port = str(endpoint).rsplit(':', 1)
+            endpoints.append((host, int(port)))
+    if not endpoints:
+        endpoints.append((dispatcher_config['host'], int(dispatcher_config['port'])))
+    return endpoints
 
 class TrapEventDispatcherThread(threading.Thread):
 
+    OVERFLOW_DROP_OLDEST = 'drop-oldest'
+    OVERFLOW_DROP_NEWEST = 'drop-newest'
+    OVERFLOW_SPOOL = 'spool'
+    OVERFLOW_BLOCK = 'block'
+    OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_SPOOL, OVERFLOW_BLOCK)
+
     def __init__(self, config):
         # Initialize threading.Thread
         threading.Thread.__init__(self, name=self.__class__.__name__)
         # Initialize TrapEventDispatcher
         self._config = config
         self._trap_event_dispatcher = TrapEventDispatcher(config)
-        self._run = False
+        # cleared by stop(), which may be called before the thread ran
+        self._run = True
+        self._drain_until = 0
         self._events = deque()
+        self._events_condition = threading.Condition()
+        self._backoff_until = 0
+        self._batch_size = max(1, int(self._config['dispatcher']['batch_size']))
+        self._batch_linger = float(self._config['dispatcher']['batch_linger'])
+
+        # Configure queue bound and overflow policy
+        self._max_queue = int(self._config['dispatcher']['max_queue'])
+        self._overflow = self._config['dispatcher']['overflow']
+        if self._overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("Unknown dispatcher overflow policy: %s" % (self._overflow))
+        self._counters = dict((name, 0) for name in ('enqueued', 'dispatched', 'dropped_oldest',
+                                                     'dropped_newest', 'spooled', 'replayed', 'blocked'))
+
+        # Configure spool
+        self._spool = None
+        self._spooling = False
+        if self._config['dispatcher']['spool_dir']:
+            self._spool = EventSpool(self._config['dispatcher']['spool_dir'],
+                                     self._config['dispatcher']['spool_segment_size'])
+            # replay events left in the spool
+            self._spooling = not self._spool.is_empty()
+        elif self._overflow == self.OVERFLOW_SPOOL:
+            raise ValueError("The spool overflow policy requires dispatcher.spool_dir to be set")
+
+    def stats(self):
+        self._events_condition.acquire()
+        try:
+            stats = dict(self._counters)
+            stats['queued'] = len(self._events)
+            stats['spooling'] = self._spooling
+            stats['endpoints'] = self._trap_event_dispatcher.stats()
+            return stats
+        finally:
+            self._events_condition.release()
 
     def dispatch(self, event):
         # Log Event
         events_log.info(event.to_json())
-        # Enqueue TrapEvent
-        self._events.append(event)
+        # Enqueue TrapEvent and wake up the dispatcher
+        self._events_condition.acquire()
+        try:
+            self._enqueue(event)
+            self._events_condition.notifyAll()
+        finally:
+            self._events_condition.release()
         log.debug("TrapEventDispatcherThread: Enqueued Event: %r" % (event))
         return True
 
+    def _enqueue(self, event):
+        # must be called with the events condition held
+        self._counters['enqueued'] += 1
+
+        if self._spooling:
+            # keep events in order while there is a backlog in the spool
+            self._spool.append(event)
+            self._counters['spooled'] += 1
+            return
+
+        if self._max_queue > 0 and len(self._events) >= self._max_queue:
+            if self._overflow == self.OVERFLOW_DROP_OLDEST:
+                # events replayed from the spool are only gone from it once
+                # a later event is acknowledged, so they are never dropped
+                for index, (dropped, position) in enumerate(self._events):
+                    if position is None:
+                        del self._events[index]
+                        self._counters['dropped_oldest'] += 1
+                        log.warning("TrapEventDispatcherThread: Queue full. Dropped oldest event: %r" % (dropped))
+                        break
+                else:
+                    self._counters['dropped_newest'] += 1
+                    log.warning("TrapEventDispatcherThread: Queue full of spooled events. Dropped event: %r" % (event))
+                    return
+            elif self._overflow == self.OVERFLOW_DROP_NEWEST:
+                self._counters['dropped_newest'] += 1
+                log.warning("TrapEventDispatcherThread: Queue full. Dropped event: %r" % (event))
+                return
+            elif self._overflow == self.OVERFLOW_SPOOL:
+                self._spool.append(event)
+                self._spooling = True
+                self._counters['spooled'] += 1
+                return
+            elif self._overflow == self.OVERFLOW_BLOCK:
+                # block the caller until the dispatcher has made room
+                self._counters['blocked'] += 1
+                while self._run and len(self._events) >= self._max_queue:
+                    self._events_condition.wait(1)
+
+        self._events.append((event, None))
+
+    def _load_spool(self):
+        # must be called with the events condition held
+        room = self._max_queue - len(self._events) if self._max_queue > 0 else self._batch_size
+        if room <= 0:
+            return
+        entries = self._spool.read(max(room, self._batch_size))
+        self._events.extend(entries)
+        self._counters['replayed'] += len(entries)
+        if not entries:
+            self._spooling = False
+
     def stop(self):
-        self._run = False
-        self._trap_event_dispatcher._close()
+        self._events_condition.acquire()
+        try:
+            self._run = False
+            self._drain_until = time.time() + float(self._config['dispatcher']['drain_timeout'])
+            self._events_condition.notifyAll()
+        finally:
+            self._events_condition.release()
+
+    def _next_events(self):
+        """
+        Blocks until events can be dispatched and returns a batch of up to
+        batch_size (event, spool position) tuples. Returns None once the
+        thread has been stopped and the queue was drained (or the drain
+        deadline has passed).
+        """
+        self._events_condition.acquire()
+        try:
+            while True:
+                if not self._run:
+                    # draining. don't wait for backoffs or more events
+                    if not self._events or self._backoff_until > time.time() or time.time() >= self._drain_until:
+                        return None
+                    return self._pop_events()
+
+                if self._spooling and len(self._events) < self._batch_size:
+                    self._load_spool()
+
+                backoff = self._backoff_until - time.time()
+                if backoff > 0:
+                    # backing off. wait until the backoff timer expires
+                    self._events_condition.wait(backoff)
+                elif self._events:
+                    # linger for more events to fill the batch
+                    if self._batch_linger > 0 and len(self._events) < self._batch_size:
+                        deadline = time.time() + self._batch_linger
+                        while self._run and len(self._events) < self._batch_size:
+                            linger = deadline - time.time()
+                            if linger <= 0:
+                                break
+                            self._events_condition.wait(linger)
+
+                    return self._pop_events()
+                else:
+                    # wait for dispatch() to enqueue an event
+                    self._events_condition.wait()
+        finally:
+            self._events_condition.release()
+
+    def _pop_events(self):
+        # must be called with the events condition held
+        entries = []
+        while self._events and len(entries) < self._batch_size:
+            entries.append(self._events.popleft())
+        # wake up blocked producers
+        self._events_condition.notifyAll()
+        return entries
+
+    def _dispatched(self, entries):
+        # must be called with the events condition held
+        self._counters['dispatched'] += len(entries)
+        positions = [position for event, position in entries if position is not None]
+        if positions:
+            self._spool.acknowledge(positions[-1])
+
+    def _persist(self):
+        # spool events which could not be dispatched before shutting down
+        self._events_condition.acquire()
+        try:
+            if self._spool is None:
+                if self._events:
+                    log.warning("TrapEventDispatcherThread: Discarding %d undispatched events" % (len(self._events)))
+                return
+            count = 0
+            for event, position in self._events:
+                # events read from the spool are still in there
+                if position is None:
+                    self._spool.append(event)
+                    count += 1
+            self._events.clear()
+            self._spool.close()
+            log.info("TrapEventDispatcherThread: Spooled %d undispatched events" % (count))
+        finally:
+            self._events_condition.release()
 
     def run(self):
         log.debug("%s: Started" % (self.name))
-        self._run = True
-        backoff = 0
-        while self._run:
-            if backoff <= 0:
-                try:
-                    # pop event off queue
-                    event = self._events.popleft()
+        while True:
+            # pop events off queue
+            entries = self._next_events()
+            if entries is None:
+                break
+
+            # attempt to dispatch events
+            dispatched = self._trap_event_dispatcher.dispatch_batch([event for event, position in entries])
 
-                    # attempt to dispatch event
-                    if not self._trap_event_dispatcher.dispatch(event):
-                        # dispatch failed. put the event back on the queue
-                        self._events.appendleft(event)
+            self._events_condition.acquire()
+            try:
+                self._dispatched(entries[:dispatched])
+                if dispatched < len(entries):
+                    # dispatch failed. put the remaining events back on the queue and back off
+                    backoff = self._trap_event_dispatcher.retry_delay()
+                    self._events.extendleft(reversed(entries[dispatched:]))
+                    self._backoff_until = time.time() + backoff
+                    log.debug("TrapDispatcherThread: back off for %.1f seconds" % (backoff))
+            finally:
+                self._events_condition.release()
 
-                        # back off
-                        backoff = int(self._config['dispatcher']['backoff'])
+        self._persist()
+        self._trap_event_dispatcher.close()
+        log.debug("%s: Exiting" % (self.name))
 
-                        log.debug("TrapDispatcherThread: back off for %d seconds" % (backoff))
+class SensuResponseReader(object):
+    """
+    Buffered reader for the responses of a Sensu client socket.
 
-                except IndexError:
-                    # Nothing in queue
-                    pass
+    Responses are framed by newlines. The Sensu client itself answers "ok"
+    without a trailing newline, so consecutive "ok"s are split up as well.
+    Waiting for data is done with poll() (or select() where poll() is not
+    available) against a sub-second deadline.
+    """
 
+    ACK = "ok"
+    READ_SIZE = 4096
+
+    def __init__(self, sock):
+        self._socket = sock
+        self._buffer = ""
+        self._responses = []
+        if hasattr(select, 'poll'):
+            self._poller = select.poll()
+            self._poller.register(self._socket.fileno(), select.POLLIN | select.POLLPRI)
+        else:
+            self._poller = None
+
+    def _wait_readable(self, timeout):
+        if self._poller is not None:
+            return bool(self._poller.poll(timeout * 1000))
+        readable, writable, exceptional = select.select([self._socket], [], [], timeout)
+        return bool(readable)
+
+    def _parse(self):
+        # move all complete responses from the buffer to the response list
+        while self._buffer:
+            data = self._buffer.lstrip()
+            if data.startswith(self.ACK):
+                self._responses.append(self.ACK)
+                self._buffer = data[len(self.ACK):]
+                continue
+
+            line_end = data.find("\n")
+            if line_end >= 0:
+                self._responses.append(data[:line_end].strip())
+                self._buffer = data[line_end + 1:]
+            elif data and not self.ACK.startswith(data):
+                # unterminated error response
+                self._responses.append(data.strip())
+                self._buffer = ""
             else:
-                backoff = backoff - 1
+                # wait for the rest of the response
+                self._buffer = data
+                break
 
-            time.sleep(1)
+    def _complete(self, count):
+        # either count responses were read or an error response was
+        for response in self._responses[:count]:
+            if response != self.ACK:
+                return True
+        return len(self._responses) >= count
 
-        log.debug("%s: Exiting" % (self.name))
+    def feed(self, data):
+        """
+        Adds data read from the socket elsewhere (by an event loop) and
+        returns all complete responses.
+        """
+        self._buffer += data
+        self._parse()
+        responses = self._responses
+        self._responses = []
+        return responses
 
-class TrapEventDispatcher(object):
-    def __init__(self, config):
+    def read(self, count, timeout):
+        """
+        Reads up to count responses, waiting at most timeout seconds. Stops
+        at the first response that isn't an acknowledgement. Responses beyond
+        count are kept for the next read.
+        """
+        deadline = time.time() + timeout
+        self._parse()
+        while not self._complete(count):
+            remaining = deadline - time.time()
+            if remaining <= 0 or not self._wait_readable(remaining):
+                break
+            data = self._socket.recv(self.READ_SIZE)
+            if not data:
+                # connection closed
+                break
+            self._buffer += data
+            self._parse()
+
+        responses = self._responses[:count]
+        self._responses = self._responses[count:]
+        return responses
+
+
+class SensuEndpoint(object):
+    """
+    A persistent connection to a single Sensu client socket, along with its
+    circuit breaker state and statistics.
+
+    After failure_threshold consecutive failures the circuit opens and the
+    endpoint is not used until its backoff expires. The backoff doubles with
+    every further failure (up to max_backoff) and is jittered. Once the
+    backoff expired the endpoint is tried again (half-open) and a single
+    successful dispatch closes the circuit.
+    """
+
+    STATE_CLOSED = 'closed'
+    STATE_OPEN = 'open'
+    STATE_HALF_OPEN = 'half-open'
+
+    def __init__(self, host, port, config):
         self._config = config
-        self._remote_host = self._config['dispatcher']['host']
-        self._remote_port = int(self._config['dispatcher']['port'])
-        self._socket_timeout = int(self._config['dispatcher']['timeout'])
+        self._remote_host = host
+        self._remote_port = int(port)
+        self._socket_timeout = float(self._config['dispatcher']['timeout'])
+        self._backoff = float(self._config['dispatcher']['backoff'])
+        self._max_backoff = float(self._config['dispatcher']['max_backoff'])
+        self._failure_threshold = max(1, int(self._config['dispatcher']['failure_threshold']))
         self._socket = None
+        self._reader = None
 
-        # Connect to Sensu
-        self._connect()
-        log.debug("TrapEventDispatcher: Initialized")
+        # circuit breaker
+        self.failures = 0
+        self.retry_at = 0
+        self.outstanding = 0
 
-    def _connect(self):
-        log.debug("TrapEventDispatcher: Connecting to %s:%d" % (self._remote_host, self._remote_port))
+        # statistics
+        self._stats = dict((name, 0) for name in ('dispatched', 'errors', 'connects', 'connect_errors'))
+        self._latency = None
+        self._last_latency = None
+        self._ack_latency = metrics.histogram('dispatcher.ack_latency')
+        self._trap_latency = metrics.histogram('dispatcher.trap_latency')
+
+    def __repr__(self):
+        return "<SensuEndpoint %s:%d >" % (self._remote_host, self._remote_port)
+
+    @property
+    def name(self):
+        return "%s:%d" % (self._remote_host, self._remote_port)
+
+    def connected(self):
+        return self._socket is not None
+
+    def state(self, now=None):
+        if now is None:
+            now = time.time()
+        if self.failures < self._failure_threshold:
+            return self.STATE_CLOSED
+        if now < self.retry_at:
+            return self.STATE_OPEN
+        return self.STATE_HALF_OPEN
+
+    def available(self, now=None):
+        return self.state(now) != self.STATE_OPEN
+
+    def latency(self):
+        return self._latency
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['state'] = self.state()
+        stats['connected'] = self.connected()
+        stats['failures'] = self.failures
+        stats['latency'] = self._latency
+        stats['last_latency'] = self._last_latency
+        return stats
+
+    def _record_success(self, latency):
+        self.failures = 0
+        self.retry_at = 0
+        self._last_latency = latency
+        if self._latency is None:
+            self._latency = latency
+        else:
+            # exponentially weighted moving average
+            self._latency = 0.8 * self._latency + 0.2 * latency
+
+    def _record_failure(self):
+        self.failures += 1
+        if self.failures >= self._failure_threshold:
+            backoff = min(self._max_backoff, self._backoff * (2 ** (self.failures - self._failure_threshold)))
+            # jitter the backoff so endpoints don't retry in lockstep
+            backoff = backoff * random.uniform(0.5, 1.0)
+            self.retry_at = time.time() + backoff
+            log.warning("SensuEndpoint: %s failed %d time(s). Backing off for %.1f seconds" % (self.name, self.failures, backoff))
+
+    def connect(self):
+        log.debug("SensuEndpoint: Connecting to %s:%d" % (self._remote_host, self._remote_port))
         # create socket
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         if self._socket is None:
             # log Error
-            log.error("TrapEventDispatcher: Unable to create socket")
+            log.error("SensuEndpoint: Unable to create socket")
             # close Socket
-            self._close()
-            return
+            self.close()
+            return False
 
         # set socket timeout
         self._socket.settimeout(self._socket_timeout)
 
-        # connect to graphite server
+        # connect to sensu client
         try:
             self._socket.connect((self._remote_host, self._remote_port))
+            self._reader = SensuResponseReader(self._socket)
+            self._stats['connects'] += 1
             # Log
-            log.debug("TrapEventDispatcher: Established connection to %s:%d" % (self._remote_host, self._remote_port))
+            log.debug("SensuEndpoint: Established connection to %s:%d" % (self._remote_host, self._remote_port))
+            return True
         except:
             # Log Error
-            log.exception("TrapEventDispatcher: Failed to connect to %s:%d" % (self._remote_host, self._remote_port))
+            log.exception("SensuEndpoint: Failed to connect to %s:%d" % (self._remote_host, self._remote_port))
+            self._stats['connect_errors'] += 1
+            self._record_failure()
             # Close Socket
-            self._close()
-            return
+            self.close()
+            return False
 
-    def _close(self):
+    def close(self):
         if self._socket is not None:
             self._socket.close()
         self._socket = None
+        self._reader = None
 
-    def dispatch(self, event):
-        # TODO: send event!
-        log.debug("TrapEventDispatcher: Dispatching TrapEvent: %r" % (event))
+    def dispatch_batch(self, events):
+        """
+        Sends a batch of events with a single write. When check_response is
+        enabled the acknowledgements are read after the whole batch was sent.
+
+        Returns the number of events (from the start of the batch) that were
+        dispatched successfully.
+        """
+        log.debug("SensuEndpoint: Dispatching %d TrapEvents to %s: %r" % (len(events), self.name, events))
         try:
             # try to (re)connect
             if self._socket is None:
-                log.debug("TrapEventDispatcher: Socket is not connected. Reconnecting")
-                self._connect()
-
-            if self._socket is not None:
-                # Send event
-                self._socket.sendall(event.to_json())
-
-                if self._config['dispatcher']['check_response']:
-                    # Receive event confirmation
-                    self._socket.setblocking(0)
-                    timer = int(time.time())
-                    data = ""
-                    while (int(time.time()) - timer) < self._socket_timeout:
-                        try:
-                            data = self._socket.recv(512)
-                            break
-                        except socket.error, e:
-                            pass
-                    self._socket.setblocking(1)
-                    if len(data) <= 0 or data.strip() != "ok":
-                        log.error("TrapEventDispatcher: Error dispatching event. Response was: %s" % (data))
-                        return False
-
-                # TODO: send event!
-                log.info("TrapEventDispatcher: Dispatched TrapEvent: %r" % (event))
+                log.debug("SensuEndpoint: Socket is not connected. Reconnecting")
+                if not self.connect():
+                    return 0
 
-                return True
+            start = time.time()
+            self.outstanding = len(events)
+
+            # Send events
+            self._socket.sendall("\n".join([event.to_json() for event in events]))
+
+            if self._config['dispatcher']['check_response']:
+                # Match the responses to the events in order
+                responses = self._reader.read(len(events), self._socket_timeout)
+                dispatched = 0
+                for response in responses[:len(events)]:
+                    if response != "ok":
+                        break
+                    dispatched += 1
+                if dispatched < len(events):
+                    log.error("SensuEndpoint: Error dispatching event to %s. Response was: %s" % (self.name, ' '.join(responses[dispatched:])))
+                    # outstanding responses can't be matched to events anymore
+                    self.close()
+                    self._stats['errors'] += 1
+                    self._stats['dispatched'] += dispatched
+                    self._record_failure()
+                    for event in events[:dispatched]:
+                        log.info("SensuEndpoint: Dispatched TrapEvent: %r" % (event))
+                    return dispatched
+
+            self._stats['dispatched'] += len(events)
+            now = time.time()
+            self._record_success(now - start)
+            self._ack_latency.observe(now - start)
+            for event in events:
+                if event.received is not None:
+                    self._trap_latency.observe(now - event.received)
+                log.info("SensuEndpoint: Dispatched TrapEvent: %r" % (event))
+
+            return len(events)
 
         except:
-            self._close()
-            log.exception("TrapEventDispatcher: Error dispatching event")
-        return False
+            self.close()
+            self._stats['errors'] += 1
+            self._record_failure()
+            log.exception("SensuEndpoint: Error dispatching event to %s" % (self.name))
+        finally:
+            self.outstanding = 0
+        return 0
+
+
+class TrapEventDispatcher(object):
+    """
+    Dispatches events to a pool of Sensu client endpoints.
+
+    Endpoints are selected round-robin, by the least outstanding
+    acknowledgements (ties broken by average latency) or in configured order
+    (failover). If an endpoint fails the rest of the batch is retried on the
+    next available endpoint right away. Up to "standby" endpoints beyond the
+    one in use are kept connected so a failover doesn't have to wait for a
+    new connection.
+    """
+
+    BALANCE_ROUND_ROBIN = 'round-robin'
+    BALANCE_LEAST_OUTSTANDING = 'least-outstanding'
+    BALANCE_FAILOVER = 'failover'
+    BALANCE_POLICIES = (BALANCE_ROUND_ROBIN, BALANCE_LEAST_OUTSTANDING, BALANCE_FAILOVER)
+
+    def __init__(self, config):
+        self._config = config
+        self._balance = self._config['dispatcher']['balance']
+        if self._balance not in self.BALANCE_POLICIES:
+            raise ValueError("Unknown dispatcher balance policy: %s" % (self._balance))
+        self._standby = int(self._config['dispatcher']['standby'])
+        self._next_endpoint = 0
+
+        # Configure endpoints
+        self._endpoints = []
+        for host, port in parse_endpoints(self._config['dispatcher']):
+            self._endpoints.append(SensuEndpoint(host, port, config))
+
+        # Connect to Sensu
+        self._maintain_connections()
+        log.debug("TrapEventDispatcher: Initialized with endpoints: %s" % (', '.join([e.name for e in self._endpoints])))
+
+    def stats(self):
+        return dict((endpoint.name, endpoint.stats()) for endpoint in self._endpoints)
+
+    def retry_delay(self):
+        """
+        Seconds until the next endpoint becomes available again.
+        """
+        now = time.time()
+        return max(0, min([endpoint.retry_at for endpoint in self._endpoints]) - now)
+
+    def _select(self, now, exclude):
+        candidates = [endpoint for endpoint in self._endpoints
+                      if endpoint not in exclude and endpoint.available(now)]
+        if not candidates:
+            return None
+
+        if self._balance == self.BALANCE_ROUND_ROBIN:
+            # start searching after the previously used endpoint
+            for i in range(len(self._endpoints)):
+                endpoint = self._endpoints[(self._next_endpoint + i) % len(self._endpoints)]
+                if endpoint in candidates:
+                    self._next_endpoint = (self._endpoints.index(endpoint) + 1) % len(self._endpoints)
+                    return endpoint
+
+        if self._balance == self.BALANCE_LEAST_OUTSTANDING:
+            def load(endpoint):
+                latency = endpoint.latency()
+                return (endpoint.outstanding, latency is None and 0 or latency)
+            return min(candidates, key=load)
+
+        # failover. prefer connected endpoints in configured order
+        for endpoint in candidates:
+            if endpoint.connected():
+                return endpoint
+        return candidates[0]
+
+    def _maintain_connections(self):
+        # keep the active endpoint and the standby endpoints connected
+        wanted = 1 + self._standby
+        if self._balance != self.BALANCE_FAILOVER:
+            wanted = len(self._endpoints)
+        now = time.time()
+        connected = len([endpoint for endpoint in self._endpoints if endpoint.connected()])
+        for endpoint in self._endpoints:
+            if connected >= wanted:
+                break
+            if not endpoint.connected() and endpoint.available(now):
+                if endpoint.connect():
+                    connected += 1
+
+    def close(self):
+        for endpoint in self._endpoints:
+            endpoint.close()
+
+    def dispatch(self, event):
+        return self.dispatch_batch([event]) == 1
+
+    def dispatch_batch(self, events):
+        """
+        Dispatches a batch of events, failing over to other endpoints if
+        necessary. Returns the number of events (from the start of the batch)
+        that were dispatched successfully.
+        """
+        dispatched = 0
+        tried = []
+        while dispatched < len(events):
+            endpoint = self._select(time.time(), tried)
+            if endpoint is None:
+                log.error("TrapEventDispatcher: No Sensu endpoint available")
+                break
+            tried.append(endpoint)
+            dispatched += endpoint.dispatch_batch(events[dispatched:])
+
+        self._maintain_connections()
+        return dispatched
@@ -1,21 +1,87 @@
-import json
+import simplejson as json
+from simplejson.encoder import encode_basestring_ascii
+
+# handler lists (and their encoding) are shared by all events with the same
+# handlers
+_handlers = dict()
+
+def _intern_handlers(handlers):
+    # returns the shared tuple of handlers and its encoding
+    handlers = tuple(handlers)
+    interned = _handlers.get(handlers)
+    if interned is None:
+        interned = _handlers.setdefault(handlers, (handlers, json.dumps(handlers)))
+    return interned
+
+def intern_handlers(handlers):
+    return _intern_handlers(handlers)[0]
 
 
 class TrapEvent(object):
+    """
+    A Sensu check result for a trap.
+
+    The JSON encoding is built once, on first use, and reused for the events
+    log, for sending and for every retry. Events must therefore not be
+    changed once they were dispatched.
+    """
+
+    __slots__ = ('name', 'output', 'status', 'handlers', 'received',
+                 'trap_count', 'trap_first_seen', 'trap_last_seen', 'type', '_json')
 
     EVENT_SEVERITY = {"CRITICAL": 2, "WARNING": 1, "OK": 0}
 
-    def __init__(self, name, output, status, handlers):
+    def __init__(self, name, output, status, handlers, received=None):
         self.name = name
         self.output = output
         self.status = status
-        self.handlers = handlers
+        self.handlers = intern_handlers(handlers)
+        # when the trap for this event was received (not sent to Sensu)
+        self.received = received
+        # set on the summaries of coalesced events
+        self.trap_count = None
+        self.trap_first_seen = None
+        self.trap_last_seen = None
+        # "metric" for metric check results
+        self.type = None
+        self._json = None
+
+    def __getstate__(self):
+        # the encoding is pickled along, so it isn't built again after
+        # being passed to another process
+        return tuple([getattr(self, slot) for slot in self.__slots__])
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+        self.handlers = intern_handlers(self.handlers)
 
     def to_json(self):
-        return json.dumps({'name': self.name,
-                           'output': self.output,
-                           'status': self.status,
-                           'handlers': self.handlers})
+        if self._json is None:
+            # the strings are escaped by the C speedups of simplejson
+            data = '{"name": %s, "output": %s, "status": %s, "handlers": %s' % (
+                encode_basestring_ascii(self.name),
+                encode_basestring_ascii(self.output),
+                'null' if self.status is None else int(self.status),
+                _intern_handlers(self.handlers)[1])
+            if self.trap_count is not None:
+                data += ', "trap_count": %d, "trap_first_seen": %d, "trap_last_seen": %d' % (
+                    self.trap_count, self.trap_first_seen, self.trap_last_seen)
+            if self.type is not None:
+                data += ', "type": %s' % (encode_basestring_ascii(self.type))
+            self._json = data + '}'
+        return self._json
+
+    @classmethod
+    def from_json(cls, data):
+        event = json.loads(data)
+        trap_event = cls(event['name'], event['output'], event['status'], event['handlers'])
+        if 'trap_count' in event:
+            trap_event.trap_count = event['trap_count']
+            trap_event.trap_first_seen = event['trap_first_seen']
+            trap_event.trap_last_seen = event['trap_last_seen']
+        trap_event.type = event.get('type')
+        return trap_event
 
     def __repr__(self):
         return "<TrapEvent name:'%s' >" % (self.name)
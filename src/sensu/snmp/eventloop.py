@@ -0,0 +1,281 @@
+import os
+import sys
+import time
+import socket
+import asyncore
+import random
+from collections import deque
+
+from sensu.snmp.log import log
+from sensu.snmp.log import events_log
+from sensu.snmp.metrics import metrics
+from sensu.snmp.dispatcher import SensuResponseReader
+from sensu.snmp.dispatcher import parse_endpoints
+
+class SensuEventChannel(asyncore.dispatcher):
+    """
+    Non-blocking connection to a Sensu client socket. The channel is polled
+    by the event loop of the trap receiver and reports back to its
+    TrapEventLoopDispatcher.
+    """
+
+    READ_SIZE = 4096
+
+    def __init__(self, dispatcher, host, port, sock_map):
+        asyncore.dispatcher.__init__(self, map=sock_map)
+        self.name = "%s:%d" % (host, port)
+        self.created = time.time()
+        self.buffer = ""
+        self._dispatcher = dispatcher
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._reader = SensuResponseReader(self.socket)
+
+    def writable(self):
+        # wait for the connection to be established or for data to send
+        return not self.connected or len(self.buffer) > 0
+
+    def handle_connect(self):
+        # asyncore only marks the channel connected after this returns
+        self.connected = True
+        self._dispatcher._channel_connected(self)
+
+    def handle_write(self):
+        sent = self.send(self.buffer)
+        if sent:
+            self.buffer = self.buffer[sent:]
+            self._dispatcher._channel_sent(self, sent)
+
+    def handle_read(self):
+        data = self.recv(self.READ_SIZE)
+        if data:
+            self._dispatcher._channel_responses(self, self._reader.feed(data))
+
+    def handle_close(self):
+        connected = self.connected
+        self.close()
+        self._dispatcher._channel_closed(self, connected)
+
+    def handle_error(self):
+        log.exception("SensuEventChannel: Error on connection to %s" % (self.name))
+        self.handle_close()
+
+
+class TrapEventLoopDispatcher(object):
+    """
+    Dispatches events to Sensu from the event loop of the trap receiver.
+
+    Events are written to a non-blocking connection and acknowledgements are
+    read as they arrive, so handling a trap never waits on Sensu. Endpoints
+    are used in the configured order; after a failure the next endpoint is
+    tried once the backoff expired. Events that were not acknowledged when a
+    connection is lost are sent again.
+    """
+
+    OVERFLOW_DROP_OLDEST = 'drop-oldest'
+    OVERFLOW_DROP_NEWEST = 'drop-newest'
+    OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+    # don't buffer more than this many bytes in the channel at once
+    WRITE_BUFFER_SIZE = 65536
+    DRAIN_INTERVAL = 0.1
+
+    def __init__(self, config, transport_dispatcher):
+        self._config = config
+        self._sock_map = transport_dispatcher.getSocketMap()
+        self._endpoints = parse_endpoints(self._config['dispatcher'])
+        self._endpoint = 0
+        self._timeout = float(self._config['dispatcher']['timeout'])
+        self._check_response = bool(self._config['dispatcher']['check_response'])
+        self._backoff = float(self._config['dispatcher']['backoff'])
+        self._max_backoff = float(self._config['dispatcher']['max_backoff'])
+        self._max_queue = int(self._config['dispatcher']['max_queue'])
+        self._overflow = self._config['dispatcher']['overflow']
+        if self._overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("Overflow policy not supported by the event loop: %s" % (self._overflow))
+
+        # (event, received) tuples waiting to be written
+        self._events = deque()
+        # (event, received, end offset, sent) tuples waiting to be acknowledged
+        self._sent = deque()
+        self._channel = None
+        self._written = 0
+        self._flushed = 0
+        self._failures = 0
+        self._retry_at = 0
+        self._drain_until = None
+        self._counters = dict((name, 0) for name in ('enqueued', 'dispatched', 'dropped_oldest',
+                                                     'dropped_newest', 'errors', 'connects'))
+        self._latency = None
+        self._last_latency = None
+        self._max_latency = None
+        self._ack_latency = metrics.histogram('dispatcher.ack_latency')
+        self._trap_latency = metrics.histogram('dispatcher.trap_latency')
+
+        # the timer of the transport dispatcher drives reconnects and timeouts
+        transport_dispatcher.registerTimerCbFun(self._tick)
+        self._connect()
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats['queued'] = len(self._events)
+        stats['outstanding'] = len(self._sent)
+        stats['connected'] = self._channel is not None and self._channel.connected
+        stats['endpoint'] = "%s:%d" % self._endpoints[self._endpoint]
+        stats['latency'] = self._latency
+        stats['last_latency'] = self._last_latency
+        stats['max_latency'] = self._max_latency
+        return stats
+
+    def dispatch(self, event):
+        # Log Event
+        events_log.info(event.to_json())
+        self._counters['enqueued'] += 1
+
+        if self._max_queue > 0 and len(self._events) + len(self._sent) >= self._max_queue:
+            if self._overflow == self.OVERFLOW_DROP_NEWEST or not self._events:
+                self._counters['dropped_newest'] += 1
+                log.warning("TrapEventLoopDispatcher: Queue full. Dropped event: %r" % (event))
+                return True
+            dropped, received = self._events.popleft()
+            self._counters['dropped_oldest'] += 1
+            log.warning("TrapEventLoopDispatcher: Queue full. Dropped oldest event: %r" % (dropped))
+
+        self._events.append((event, event.received or time.time()))
+        self._flush()
+        return True
+
+    def stop(self):
+        self._drain_until = time.time() + float(self._config['dispatcher']['drain_timeout'])
+
+    def drain(self):
+        """
+        Runs the event loop for the Sensu connection until all events were
+        dispatched or the drain timeout expired. Called once the trap
+        receiver stopped.
+        """
+        if self._drain_until is None:
+            self.stop()
+        while (self._events or self._sent) and time.time() < self._drain_until:
+            asyncore.poll(self.DRAIN_INTERVAL, self._sock_map)
+            self._tick(time.time())
+
+        if self._events or self._sent:
+            log.warning("TrapEventLoopDispatcher: Dropped %d undispatched events" % (len(self._events) + len(self._sent)))
+        if self._channel is not None:
+            self._channel.close()
+            self._channel = None
+
+    def _connect(self):
+        host, port = self._endpoints[self._endpoint]
+        log.debug("TrapEventLoopDispatcher: Connecting to %s:%d" % (host, port))
+        self._channel = SensuEventChannel(self, host, port, self._sock_map)
+        self._written = 0
+        self._flushed = 0
+        try:
+            self._channel.connect((host, port))
+        except socket.error, e:
+            log.error("TrapEventLoopDispatcher: Failed to connect to %s:%d: %s" % (host, port, e))
+            self._channel.handle_close()
+
+    def _tick(self, now):
+        if self._drain_until is not None and now >= self._drain_until:
+            # stopped. give up on the remaining events
+            if self._channel is not None:
+                self._channel.close()
+                self._channel = None
+            return
+
+        if self._channel is None:
+            if now >= self._retry_at:
+                self._connect()
+        elif not self._channel.connected:
+            if now - self._channel.created > self._timeout:
+                log.error("TrapEventLoopDispatcher: Timed out connecting to %s" % (self._channel.name))
+                self._channel.handle_close()
+        elif self._check_response and self._sent and now - self._sent[0][3] > self._timeout:
+            log.error("TrapEventLoopDispatcher: Timed out waiting for a response from %s" % (self._channel.name))
+            self._counters['errors'] += 1
+            self._channel.handle_close()
+
+    def _flush(self):
+        # move queued events into the write buffer of the channel
+        channel = self._channel
+        if channel is None or not channel.connected:
+            return
+        now = time.time()
+        while self._events and len(channel.buffer) < self.WRITE_BUFFER_SIZE:
+            event, received = self._events.popleft()
+            data = event.to_json() + "\n"
+            channel.buffer += data
+            self._written += len(data)
+            self._sent.append((event, received, self._written, now))
+
+    def _complete(self, now):
+        event, received, offset, sent = self._sent.popleft()
+        latency = now - received
+        self._trap_latency.observe(latency)
+        self._ack_latency.observe(now - sent)
+        self._last_latency = latency
+        if self._latency is None:
+            self._latency = latency
+        else:
+            # exponentially weighted moving average
+            self._latency = 0.8 * self._latency + 0.2 * latency
+        if self._max_latency is None or latency > self._max_latency:
+            self._max_latency = latency
+        self._failures = 0
+        self._counters['dispatched'] += 1
+        log.info("TrapEventLoopDispatcher: Dispatched TrapEvent: %r" % (event))
+
+    def _channel_connected(self, channel):
+        log.debug("TrapEventLoopDispatcher: Established connection to %s" % (channel.name))
+        self._counters['connects'] += 1
+        self._flush()
+
+    def _channel_sent(self, channel, count):
+        self._flushed += count
+        if not self._check_response:
+            # without acknowledgements an event is done once it was written
+            now = time.time()
+            while self._sent and self._sent[0][2] <= self._flushed:
+                self._complete(now)
+        self._flush()
+
+    def _channel_responses(self, channel, responses):
+        now = time.time()
+        for response in responses:
+            if not self._sent:
+                log.warning("TrapEventLoopDispatcher: Unexpected response from %s: %s" % (channel.name, response))
+                continue
+            if response != "ok":
+                log.error("TrapEventLoopDispatcher: Error dispatching event to %s. Response was: %s" % (channel.name, response))
+                self._counters['errors'] += 1
+                # outstanding responses can't be matched to events anymore
+                channel.handle_close()
+                return
+            self._complete(now)
+
+    def _channel_closed(self, channel, connected):
+        if channel is not self._channel:
+            return
+        self._channel = None
+        log.debug("TrapEventLoopDispatcher: Connection to %s closed" % (channel.name))
+
+        # send the events that weren't acknowledged again
+        if self._sent:
+            self._events.extendleft(reversed([(event, received) for event, received, offset, sent in self._sent]))
+            self._sent.clear()
+
+        self._failures += 1
+        if connected and self._failures == 1:
+            # reconnect right away after losing a working connection
+            self._retry_at = 0
+            return
+
+        # try the next endpoint after backing off
+        self._endpoint = (self._endpoint + 1) % len(self._endpoints)
+        backoff = min(self._max_backoff, self._backoff * (2 ** (self._failures - 1)))
+        # jitter the backoff so daemons don't retry in lockstep
+        backoff = backoff * random.uniform(0.5, 1.0)
+        self._retry_at = time.time() + backoff
+        log.warning("TrapEventLoopDispatcher: Connecting to %s failed %d time(s). Backing off for %.1f seconds" % (channel.name, self._failures, backoff))
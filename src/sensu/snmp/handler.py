@@ -1,10 +1,18 @@
 from sensu.snmp.event import TrapEvent
 from sensu.snmp.log import log
+from sensu.snmp.template import EventTemplate
+from sensu.snmp.trap import Trap
+from sensu.snmp.predicate import parse_predicates
+from sensu.snmp.predicate import PredicateIndex
 
 
 class TrapHandler(object):
 
-    def __init__(self, trap_type, trap_args, event_name, event_output, event_handlers, event_severity, predicates=None):
+    # Trap arguments which are sent along with every trap (SNMPv2-MIB::sysUpTime.0)
+    # and therefore never have to be mapped by a trap handler
+    IGNORED_TRAP_ARGS = frozenset([(1, 3, 6, 1, 2, 1, 1, 3, 0)])
+
+    def __init__(self, trap_type, trap_args, event_name, event_output, event_handlers, event_severity, predicates=None, priority=0, coalesce_window=None):
         if predicates is None:
             predicates = dict()
 
@@ -15,38 +23,139 @@ class TrapHandler(object):
         self.event_handlers = event_handlers
         self.event_severity = event_severity
         self.predicates = predicates
+        self.priority = priority
+        # compiled predicates, all of them have to hold for a trap to match
+        self._predicates = parse_predicates(predicates, trap_args)
+        # seconds to coalesce repeated events for (None uses the default)
+        self.coalesce_window = coalesce_window
+
+        # precompute the set of trap arguments this handler accepts
+        self._accepted_args = frozenset(self.trap_args.keys()) | self.IGNORED_TRAP_ARGS
+
+        # compile event templates
+        self._event_name_template = EventTemplate(self.event_name)
+        self._event_output_template = EventTemplate(self.event_output)
+        self._compile_substitutions()
+
+    def _compile_substitutions(self):
+        fields = self._event_name_template.fields | self._event_output_template.fields
+
+        # make sure every substitution can be satisfied
+        available = set(['oid']) | set(Trap.PROPERTIES) | set(self.trap_args.values())
+        unknown = fields - available
+        if unknown:
+            raise ValueError("Unknown substitution(s) in event templates: %s" % (', '.join(sorted(unknown))))
+
+        # only the referenced substitutions are built for each trap
+        self._oid_substitution = 'oid' in fields
+        self._property_substitutions = tuple(sorted(fields & set(Trap.PROPERTIES)))
+        self._arg_substitutions = tuple((trap_arg_type_oid, token)
+                                        for trap_arg_type_oid, token in self.trap_args.items()
+                                        if token in fields)
 
     def handles(self, trap):
-        if trap.oid == self.trap_type:
-            for trap_arg in trap.arguments:
-                if str(trap_arg) not in ['1.3.6.1.2.1.1.3.0'] and trap_arg not in self.trap_args.keys():
-                    return False
-            return True
-        return False
+        return (trap.oid == self.trap_type and self.accepts_arguments(trap.arguments) and
+                self.matches_predicates(trap))
+
+    def matches_predicates(self, trap):
+        for predicate in self._predicates:
+            if not predicate.matches(trap):
+                return False
+        return True
+
+    def accepts_arguments(self, trap_args):
+        return self._accepted_args.issuperset(trap_args)
 
     def _build_substitutions(self, trap):
         substitutions = dict()
 
         # add default substitutions
-        substitutions['oid'] = str(trap.oid)
+        if self._oid_substitution:
+            substitutions['oid'] = str(trap.oid)
 
         # build substitution list from trap properties
-        for k, v in trap.properties.items():
-            substitutions[k] = str(v)
+        for k in self._property_substitutions:
+            if k in trap.properties:
+                substitutions[k] = str(trap.properties[k])
 
         # build substitution list from trap arguments
-        for trap_arg_type_oid, token in self.trap_args.items():
+        for trap_arg_type_oid, token in self._arg_substitutions:
             if trap_arg_type_oid in trap.arguments:
                 substitutions[token] = str(trap.arguments[trap_arg_type_oid])
 
         return substitutions
 
-    def _do_substitutions(self, pattern, substitutions):
-        return pattern.format(**substitutions)
-
     def transform(self, trap):
         substitutions = self._build_substitutions(trap)
-        return TrapEvent(self._do_substitutions(self.event_name, substitutions),
-                         self._do_substitutions(self.event_output, substitutions),
+        return TrapEvent(self._event_name_template.render(substitutions),
+                         self._event_output_template.render(substitutions),
                          self.event_severity,
-                         self.event_handlers)
+                         self.event_handlers,
+                         trap.received)
+
+
+class TrapHandlerIndex(object):
+    """
+    Index of trap handlers keyed by trap type OID. Handlers sharing a trap
+    type are kept in priority order (highest priority first, ties broken by
+    trap handler id). The predicates of the handlers of a trap type are
+    compiled into a PredicateIndex, so they aren't tested one handler at a
+    time.
+    """
+
+    MATCH_FIRST = 'first'
+    MATCH_ALL = 'all'
+    MATCH_POLICIES = (MATCH_FIRST, MATCH_ALL)
+
+    def __init__(self, trap_handlers, match_policy=MATCH_FIRST):
+        if match_policy not in self.MATCH_POLICIES:
+            raise ValueError("Unknown trap match policy: %s" % (match_policy))
+        self.match_policy = match_policy
+
+        # build the trap type index
+        self._index = dict()
+        ordered = sorted(trap_handlers.items(), key=lambda item: (-item[1].priority, item[0]))
+        for trap_handler_id, trap_handler in ordered:
+            trap_type = tuple(trap_handler.trap_type)
+            self._index.setdefault(trap_type, []).append((trap_handler_id, trap_handler))
+
+        # trap type -> (positions of the handlers without predicates, PredicateIndex)
+        self._predicate_index = dict()
+        for trap_type, candidates in self._index.items():
+            with_predicates = [(position, trap_handler._predicates)
+                               for position, (trap_handler_id, trap_handler) in enumerate(candidates)
+                               if trap_handler._predicates]
+            if with_predicates:
+                without_predicates = [position for position, (trap_handler_id, trap_handler) in enumerate(candidates)
+                                      if not trap_handler._predicates]
+                self._predicate_index[trap_type] = (without_predicates, PredicateIndex(with_predicates))
+
+        log.debug("TrapHandlerIndex: Indexed %d trap handlers for %d trap types" % (len(trap_handlers), len(self._index)))
+
+    def __len__(self):
+        return len(self._index)
+
+    def match(self, trap):
+        """
+        Returns a list of (trap_handler_id, trap_handler) tuples handling the
+        given trap according to the match policy.
+        """
+        candidates = self._index.get(trap.oid)
+        if not candidates:
+            return []
+
+        predicate_index = self._predicate_index.get(trap.oid)
+        if predicate_index is not None:
+            # only the handlers whose predicates hold, in priority order
+            without_predicates, predicate_index = predicate_index
+            positions = sorted(predicate_index.match(trap).union(without_predicates))
+            candidates = [candidates[position] for position in positions]
+
+        trap_args = frozenset(trap.arguments)
+        matches = []
+        for trap_handler_id, trap_handler in candidates:
+            if trap_handler.accepts_arguments(trap_args):
+                matches.append((trap_handler_id, trap_handler))
+                if self.match_policy == self.MATCH_FIRST:
+                    break
+        return matches
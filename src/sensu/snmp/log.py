@@ -1,6 +1,11 @@
+import os
 import sys
+import time
+import errno
+import Queue
 import logging
 import logging.handlers
+import threading
 
 # the main log
 log = logging.getLogger('sensu-trapd')
@@ -8,6 +13,178 @@ log = logging.getLogger('sensu-trapd')
 # the events log
 events_log = logging.getLogger('sensu-trapd-events')
 
+# formats the tracebacks of queued records for handlers without a formatter
+exception_formatter = logging.Formatter()
+
+class AsyncLogHandler(logging.Handler):
+    """
+    Hands log records to a writer thread, which passes them on to the
+    wrapped handlers. Records are collected until batch_size records are
+    queued or flush_interval seconds passed, and the records of a batch are
+    written to file handlers with a single write and flush. A
+    WatchedFileHandler still reopens its file once it was rotated, but the
+    file is only checked once per batch.
+
+    At most queue_size records are queued. Further records are dropped (and
+    counted) rather than blocking the caller. The writer thread is started on
+    first use in every process, so the handler survives forking.
+    """
+
+    def __init__(self, handlers, queue_size=10000, batch_size=256, flush_interval=0.5):
+        logging.Handler.__init__(self)
+        self.handlers = list(handlers)
+        self.queue_size = int(queue_size)
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def stats(self):
+        return {'queued': self._queue.qsize() if self._queue is not None else 0,
+                'dropped': self.dropped,
+                'written': self.written,
+                'batches': self.batches}
+
+    def _start(self):
+        self.acquire()
+        try:
+            if self._pid == os.getpid():
+                return
+            # a forked process doesn't inherit the writer thread
+            self._queue = Queue.Queue(self.queue_size)
+            self._thread = threading.Thread(target=self._write_records, name=self.__class__.__name__)
+            self._thread.setDaemon(True)
+            self._thread.start()
+            self._pid = os.getpid()
+        finally:
+            self.release()
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            # format the message now, the arguments may change later
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = (self.formatter or exception_formatter).formatException(record.exc_info)
+                record.exc_info = None
+            self._queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _next_batch(self):
+        # wait for a record, then linger until the batch is full
+        try:
+            records = [self._queue.get(True, self.flush_interval)]
+        except Queue.Empty:
+            return []
+        deadline = time.time() + self.flush_interval
+        while len(records) < self.batch_size:
+            timeout = deadline - time.time()
+            try:
+                if timeout <= 0:
+                    records.append(self._queue.get_nowait())
+                else:
+                    records.append(self._queue.get(True, timeout))
+            except Queue.Empty:
+                break
+        return records
+
+    def _write_records(self):
+        while True:
+            records = self._next_batch()
+            if not records:
+                continue
+            # None stops the writer once everything before it was written
+            stop = None in records
+            records = [record for record in records if record is not None]
+            for handler in self.handlers:
+                self._write_batch(handler, records)
+            self.written += len(records)
+            self.batches += 1
+            if stop:
+                break
+
+    def _write_batch(self, handler, records):
+        records = [record for record in records if record.levelno >= handler.level]
+        if not records:
+            return
+        if not isinstance(handler, logging.StreamHandler):
+            for record in records:
+                handler.handle(record)
+            return
+
+        handler.acquire()
+        try:
+            if isinstance(handler, logging.handlers.WatchedFileHandler):
+                self._reopen_rotated(handler)
+            if handler.stream is None:
+                handler.stream = handler._open()
+            lines = []
+            for record in records:
+                line = handler.format(record)
+                if isinstance(line, unicode):
+                    line = line.encode('utf-8')
+                lines.append(line + "\n")
+            handler.stream.write(''.join(lines))
+            handler.flush()
+        except Exception:
+            handler.handleError(records[-1])
+        finally:
+            handler.release()
+
+    def _reopen_rotated(self, handler):
+        # what WatchedFileHandler.emit() does before every record
+        try:
+            stat = os.stat(handler.baseFilename)
+            changed = stat.st_dev != handler.dev or stat.st_ino != handler.ino
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            stat = None
+            changed = True
+        if changed and handler.stream is not None:
+            handler.stream.flush()
+            handler.stream.close()
+            handler.stream = handler._open()
+            if stat is None:
+                stat = os.stat(handler.baseFilename)
+            handler.dev, handler.ino = stat.st_dev, stat.st_ino
+
+    def flush(self):
+        # wait (a while) for the queued records to be written
+        if self._pid != os.getpid():
+            return
+        deadline = time.time() + 5
+        while not self._queue.empty() and time.time() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        if self._pid == os.getpid() and self._thread.isAlive():
+            try:
+                self._queue.put(None, True, 5)
+            except Queue.Full:
+                pass
+            self._thread.join(5)
+        for handler in self.handlers:
+            handler.close()
+        logging.Handler.close(self)
+
+def make_async(log, queue_size=10000, batch_size=256, flush_interval=0.5):
+    """
+    Replaces the handlers of log with an AsyncLogHandler writing to them.
+    """
+    handler = AsyncLogHandler(log.handlers, queue_size, batch_size, flush_interval)
+    log.handlers = [handler]
+    return handler
+
 def configure_log(log, log_file, log_level, foreground):
     # Clear existing log handlers
     log.handlers = []
@@ -0,0 +1,191 @@
+import re
+import bisect
+import threading
+import BaseHTTPServer
+import simplejson as json
+
+from sensu.snmp.log import log
+
+class Counter(object):
+    """
+    A monotonically increasing counter. Increments are not locked, so
+    concurrent increments may very rarely be lost.
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, count=1):
+        self.value += count
+
+
+class Histogram(object):
+    """
+    Counts observations into fixed buckets (upper bounds, in seconds for
+    latencies). The bucket counts are cumulative in snapshots, so the
+    histograms of several processes can be summed up.
+    """
+
+    LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        snapshot = {'count': self.count, 'sum': self.sum}
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            snapshot['le_%s' % (bound)] = total
+        return snapshot
+
+
+def metric_name(*parts):
+    """
+    Joins the parts of a metric name with dots. Characters that can't be
+    used in a graphite path are replaced.
+    """
+    return '.'.join([re.sub(r'[^\w-]+', '_', str(part)) for part in parts])
+
+def flatten(prefix, value, metrics):
+    # add the numbers in (nested dicts of) value to metrics
+    if isinstance(value, dict):
+        for k, v in value.items():
+            flatten(prefix + '.' + metric_name(k) if prefix else metric_name(k), v, metrics)
+    elif isinstance(value, bool):
+        metrics[prefix] = int(value)
+    elif isinstance(value, (int, long, float)):
+        metrics[prefix] = value
+
+
+class MetricsRegistry(object):
+    """
+    Registry of the counters, histograms and gauges of the daemon.
+
+    Counters and histograms are updated directly in the hot path. Gauges are
+    callables that are only evaluated when a snapshot is taken and may return
+    a number or a (nested) dict of numbers, such as the stats() of a
+    component.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict()
+        self._histograms = dict()
+        self._gauges = dict()
+
+    def counter(self, name):
+        counter = self._counters.get(name)
+        if counter is None:
+            self._lock.acquire()
+            try:
+                counter = self._counters.setdefault(name, Counter())
+            finally:
+                self._lock.release()
+        return counter
+
+    def histogram(self, name, buckets=Histogram.LATENCY_BUCKETS):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            self._lock.acquire()
+            try:
+                histogram = self._histograms.setdefault(name, Histogram(buckets))
+            finally:
+                self._lock.release()
+        return histogram
+
+    def gauge(self, name, function):
+        self._gauges[name] = function
+
+    def remove_gauge(self, name):
+        self._gauges.pop(name, None)
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._counters.clear()
+            self._histograms.clear()
+            self._gauges.clear()
+        finally:
+            self._lock.release()
+
+    def snapshot(self):
+        """
+        Returns all metrics as a flat dict of dotted names to numbers.
+        """
+        snapshot = dict()
+        for name, counter in self._counters.items():
+            snapshot[name] = counter.value
+        for name, histogram in self._histograms.items():
+            flatten(name, histogram.snapshot(), snapshot)
+        for name, function in self._gauges.items():
+            try:
+                flatten(name, function(), snapshot)
+            except Exception:
+                log.exception("MetricsRegistry: Error reading gauge %s" % (name))
+        return snapshot
+
+def to_graphite(snapshot, prefix, timestamp):
+    """
+    Formats a snapshot in the graphite plaintext format used by Sensu
+    metric checks.
+    """
+    return "\n".join(["%s.%s %s %d" % (prefix, name, value, timestamp)
+                      for name, value in sorted(snapshot.items())])
+
+
+class MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/stats'):
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.snapshot(), sort_keys=True)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("MetricsServer: %s %s" % (self.address_string(), format % args))
+
+
+class MetricsServerThread(threading.Thread):
+    """
+    Serves snapshots of the metrics as JSON over HTTP.
+    """
+
+    def __init__(self, listen_address, listen_port, snapshot):
+        # Initialize threading.Thread
+        threading.Thread.__init__(self, name=self.__class__.__name__)
+        self.setDaemon(True)
+        self._http_server = BaseHTTPServer.HTTPServer((listen_address, int(listen_port)), MetricsRequestHandler)
+        self._http_server.snapshot = snapshot
+        self.address = self._http_server.server_address
+        log.info("MetricsServer: Serving stats on http://%s:%d/stats" % self.address)
+
+    def stop(self):
+        # shutdown() waits for serve_forever(), so only call it once running
+        if self.isAlive():
+            self._http_server.shutdown()
+
+    def run(self):
+        log.debug("%s: Started" % (self.name))
+        self._http_server.serve_forever(poll_interval=0.5)
+        self._http_server.server_close()
+        log.debug("%s: Exiting" % (self.name))
+
+
+# the metrics of this process
+metrics = MetricsRegistry()
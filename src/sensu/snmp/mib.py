@@ -1,55 +1,246 @@
+import threading
+
 import pysnmp.smi.builder
 import pysnmp.smi.view
 import pysnmp.entity.rfc3413.mibvar
 import pysnmp.proto.rfc1902
+from pysnmp.smi.error import NoSuchObjectError
 
 from sensu.snmp.log import log
+from sensu.snmp.mibtable import MibTable
+from sensu.snmp.mibtable import compile_mib_table
+from sensu.snmp.mibtable import mib_sources
+from sensu.snmp.mibtable import open_mib_table
+from sensu.snmp.mibtable import SYNTAX_NONE
+from sensu.snmp.mibtable import SYNTAX_TYPES
+from sensu.snmp.mibtable import SYNTAX_UNKNOWN
+from sensu.snmp.util import LRUCache
 
 class MibResolver(object):
 
     DEFAULT_MIB_PATHS = []
     DEFAULT_MIB_LIST = ['SNMPv2-MIB', 'SNMP-COMMUNITY-MIB']
+    DEFAULT_CACHE_SIZE = 10000
+
+    # marker for cached symbols without a value syntax
+    _NO_SYNTAX = object()
 
-    def __init__(self, mib_paths=None, mib_list=None):
+    def __init__(self, mib_paths=None, mib_list=None, cache_size=DEFAULT_CACHE_SIZE, table_path=None):
         if mib_paths is None:
             mib_paths = []
         if mib_list is None:
             mib_list = []
+        self._mib_paths = self.DEFAULT_MIB_PATHS + mib_paths
+        self._mib_list = self.DEFAULT_MIB_LIST + mib_list
 
-        # Initialize mib MibBuilder
-        self._mib_builder = pysnmp.smi.builder.MibBuilder()
-
-        # Configure MIB sources
-        self._mib_sources = self._mib_builder.getMibSources()
+        # Initialize lookup caches
+        self._oid_cache = LRUCache(cache_size)
+        self._value_cache = LRUCache(cache_size)
 
-        # Load default mib dirs
-        for path in self.DEFAULT_MIB_PATHS + mib_paths:
-            self.load_mib_dir(path)
-        # Load default mibs
-        for mib in self.DEFAULT_MIB_LIST + mib_list:
-            self.load_mib(mib)
+        # The MibBuilder is only set up when a lookup misses the MIB table
+        self._mib_builder = None
+        self._mib_view = None
+        # pysnmp's MibBuilder and MibViewController aren't thread-safe
+        self._mib_lock = threading.RLock()
+        self._table = None
+        self._table_fallbacks = 0
+        self._sources = mib_sources(self._mib_paths, self._mib_list)
 
-        # Initialize MibViewController
-        self._mib_view = pysnmp.smi.view.MibViewController(self._mib_builder)
+        if table_path is not None:
+            self._table = open_mib_table(table_path, self._sources)
+            if self._table is None:
+                self._load_mibs()
+                compile_mib_table(table_path, self._mib_builder, self._mib_view, self._sources)
+                self._table = MibTable(table_path)
+            log.info("MibResolver: Using MIB table %s" % (table_path))
+        else:
+            self._load_mibs()
         log.debug("MibResolver: Initialized")
 
-    def load_mib_dir(self, path):
+    def _load_mibs(self):
+        if self._mib_view is not None:
+            return
+        # a table miss on the receiver and the main thread may race
+        self._mib_lock.acquire()
+        try:
+            if self._mib_view is not None:
+                return
+            # Initialize mib MibBuilder
+            self._mib_builder = pysnmp.smi.builder.MibBuilder()
+
+            # Configure MIB sources
+            self._mib_sources = self._mib_builder.getMibSources()
+
+            # Load default mib dirs
+            for path in self._mib_paths:
+                self._load_mib_dir(path)
+            # Load default mibs
+            for mib in self._mib_list:
+                self._load_mib(mib)
+
+            # Initialize MibViewController
+            self._mib_view = pysnmp.smi.view.MibViewController(self._mib_builder)
+            log.debug("MibResolver: Loaded MIBs")
+        finally:
+            self._mib_lock.release()
+
+    def _load_mib_dir(self, path):
         self._mib_sources += (pysnmp.smi.builder.DirMibSource(path),)
         log.debug("MibResolver: Loaded MIB source: %s" % path)
         self._mib_builder.setMibSources(*self._mib_sources)
 
-    def load_mib(self, mib):
+    def _load_mib(self, mib):
         self._mib_builder.loadModules(mib, )
         log.debug("MibResolver: Loaded MIB: %s" % mib)
 
+    def _table_miss(self):
+        self._table_fallbacks += 1
+        self._load_mibs()
+
+    def load_mib_dir(self, path):
+        # the MIB table doesn't know about MIBs loaded later on
+        self._load_mibs()
+        self._table = None
+        self._mib_lock.acquire()
+        try:
+            self._load_mib_dir(path)
+        finally:
+            self._mib_lock.release()
+        self._mib_paths.append(path)
+        self._sources = mib_sources(self._mib_paths, self._mib_list)
+        self.clear_cache()
+
+    def load_mib(self, mib):
+        self._load_mibs()
+        self._table = None
+        self._mib_lock.acquire()
+        try:
+            self._load_mib(mib)
+        finally:
+            self._mib_lock.release()
+        self._mib_list.append(mib)
+        self._sources = mib_sources(self._mib_paths, self._mib_list)
+        self.clear_cache()
+
+    def sources(self):
+        """
+        Returns the MIB paths and modules loaded, along with the modification
+        times of the files in the MIB paths when they were loaded.
+        """
+        return self._sources
+
+    def clear_cache(self):
+        self._oid_cache.clear()
+        self._value_cache.clear()
+
+    def cache_stats(self):
+        stats = {'oid': self._oid_cache.stats(),
+                 'value': self._value_cache.stats()}
+        if self._table is not None:
+            stats['table'] = self._table.stats()
+            stats['table']['fallbacks'] = self._table_fallbacks
+        return stats
+
     def lookup(self, module, symbol):
+        if self._table is not None:
+            found = self._table.lookup_name(module, symbol)
+            if found is not None:
+                return pysnmp.proto.rfc1902.ObjectName(found[0])
+            self._table_miss()
         name = ((module,symbol),)
-        oid,suffix = pysnmp.entity.rfc3413.mibvar.mibNameToOid(self._mib_view, name)
+        self._mib_lock.acquire()
+        try:
+            oid,suffix = pysnmp.entity.rfc3413.mibvar.mibNameToOid(self._mib_view, name)
+        finally:
+            self._mib_lock.release()
         return pysnmp.proto.rfc1902.ObjectName(oid)
 
+    def _resolve_oid(self, oid):
+        """
+        Walks the MIB tree for an OID. Returns the (module, symbol) tuple, the
+        OID of the resolved MIB node and whether that node is a table column
+        (in which case every OID below the node resolves to the same symbol).
+        """
+        found = None
+        if self._table is not None:
+            found = self._table.lookup_oid(oid)
+            if found is None:
+                self._table_miss()
+        if found is not None:
+            module, symbol, node_oid, column = found
+            suffix = oid[len(node_oid):]
+        else:
+            self._mib_lock.acquire()
+            try:
+                node_oid, label, suffix = self._mib_view.getNodeNameByOid(oid)
+                module, symbol, __suffix = self._mib_view.getNodeLocation(node_oid)
+                mib_node, = self._mib_builder.importSymbols(module, symbol)
+            finally:
+                self._mib_lock.release()
+            column = hasattr(mib_node, 'createTest')
+        if not column and suffix not in ((), (0,)):
+            raise NoSuchObjectError(
+                str='No MIB registered that defines %s object, closest known parent is %s (%s::%s)' % (
+                    pysnmp.proto.rfc1902.ObjectName(oid), pysnmp.proto.rfc1902.ObjectName(node_oid), module, symbol))
+        return (module, symbol), node_oid, column
+
     def lookup_oid(self, oid):
-        (symbol, module), indices = pysnmp.entity.rfc3413.mibvar.oidToMibName(self._mib_view, oid)
-        return (module, symbol)
+        oid = tuple(oid)
+        result = self._oid_cache.get(oid)
+        if result is None:
+            result, node_oid, column = self._resolve_oid(oid)
+            self._oid_cache.set(oid, result)
+        return result
+
+    def lookup_oids(self, oids):
+        """
+        Resolves a list of OIDs to (module, symbol) tuples. OIDs sharing a
+        table column prefix (e.g. varbinds for several rows of a table) are
+        resolved with a single walk of the MIB tree.
+        """
+        results = []
+        columns = []
+        for oid in oids:
+            oid = tuple(oid)
+            result = self._oid_cache.get(oid)
+            if result is None:
+                for column_oid, column_result in columns:
+                    if oid[:len(column_oid)] == column_oid:
+                        result = column_result
+                        break
+                else:
+                    result, node_oid, column = self._resolve_oid(oid)
+                    if column:
+                        columns.append((tuple(node_oid), result))
+                self._oid_cache.set(oid, result)
+            results.append(result)
+        return results
+
+    def _table_syntax(self, module, symbol):
+        # the base type of the value syntax, from the MIB table
+        if self._table is not None:
+            found = self._table.lookup_name(module, symbol)
+            if found is not None and found[1] == SYNTAX_NONE:
+                return self._NO_SYNTAX
+            if found is not None and found[1] != SYNTAX_UNKNOWN:
+                return SYNTAX_TYPES[found[1]]()
+            self._table_miss()
+        return None
 
     def lookup_value(self, module, symbol, value):
-        return pysnmp.entity.rfc3413.mibvar.cloneFromMibValue(self._mib_view, module, symbol, value)
+        key = (module, symbol)
+        syntax = self._value_cache.get(key)
+        if syntax is None:
+            syntax = self._table_syntax(module, symbol)
+            if syntax is None:
+                self._mib_lock.acquire()
+                try:
+                    mib_node, = self._mib_builder.importSymbols(module, symbol)
+                finally:
+                    self._mib_lock.release()
+                syntax = getattr(mib_node, 'syntax', self._NO_SYNTAX)
+            self._value_cache.set(key, syntax)
+        if syntax is self._NO_SYNTAX:
+            # identifier
+            return None
+        return syntax.clone(value)
@@ -0,0 +1,297 @@
+import os
+import mmap
+import struct
+import inspect
+
+import simplejson as json
+import pysnmp
+import pysnmp.proto.rfc1902
+import pyasn1.type.univ
+from pysnmp.smi.error import NoSuchObjectError
+
+from sensu.snmp.log import log
+
+# identifies MIB table files (and the version of the table format, which
+# includes the syntax codes)
+TABLE_MAGIC = "SNMPMIBTAB\x02"
+
+# offset and length of the sources, the strings, the OID records and the
+# name records
+TABLE_HEADER = struct.Struct('!IIIIIIII')
+
+# offset and length of a string
+STRING_RECORD = struct.Struct('!II')
+
+# OID key offset, OID length, module, symbol, column flag
+OID_RECORD = struct.Struct('!IHIIB')
+
+# module, symbol, OID key offset, OID length, syntax
+NAME_RECORD = struct.Struct('!IIIHB')
+
+ARC = struct.Struct('!I')
+
+# the syntax of identifiers (which have no value)
+SYNTAX_NONE = 0
+# syntaxes the table can't rebuild, their values are cloned by pysnmp
+SYNTAX_UNKNOWN = 255
+
+# values are rebuilt with their base SMI type, which keeps their value (and
+# str()) but not the display hints of textual conventions
+SYNTAX_TYPES = [None,
+                pysnmp.proto.rfc1902.Integer32,
+                pysnmp.proto.rfc1902.Integer,
+                pysnmp.proto.rfc1902.OctetString,
+                pysnmp.proto.rfc1902.ObjectName,
+                pysnmp.proto.rfc1902.IpAddress,
+                pysnmp.proto.rfc1902.Counter32,
+                pysnmp.proto.rfc1902.Gauge32,
+                pysnmp.proto.rfc1902.Unsigned32,
+                pysnmp.proto.rfc1902.TimeTicks,
+                pysnmp.proto.rfc1902.Opaque,
+                pysnmp.proto.rfc1902.Counter64,
+                pysnmp.proto.rfc1902.Bits,
+                # OBJECT IDENTIFIER syntaxes (like sysObjectID) use the
+                # ASN.1 type rather than ObjectName
+                pyasn1.type.univ.ObjectIdentifier]
+
+class MibTableFormatError(ValueError):
+    pass
+
+def mib_sources(mib_paths, mib_list):
+    """
+    Describes what a MIB table is compiled from: the MIB paths and modules,
+    the modification times of the files in the MIB paths and the pysnmp
+    version (which ships the default MIBs).
+    """
+    files = dict()
+    for path in mib_paths:
+        try:
+            names = os.listdir(path)
+        except OSError:
+            continue
+        for name in names:
+            filename = os.path.join(path, name)
+            if os.path.isfile(filename):
+                files[filename] = os.stat(filename).st_mtime
+    return {'paths': list(mib_paths),
+            'mibs': list(mib_list),
+            'files': files,
+            'pysnmp': pysnmp.__version__}
+
+def _syntax_type(mib_node):
+    if not hasattr(mib_node, 'syntax'):
+        return SYNTAX_NONE
+    if mib_node.syntax is None:
+        return SYNTAX_UNKNOWN
+    for cls in inspect.getmro(mib_node.syntax.__class__):
+        if cls in SYNTAX_TYPES:
+            return SYNTAX_TYPES.index(cls)
+    return SYNTAX_UNKNOWN
+
+def _walk_mib_view(mib_view):
+    # yields the OID of every node of the MIB tree
+    try:
+        oid, label, suffix = mib_view.getFirstNodeName()
+        while True:
+            yield oid
+            oid, label, suffix = mib_view.getNextNodeName(oid)
+    except NoSuchObjectError:
+        pass
+
+def compile_mib_table(path, mib_builder, mib_view, sources):
+    """
+    Writes the resolved MIB tree of a MibViewController to a MIB table file:
+    every node of the tree with the module and symbol it resolves to, and
+    every symbol with its OID and value syntax. Returns the number of nodes
+    and symbols written.
+    """
+    strings = dict()
+    def string_id(value):
+        return strings.setdefault(value, len(strings))
+
+    # nodes, as resolved by the view
+    nodes = []
+    for oid in _walk_mib_view(mib_view):
+        module, symbol, suffix = mib_view.getNodeLocation(oid)
+        mib_node, = mib_builder.importSymbols(module, symbol)
+        nodes.append((tuple(oid), module, symbol, hasattr(mib_node, 'createTest')))
+    nodes.sort()
+
+    # symbols, including those defined by several modules
+    names = []
+    for module, symbols in mib_builder.mibSymbols.items():
+        for symbol, mib_node in symbols.items():
+            if isinstance(getattr(mib_node, 'name', None), tuple) and hasattr(mib_node, 'getName'):
+                names.append((module, symbol, tuple(mib_node.name), _syntax_type(mib_node)))
+    names.sort()
+
+    keys = []
+    key_size = 0
+    oid_records = []
+    for oid, module, symbol, column in nodes:
+        oid_records.append(OID_RECORD.pack(key_size, len(oid), string_id(module), string_id(symbol), column))
+        keys.append(struct.pack('!%dI' % (len(oid)), *oid))
+        key_size += len(keys[-1])
+    name_records = []
+    for module, symbol, oid, syntax in names:
+        name_records.append(NAME_RECORD.pack(string_id(module), string_id(symbol), key_size, len(oid), syntax))
+        keys.append(struct.pack('!%dI' % (len(oid)), *oid))
+        key_size += len(keys[-1])
+
+    string_records = []
+    string_size = 0
+    string_data = []
+    for value, i in sorted(strings.items(), key=lambda item: item[1]):
+        string_records.append(STRING_RECORD.pack(string_size, len(value)))
+        string_data.append(value)
+        string_size += len(value)
+
+    source_data = json.dumps(sources, sort_keys=True)
+    sections = [source_data, ''.join(string_records), ''.join(oid_records), ''.join(name_records),
+                ''.join(string_data), ''.join(keys)]
+    offset = len(TABLE_MAGIC) + TABLE_HEADER.size
+    offsets = []
+    for section in sections:
+        offsets.append(offset)
+        offset += len(section)
+    header = TABLE_HEADER.pack(offsets[0], len(source_data), offsets[1], len(strings),
+                               offsets[2], len(oid_records), offsets[3], len(name_records))
+
+    # replace the table atomically, a running daemon may have it mapped
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    fh = open(temp_path, 'wb')
+    try:
+        fh.write(TABLE_MAGIC)
+        fh.write(header)
+        fh.write(''.join(sections))
+    finally:
+        fh.close()
+    os.rename(temp_path, path)
+    log.debug("compile_mib_table: Wrote %d nodes and %d symbols to %s" % (len(oid_records), len(name_records), path))
+    return len(oid_records), len(name_records)
+
+
+class MibTable(object):
+    """
+    A memory-mapped MIB table. Nodes are sorted by OID and symbols by
+    module and symbol name, so lookups are binary searches of the mapped
+    file and only the pages touched are read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        fh = open(path, 'rb')
+        try:
+            if os.fstat(fh.fileno()).st_size < len(TABLE_MAGIC) + TABLE_HEADER.size:
+                raise MibTableFormatError("Not a MIB table file: %s" % (path))
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fh.close()
+        if self._map[:len(TABLE_MAGIC)] != TABLE_MAGIC:
+            self.close()
+            raise MibTableFormatError("Not a MIB table file: %s" % (path))
+        (sources_offset, sources_length, self._strings_offset, self._string_count,
+         self._oids_offset, self.node_count, self._names_offset, self.symbol_count) = \
+            TABLE_HEADER.unpack_from(self._map, len(TABLE_MAGIC))
+        self.sources = json.loads(self._map[sources_offset:sources_offset + sources_length])
+        self._string_data_offset = self._names_offset + self.symbol_count * NAME_RECORD.size
+        string_data_size = 0
+        if self._string_count:
+            offset, length = STRING_RECORD.unpack_from(
+                self._map, self._strings_offset + (self._string_count - 1) * STRING_RECORD.size)
+            string_data_size = offset + length
+        self._keys_offset = self._string_data_offset + string_data_size
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _string(self, i):
+        offset, length = STRING_RECORD.unpack_from(self._map, self._strings_offset + i * STRING_RECORD.size)
+        offset += self._string_data_offset
+        return self._map[offset:offset + length]
+
+    def _key(self, offset, arcs):
+        offset += self._keys_offset
+        return self._map[offset:offset + arcs * ARC.size]
+
+    def _oid(self, offset, arcs):
+        return struct.unpack('!%dI' % (arcs), self._key(offset, arcs))
+
+    def _oid_record(self, i):
+        return OID_RECORD.unpack_from(self._map, self._oids_offset + i * OID_RECORD.size)
+
+    def _name_record(self, i):
+        return NAME_RECORD.unpack_from(self._map, self._names_offset + i * NAME_RECORD.size)
+
+    def _find_oid(self, key):
+        # OIDs are packed as fixed width arcs, so their byte order is their
+        # OID order
+        low, high = 0, self.node_count
+        while low < high:
+            middle = (low + high) // 2
+            key_offset, arcs, module, symbol, column = self._oid_record(middle)
+            found = self._key(key_offset, arcs)
+            if found == key:
+                return module, symbol, column
+            if found < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def lookup_oid(self, oid):
+        """
+        Finds the closest node of the MIB tree for an OID, like
+        MibViewController.getNodeNameByOid() does. Returns the module,
+        symbol, OID and column flag of the node, or None.
+        """
+        for length in range(len(oid), 0, -1):
+            node_oid = tuple(oid[:length])
+            found = self._find_oid(struct.pack('!%dI' % (length), *node_oid))
+            if found is not None:
+                module, symbol, column = found
+                return self._string(module), self._string(symbol), node_oid, bool(column)
+        return None
+
+    def lookup_name(self, module, symbol):
+        """
+        Returns the OID and the syntax type of a symbol, or None.
+        """
+        name = (module, symbol)
+        low, high = 0, self.symbol_count
+        while low < high:
+            middle = (low + high) // 2
+            record = self._name_record(middle)
+            found = (self._string(record[0]), self._string(record[1]))
+            if found == name:
+                return self._oid(record[2], record[3]), record[4]
+            if found < name:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def stats(self):
+        return {'nodes': self.node_count,
+                'symbols': self.symbol_count}
+
+def open_mib_table(path, sources):
+    """
+    Opens a MIB table if it exists and was compiled from the given sources.
+    Returns None otherwise.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        table = MibTable(path)
+    except (EnvironmentError, ValueError), e:
+        log.warning("open_mib_table: Ignoring unreadable MIB table %s: %s" % (path, str(e)))
+        return None
+    if table.sources != sources:
+        log.info("open_mib_table: MIB table %s is out of date" % (path))
+        table.close()
+        return None
+    return table
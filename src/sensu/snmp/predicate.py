@@ -0,0 +1,342 @@
+import re
+import socket
+import bisect
+import pysnmp.proto.rfc1902
+
+from sensu.snmp.trap import Trap
+
+# predicates test a trap argument (by OID) or a trap property (by name)
+FIELD_ARGUMENT = 'argument'
+FIELD_PROPERTY = 'property'
+
+RANGE_OPERATORS = ('gt', 'ge', 'lt', 'le')
+
+def _text(value):
+    # values are compared as they are rendered in events
+    if isinstance(value, pysnmp.proto.rfc1902.IpAddress):
+        return socket.inet_ntoa(str(value))
+    return str(value)
+
+def _number(value):
+    try:
+        return float(_text(value))
+    except ValueError:
+        return None
+
+def _address(value):
+    # (address family bits, address as an integer) or None
+    if isinstance(value, pysnmp.proto.rfc1902.IpAddress):
+        packed = str(value)
+    else:
+        packed = None
+        for family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                packed = socket.inet_pton(family, _text(value))
+                break
+            except (socket.error, ValueError):
+                pass
+        if packed is None:
+            return None
+    return len(packed) * 8, long(packed.encode('hex'), 16)
+
+def _network(cidr):
+    if '/' in cidr:
+        address, prefix_length = cidr.split('/', 1)
+    else:
+        address, prefix_length = cidr, None
+    parsed = _address(address)
+    if parsed is None:
+        raise ValueError("Invalid network: %s" % (cidr))
+    bits, address = parsed
+    if prefix_length is None:
+        prefix_length = bits
+    prefix_length = int(prefix_length)
+    if not 0 <= prefix_length <= bits:
+        raise ValueError("Invalid network: %s" % (cidr))
+    return bits, prefix_length, address >> (bits - prefix_length)
+
+
+class Predicate(object):
+    """
+    A test of the value of one trap argument or trap property. Traps
+    without the value never match.
+    """
+
+    def __init__(self, field):
+        # (FIELD_ARGUMENT, oid) or (FIELD_PROPERTY, name)
+        self.field = field
+
+    def value(self, trap):
+        kind, key = self.field
+        if kind == FIELD_ARGUMENT:
+            return trap.arguments.get(key)
+        return trap.properties.get(key)
+
+    def matches(self, trap):
+        value = self.value(trap)
+        return value is not None and self.test(value)
+
+    def test(self, value):
+        raise NotImplementedError()
+
+
+class EqualsPredicate(Predicate):
+
+    def __init__(self, field, values):
+        Predicate.__init__(self, field)
+        self.values = frozenset([_text(value) for value in values])
+
+    def test(self, value):
+        return _text(value) in self.values
+
+
+class RangePredicate(Predicate):
+
+    def __init__(self, field, low=None, low_inclusive=True, high=None, high_inclusive=True):
+        Predicate.__init__(self, field)
+        self.low = low
+        self.low_inclusive = low_inclusive
+        self.high = high
+        self.high_inclusive = high_inclusive
+
+    def test(self, value):
+        number = _number(value)
+        if number is None:
+            return False
+        if self.low is not None and (number < self.low or (number == self.low and not self.low_inclusive)):
+            return False
+        if self.high is not None and (number > self.high or (number == self.high and not self.high_inclusive)):
+            return False
+        return True
+
+
+class RegexPredicate(Predicate):
+
+    def __init__(self, field, pattern):
+        Predicate.__init__(self, field)
+        try:
+            self.pattern = re.compile(pattern)
+        except re.error, e:
+            raise ValueError("Invalid regex %r: %s" % (pattern, e))
+
+    def test(self, value):
+        return self.pattern.search(_text(value)) is not None
+
+
+class CidrPredicate(Predicate):
+
+    def __init__(self, field, networks):
+        Predicate.__init__(self, field)
+        # (address family bits, prefix length, network prefix)
+        self.networks = frozenset([_network(network) for network in networks])
+
+    def test(self, value):
+        address = _address(value)
+        if address is None:
+            return False
+        bits, address = address
+        for network_bits, prefix_length, prefix in self.networks:
+            if network_bits == bits and address >> (bits - prefix_length) == prefix:
+                return True
+        return False
+
+
+def parse_predicates(predicates, trap_args):
+    """
+    Compiles the predicates of a trap handler definition. Every key names a
+    trap argument (as mapped in trap_args) or a trap property, and every
+    predicate must hold for the trap handler to match:
+
+        "severity": "critical"                  equals
+        "severity": {"in": ["major", "critical"]}
+        "load":     {"ge": 80, "lt": 100}       numeric range (gt, ge, lt, le)
+        "message":  {"regex": "^disk .* full"}  regular expression search
+        "ipaddress": {"cidr": ["10.0.0.0/8"]}   source address in network(s)
+    """
+    tokens = dict((token, oid) for oid, token in trap_args.items())
+    compiled = []
+    for name, spec in sorted(predicates.items()):
+        if name in tokens:
+            field = (FIELD_ARGUMENT, tokens[name])
+        elif name in Trap.PROPERTIES:
+            field = (FIELD_PROPERTY, name)
+        else:
+            raise ValueError("Unknown predicate field: %s" % (name))
+
+        if not isinstance(spec, dict):
+            spec = {'eq': spec}
+        unknown = set(spec) - set(('eq', 'in', 'regex', 'cidr') + RANGE_OPERATORS)
+        if unknown:
+            raise ValueError("Unknown predicate operator(s) for %s: %s" % (name, ', '.join(sorted(unknown))))
+
+        if 'eq' in spec:
+            compiled.append(EqualsPredicate(field, [spec['eq']]))
+        if 'in' in spec:
+            compiled.append(EqualsPredicate(field, spec['in']))
+        if set(spec) & set(RANGE_OPERATORS):
+            low = low_inclusive = high = high_inclusive = None
+            if 'gt' in spec or 'ge' in spec:
+                low_inclusive = 'ge' in spec
+                low = float(spec['ge'] if low_inclusive else spec['gt'])
+            if 'lt' in spec or 'le' in spec:
+                high_inclusive = 'le' in spec
+                high = float(spec['le'] if high_inclusive else spec['lt'])
+            compiled.append(RangePredicate(field, low, low_inclusive, high, high_inclusive))
+        if 'regex' in spec:
+            compiled.append(RegexPredicate(field, spec['regex']))
+        if 'cidr' in spec:
+            networks = spec['cidr']
+            if isinstance(networks, basestring):
+                networks = [networks]
+            compiled.append(CidrPredicate(field, networks))
+    return compiled
+
+
+class RangeIndex(object):
+    """
+    Finds the ranges containing a number with a binary search. The number
+    line is cut at every range bound into points and the open intervals
+    between them, and the ranges covering each piece are computed up front.
+    """
+
+    def __init__(self, ranges):
+        # ranges is a list of (predicate id, RangePredicate)
+        bounds = set()
+        for predicate_id, predicate in ranges:
+            if predicate.low is not None:
+                bounds.add(predicate.low)
+            if predicate.high is not None:
+                bounds.add(predicate.high)
+        self._bounds = sorted(bounds)
+
+        # piece 2i is the interval below bound i, 2i+1 is bound i itself
+        self._pieces = []
+        for piece in range(2 * len(self._bounds) + 1):
+            self._pieces.append(tuple(predicate_id for predicate_id, predicate in ranges
+                                      if self._covers(predicate, piece)))
+
+    def _covers(self, predicate, piece):
+        i = piece // 2
+        if piece % 2:
+            # a bound
+            return predicate.test(self._bounds[i])
+        # an interval between bounds, its points all behave the same
+        if i == 0:
+            if not self._bounds:
+                return predicate.low is None and predicate.high is None
+            lower, upper = None, self._bounds[0]
+        elif i == len(self._bounds):
+            lower, upper = self._bounds[-1], None
+        else:
+            lower, upper = self._bounds[i - 1], self._bounds[i]
+        if predicate.low is not None and (lower is None or lower < predicate.low):
+            return False
+        if predicate.high is not None and (upper is None or upper > predicate.high):
+            return False
+        return True
+
+    def match(self, number):
+        i = bisect.bisect_left(self._bounds, number)
+        if i < len(self._bounds) and self._bounds[i] == number:
+            return self._pieces[2 * i + 1]
+        return self._pieces[2 * i]
+
+
+class FieldIndex(object):
+    """
+    The predicates of one field: equality by hash lookup, ranges by binary
+    search, networks by a hash lookup per prefix length and regular
+    expressions (grouped by pattern) one by one.
+    """
+
+    def __init__(self):
+        self._equals = dict()
+        self._ranges = []
+        self._regexes = dict()
+        self._networks = dict()
+        self._range_index = None
+
+    def add(self, predicate_id, predicate):
+        if isinstance(predicate, EqualsPredicate):
+            for value in predicate.values:
+                self._equals.setdefault(value, []).append(predicate_id)
+        elif isinstance(predicate, RangePredicate):
+            self._ranges.append((predicate_id, predicate))
+        elif isinstance(predicate, RegexPredicate):
+            self._regexes.setdefault(predicate.pattern.pattern, (predicate.pattern, []))[1].append(predicate_id)
+        elif isinstance(predicate, CidrPredicate):
+            for bits, prefix_length, prefix in predicate.networks:
+                networks = self._networks.setdefault((bits, prefix_length), dict())
+                networks.setdefault(prefix, []).append(predicate_id)
+        else:
+            raise ValueError("Can't index predicate: %r" % (predicate))
+
+    def compile(self):
+        self._range_index = RangeIndex(self._ranges) if self._ranges else None
+        self._regexes = self._regexes.values()
+        self._networks = self._networks.items()
+
+    def match(self, value, hits):
+        """
+        Adds the ids of the predicates holding for value to hits.
+        """
+        if self._equals:
+            hits.update(self._equals.get(_text(value), ()))
+        if self._range_index is not None:
+            number = _number(value)
+            if number is not None:
+                hits.update(self._range_index.match(number))
+        for pattern, predicate_ids in self._regexes:
+            if pattern.search(_text(value)) is not None:
+                hits.update(predicate_ids)
+        if self._networks:
+            address = _address(value)
+            if address is not None:
+                bits, address = address
+                for (network_bits, prefix_length), networks in self._networks:
+                    if network_bits == bits:
+                        hits.update(networks.get(address >> (bits - prefix_length), ()))
+
+
+class PredicateIndex(object):
+    """
+    Matches the predicates of many trap handlers (of the same trap type)
+    at once. Every field is looked up in its FieldIndex once, and a trap
+    handler matches if all of its predicates were hit, so the cost depends
+    on the number of fields and distinct regexes rather than the number of
+    trap handlers.
+    """
+
+    def __init__(self, trap_handlers):
+        # trap_handlers is a list of (key, predicates)
+        self._fields = dict()
+        self._owners = []
+        self._required = dict()
+        for key, predicates in trap_handlers:
+            self._required[key] = len(predicates)
+            for predicate in predicates:
+                predicate_id = len(self._owners)
+                self._owners.append(key)
+                self._fields.setdefault(predicate.field, FieldIndex()).add(predicate_id, predicate)
+        for field_index in self._fields.values():
+            field_index.compile()
+        self._fields = self._fields.items()
+
+    def match(self, trap):
+        """
+        Returns the set of keys whose predicates all hold for the trap.
+        """
+        hits = set()
+        for (kind, key), field_index in self._fields:
+            if kind == FIELD_ARGUMENT:
+                value = trap.arguments.get(key)
+            else:
+                value = trap.properties.get(key)
+            if value is not None:
+                field_index.match(value, hits)
+
+        counts = dict()
+        for predicate_id in hits:
+            owner = self._owners[predicate_id]
+            counts[owner] = counts.get(owner, 0) + 1
+        return set(owner for owner, count in counts.items() if count == self._required[owner])
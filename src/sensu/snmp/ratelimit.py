@@ -0,0 +1,94 @@
+import time
+import threading
+
+from sensu.snmp.log import log
+from sensu.snmp.util import LRUCache
+
+class TrapRateLimiter(object):
+    """
+    Token bucket rate limiting of traps per source address, or per source
+    address and trap OID.
+
+    Every bucket holds up to burst tokens and is refilled with rate tokens
+    per second. A trap takes a token; traps arriving at an empty bucket are
+    suppressed and counted. Buckets are kept in a LRU table of max_sources
+    entries, so a flood of (spoofed) sources can't exhaust memory.
+    """
+
+    def __init__(self, rate, burst, max_sources=10000, per_trap=False):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.per_trap = per_trap
+        self._buckets = LRUCache(max_sources)
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.suppressed = 0
+        # suppressed since the last summary
+        self._interval_suppressed = 0
+
+    def stats(self):
+        self._lock.acquire()
+        try:
+            stats = self._buckets.stats()
+            stats['allowed'] = self.allowed
+            stats['suppressed'] = self.suppressed
+            return stats
+        finally:
+            self._lock.release()
+
+    def allow(self, source, trap_oid=None, now=None):
+        """
+        Takes a token from the bucket of the source (and trap OID). Returns
+        False if the trap should be dropped.
+        """
+        if now is None:
+            now = time.time()
+        key = (source, trap_oid) if self.per_trap else (source, None)
+
+        self._lock.acquire()
+        try:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                # [tokens, last refill, suppressed since the last summary]
+                bucket = [self.burst, now, 0]
+                self._buckets.set(key, bucket)
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                self.allowed += 1
+                return True
+
+            bucket[2] += 1
+            self.suppressed += 1
+            self._interval_suppressed += 1
+            return False
+        finally:
+            self._lock.release()
+
+    def summarize(self):
+        """
+        Returns the number of traps suppressed since the last summary and a
+        list of (source, trap oid, count) tuples, most suppressed first.
+        Traps counted for buckets that were evicted since are only included
+        in the total.
+        """
+        self._lock.acquire()
+        try:
+            total = self._interval_suppressed
+            self._interval_suppressed = 0
+            if not total:
+                return 0, []
+
+            sources = []
+            for (source, trap_oid), bucket in self._buckets.items():
+                if bucket[2]:
+                    sources.append((source, trap_oid, bucket[2]))
+                    bucket[2] = 0
+        finally:
+            self._lock.release()
+
+        sources.sort(key=lambda source: source[2], reverse=True)
+        return total, sources
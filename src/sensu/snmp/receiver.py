@@ -1,30 +1,50 @@
 import os
 import sys
 import threading
+import socket
+import time
 import pysnmp.entity.engine
 import pysnmp.entity.config
 import pysnmp.smi.builder
 import pysnmp.smi.view
 import pysnmp.entity.rfc3413.mibvar
 from pysnmp.carrier.asynsock.dgram import udp
+from pysnmp.carrier.asynsock.dgram import udp6
 from pysnmp.entity.rfc3413 import ntfrcv
 from pysnmp.proto.api import v2c
 
 from sensu.snmp.log import log as log
 from sensu.snmp.trap import Trap
+from sensu.snmp.ber import decode_v2c_trap
+from sensu.snmp.ber import decode_version
+from sensu.snmp.ber import BerDecodeError
+from sensu.snmp.ber import SNMP_TRAP_OID
+from sensu.snmp.capture import TrapCaptureWriter
+from sensu.snmp.capture import TRANSPORT_UDP
+from sensu.snmp.capture import TRANSPORT_TCP
+from sensu.snmp.transport import PollingDispatcher
+from sensu.snmp.transport import TcpTransport
+from sensu.snmp.transport import TCP_DOMAIN_NAME
+from sensu.snmp.transport import TCP6_DOMAIN_NAME
+from sensu.snmp.sockstats import UdpSocketMonitor
+from sensu.snmp.sockstats import set_receive_buffer
+from sensu.snmp.metrics import metrics
+from sensu.snmp.metrics import metric_name
 from sensu.snmp.util import *
 
 
 class TrapReceiverThread(threading.Thread):
-    def __init__(self, config, mibs, callback):
+    def __init__(self, config, mibs, callback, resolver=None, reuse_port=False, rate_limiter=None):
         # Initialize threading.Thread
         threading.Thread.__init__(self, name=self.__class__.__name__)
         # Initialize TrapReceiver
-        self._trap_receiver = TrapReceiver(config, mibs, callback)
+        self._trap_receiver = TrapReceiver(config, mibs, callback, resolver, reuse_port, rate_limiter)
+
+    def set_mibs(self, mibs):
+        self._trap_receiver.set_mibs(mibs)
 
     def stop(self):
-        if self._trap_receiver._snmp_engine.transportDispatcher.jobsArePending():
-            self._trap_receiver._snmp_engine.transportDispatcher.jobFinished(1) 
+        self._trap_receiver.stop()
 
     def run(self):
         log.debug("%s: Started" % (self.name))
@@ -37,26 +57,61 @@ class TrapReceiver(object):
     SNMPV3_AUTH_PROTOCOLS = {"MD5": pysnmp.entity.config.usmHMACMD5AuthProtocol}
     SNMPV3_PRIV_PROTOCOLS = {"DES": pysnmp.entity.config.usmDESPrivProtocol, "none": None}
 
-    def __init__(self, config, mibs, callback):
+    # names of the transports and SNMP versions in metrics
+    TRANSPORT_NAMES = {udp.domainName: 'udp', udp6.domainName: 'udp6',
+                       TCP_DOMAIN_NAME: 'tcp', TCP6_DOMAIN_NAME: 'tcp6'}
+
+    # transports in capture files
+    CAPTURE_TRANSPORTS = {udp.domainName: TRANSPORT_UDP, udp6.domainName: TRANSPORT_UDP,
+                          TCP_DOMAIN_NAME: TRANSPORT_TCP, TCP6_DOMAIN_NAME: TRANSPORT_TCP}
+    CAPTURE_FLUSH_INTERVAL = 1
+    TCP_IDLE_CHECK_INTERVAL = 1
+    VERSION_NAMES = {0: 'v1', 1: 'v2c', 3: 'v3'}
+
+    def __init__(self, config, mibs, callback, resolver=None, reuse_port=False, rate_limiter=None):
         self._config = config
         self._mibs = mibs
         self._callback = callback
+        self._resolver = resolver
+        self._reuse_port = reuse_port
+        self._rate_limiter = rate_limiter
+        self._fast_path_community = None
+        self._capture = None
+        self._tcp_transports = []
+        self._udp_monitor = None
+        self._transport_names = dict(self.TRANSPORT_NAMES)
+        self._capture_transports = dict(self.CAPTURE_TRANSPORTS)
+
+        # Configure metrics
+        self._received_counters = dict()
+        self._decode_errors = metrics.counter('traps.decode_errors')
+        self._rate_limited_counter = metrics.counter('traps.rate_limited')
+        self._fast_path_counter = metrics.counter('traps.fast_path')
 
         # Create SNMP engine with autogenernated engineID and pre-bound to
         # socket transport dispatcher
         self._snmp_engine = pysnmp.entity.engine.SnmpEngine()
+        # poll() rather than select() so TCP connections aren't limited to
+        # FD_SETSIZE
+        self._snmp_engine.registerTransportDispatcher(PollingDispatcher())
         log.debug("TrapReceiver: Initialized SNMP Engine")
 
-        # Configure transport UDP over IPv4
-        if config['snmp']['transport']['udp']['enabled']:
-            self._configure_udp_transport(
-                config['snmp']['transport']['listen_address'], 
-                int(config['snmp']['transport']['listen_port']))
-
-        # Configure transport TCP over IPv4
-        if config['snmp']['transport']['tcp']['enabled']:
-            # TODO: Implement TCP transport ?
-            pass
+        # Configure UDP and TCP transports on every listen endpoint
+        transport_config = config['snmp']['transport']
+        for index, (listen_address, listen_port, rcvbuf) in enumerate(self._listen_endpoints(transport_config)):
+            if transport_config['udp']['enabled']:
+                self._configure_udp_transport(index, listen_address, listen_port, rcvbuf)
+            if transport_config['tcp']['enabled']:
+                self._configure_tcp_transport(index, listen_address, listen_port, transport_config['tcp'])
+        if self._tcp_transports:
+            metrics.gauge('tcp', self._tcp_stats)
+
+        # Watch the kernel counters of the UDP sockets if enabled
+        if self._udp_monitor is not None and float(transport_config['udp']['stats_interval']) > 0:
+            self._udp_monitor.check()
+            self._snmp_engine.transportDispatcher.registerTimerCbFun(self._udp_monitor.check,
+                                                                     float(transport_config['udp']['stats_interval']))
+            metrics.gauge('udp_sockets', self._udp_monitor.stats)
 
         # Configure SNMPv2 if enabled
         if bool(self._config['snmp']['auth']['version2']['enabled']):
@@ -67,20 +122,106 @@ class TrapReceiver(object):
             # TODO: configure SNMPv3 users from config file
             self._configure_snmp_v3(self._config['snmp']['auth']['version3']['users'])
 
+        # Configure the SNMPv2c trap fast path if enabled
+        if bool(self._config['snmp']['fast_path']['enabled']) and \
+                bool(self._config['snmp']['auth']['version2']['enabled']):
+            self._configure_fast_path(self._config['snmp']['auth']['version2']['community'])
+
+        # Receive messages before the engine does
+        if self._snmp_engine.transportDispatcher is not None:
+            self._snmp_engine.transportDispatcher.unregisterRecvCbFun()
+            self._snmp_engine.transportDispatcher.registerRecvCbFun(self._receive_message)
+
+            # Configure capturing of raw messages if enabled
+            if bool(self._config['snmp']['capture']['enabled']):
+                self._configure_capture(self._config['snmp']['capture'])
+
         # configure pysnmp debugging 
         #from pysnmp import debug
         #debug.setLogger(debug.Debug('io'))
 
         log.debug("TrapReceiver: Initialized")
 
-    def _configure_udp_transport(self, listen_address, listen_port):
-        pysnmp.entity.config.addSocketTransport(self._snmp_engine, udp.domainName,
-            udp.UdpTransport().openServerMode((listen_address, listen_port)))
+    def _listen_endpoints(self, transport_config):
+        """
+        Returns the (address, port, receive buffer size) of every endpoint to
+        listen on: the "listen" endpoints, or listen_address and listen_port.
+        """
+        endpoints = []
+        for endpoint in transport_config['listen'] or [dict()]:
+            endpoints.append((endpoint.get('address', transport_config['listen_address']),
+                              int(endpoint.get('port', transport_config['listen_port'])),
+                              endpoint.get('rcvbuf', transport_config['udp']['rcvbuf'])))
+        return endpoints
+
+    def _transport_domain(self, domain_name, index):
+        # every transport needs a domain of its own, the first endpoint keeps
+        # the standard one
+        if index == 0:
+            return domain_name
+        return domain_name + (index,)
+
+    def _create_socket(self, listen_address, sock_type, rcvbuf=None):
+        if ':' in listen_address:
+            sock = socket.socket(socket.AF_INET6, sock_type)
+            # IPv4 is received on endpoints of its own
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+        else:
+            sock = socket.socket(socket.AF_INET, sock_type)
+        if self._reuse_port:
+            # allow several receiver processes to share the listen address
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if rcvbuf:
+            set_receive_buffer(sock, int(rcvbuf), listen_address)
+        return sock
+
+    def _configure_udp_transport(self, index, listen_address, listen_port, rcvbuf=None):
+        sock = self._create_socket(listen_address, socket.SOCK_DGRAM, rcvbuf)
+        if sock.family == socket.AF_INET6:
+            domain_name = self._transport_domain(udp6.domainName, index)
+            transport = udp6.Udp6Transport(sock)
+            self._transport_names[domain_name] = 'udp6'
+        else:
+            domain_name = self._transport_domain(udp.domainName, index)
+            transport = udp.UdpTransport(sock)
+            self._transport_names[domain_name] = 'udp'
+        self._capture_transports[domain_name] = TRANSPORT_UDP
+        pysnmp.entity.config.addSocketTransport(self._snmp_engine, domain_name,
+            transport.openServerMode((listen_address, listen_port)))
+
+        if self._udp_monitor is None:
+            self._udp_monitor = UdpSocketMonitor()
+        self._udp_monitor.add_socket("%s:%s" % (listen_address, listen_port), sock)
         log.info("TrapReceiver: Initialized SNMP UDP Transport on %s:%s" % (listen_address, listen_port))
 
-    def _configure_tcp_transport(self, listen_address, listen_port):
-        #log.info("TrapReceiver: Initialized SNMP TCP Transport on %s:%s" % (listen_address, listen_port))
-        pass
+    def _configure_tcp_transport(self, index, listen_address, listen_port, tcp_config):
+        # with several receiver processes the kernel spreads new connections
+        # across them
+        sock = self._create_socket(listen_address, socket.SOCK_STREAM)
+        if sock.family == socket.AF_INET6:
+            domain_name = self._transport_domain(TCP6_DOMAIN_NAME, index)
+            self._transport_names[domain_name] = 'tcp6'
+        else:
+            domain_name = self._transport_domain(TCP_DOMAIN_NAME, index)
+            self._transport_names[domain_name] = 'tcp'
+        self._capture_transports[domain_name] = TRANSPORT_TCP
+        transport = TcpTransport(sock,
+                                 max_connections=tcp_config['max_connections'],
+                                 idle_timeout=tcp_config['idle_timeout'],
+                                 max_message_size=tcp_config['max_message_size'])
+        pysnmp.entity.config.addSocketTransport(self._snmp_engine, domain_name,
+            transport.openServerMode((listen_address, listen_port)))
+        self._snmp_engine.transportDispatcher.registerTimerCbFun(transport.close_idle,
+                                                                 self.TCP_IDLE_CHECK_INTERVAL)
+        self._tcp_transports.append(transport)
+        log.info("TrapReceiver: Initialized SNMP TCP Transport on %s:%s" % (listen_address, listen_port))
+
+    def _tcp_stats(self):
+        stats = {'connections': 0, 'max_connections': 0}
+        for transport in self._tcp_transports:
+            for key, value in transport.stats().items():
+                stats[key] += value
+        return stats
 
     def _configure_snmp_v2(self, community):
         # v1/2 setup
@@ -115,6 +256,67 @@ class TrapReceiver(object):
 
         log.debug("TrapReceiver: Initialized SNMPv3 Auth")
 
+    def _configure_fast_path(self, community):
+        # decode v2c traps ourselves and hand everything else to the engine
+        self._fast_path_community = community
+        log.debug("TrapReceiver: Initialized SNMPv2c fast path")
+
+    def _configure_capture(self, capture_config):
+        self._capture = TrapCaptureWriter(capture_config['path'],
+                                          capture_config['max_size'],
+                                          capture_config['max_files'])
+        # don't keep captured messages in the buffer for long
+        self._snmp_engine.transportDispatcher.registerTimerCbFun(self._flush_capture, self.CAPTURE_FLUSH_INTERVAL)
+        log.debug("TrapReceiver: Initialized capture to %s" % (capture_config['path']))
+
+    def _flush_capture(self, now):
+        self._capture.flush()
+
+    def _receive_message(self, transport_dispatcher, transport_domain, transport_address, message):
+        """
+        Receive callback of the transport dispatcher. Counts the message and
+        decodes it on the fast path if possible.
+        """
+        if self._capture is not None:
+            self._capture.write(time.time(), self._capture_transports.get(transport_domain, TRANSPORT_UDP),
+                                transport_address, message)
+
+        try:
+            version = decode_version(message)
+        except BerDecodeError:
+            # let the engine account for it
+            self._decode_errors.inc()
+            version = None
+        counter = self._received_counters.get((transport_domain, version))
+        if counter is None:
+            counter = metrics.counter(metric_name('traps', 'received',
+                                                  self._transport_names.get(transport_domain, 'other'),
+                                                  self.VERSION_NAMES.get(version, 'other')))
+            self._received_counters[(transport_domain, version)] = counter
+        counter.inc()
+
+        notification = None
+        if self._fast_path_community is not None and version == 1:
+            try:
+                notification = decode_v2c_trap(message)
+            except BerDecodeError, ex:
+                self._decode_errors.inc()
+                log.debug("TrapReceiver: Fast path failed to decode message from %s: %s" % (transport_address[0], ex))
+
+        if notification is None or notification[0] != self._fast_path_community:
+            # INFORMs, SNMPv1/v3 and unknown communities take the slow path
+            self._snmp_engine.msgAndPduDsp.receiveMessage(self._snmp_engine, transport_domain,
+                                                          transport_address, message)
+            return
+
+        self._fast_path_counter.inc()
+        community, var_binds = notification
+        for i, (oid, val) in enumerate(var_binds):
+            if oid == SNMP_TRAP_OID:
+                var_binds[i] = (oid, v2c.ObjectIdentifier(val))
+                break
+        self._handle_notification(transport_address, var_binds)
+
     def _create_trap(self, trap_oid, trap_arguments, trap_properties):
         # initialize trap
         return Trap(trap_oid, trap_arguments, **trap_properties)
@@ -123,19 +325,38 @@ class TrapReceiver(object):
         """
         Callback function for receiving notifications
         """
+        # get the source address for this notification
+        transportDomain, trap_source = snmp_engine.msgAndPduDsp.getTransportInfo(stateReference)
+        self._handle_notification(trap_source, varBinds)
+
+    def _rate_limited(self, trap_source, varBinds):
+        trap_oid = None
+        if self._rate_limiter.per_trap:
+            for oid, val in varBinds:
+                if oid == SNMP_TRAP_OID:
+                    trap_oid = tuple(val)
+                    break
+        return not self._rate_limiter.allow(trap_source[0], trap_oid)
+
+    def _handle_notification(self, trap_source, varBinds):
+        received = time.time()
         trap_oid = None
         trap_name = None
         trap_args = dict()
 
         try:
-            # get the source address for this notification
-            transportDomain, trap_source = snmp_engine.msgAndPduDsp.getTransportInfo(stateReference)
+            # drop traps over the rate limit before doing any real work
+            if self._rate_limiter is not None and self._rate_limited(trap_source, varBinds):
+                self._rate_limited_counter.inc()
+                return
+
             log.debug("TrapReceiver: Notification received from %s, %s" % (trap_source[0], trap_source[1]))
 
+            # translate all varBind OIDs to mib symbol/modname
+            varbind_symbols = self._mibs.lookup_oids([oid for oid, val in varBinds])
+
             # read all the varBinds
-            for oid, val in varBinds:
-                # translate OID to mib symbol/modname
-                (module, symbol) = self._mibs.lookup_oid(oid)
+            for (oid, val), (module, symbol) in zip(varBinds, varbind_symbols):
 
                 if module == "SNMPv2-MIB" and symbol == "snmpTrapOID":
                     # the SNMPv2-MIB::snmpTrapOID value is the trap oid
@@ -153,8 +374,11 @@ class TrapReceiver(object):
                 log.debug("TrapReceiver: Trap argument: %s, %s = %s" % (module, symbol, val))
 
             # get trap source info
-            trap_source_address, trap_source_port = trap_source
-            trap_source_hostname, trap_source_domain = get_hostname_from_address(trap_source_address)
+            trap_source_address, trap_source_port = trap_source[:2]
+            if self._resolver is not None:
+                trap_source_hostname, trap_source_domain = self._resolver.resolve(trap_source_address)
+            else:
+                trap_source_hostname, trap_source_domain = get_hostname_from_address(trap_source_address)
 
             # set trap propreties
             trap_properties = dict()
@@ -164,6 +388,7 @@ class TrapReceiver(object):
 
             # create trap
             trap = self._create_trap(trap_oid, trap_args, trap_properties)
+            trap.received = received
 
             # now that everything has been parsed, trigger the callback
             self._callback(trap)
@@ -171,6 +396,18 @@ class TrapReceiver(object):
         except Exception, ex:
             log.exception("Error handling SNMP notification")
 
+    @property
+    def transport_dispatcher(self):
+        return self._snmp_engine.transportDispatcher
+
+    def set_mibs(self, mibs):
+        # traps received from now on are resolved with the new MIBs
+        self._mibs = mibs
+
+    def stop(self):
+        if self._snmp_engine.transportDispatcher.jobsArePending():
+            self._snmp_engine.transportDispatcher.jobFinished(1)
+
     def run(self):
         # Register SNMP Application at the SNMP engine
         ntfrcv.NotificationReceiver(self._snmp_engine, self._notification_callback)
@@ -180,6 +417,8 @@ class TrapReceiver(object):
         # Run I/O dispatcher which would receive queries and send confirmations
         try:
             self._snmp_engine.transportDispatcher.runDispatcher()
-        except:
+        finally:
+            # release the listen sockets
             self._snmp_engine.transportDispatcher.closeDispatcher()
-            raise
+            if self._capture is not None:
+                self._capture.close()
@@ -0,0 +1,160 @@
+import threading
+import socket
+import time
+import Queue
+
+from sensu.snmp.log import log
+from sensu.snmp.util import LRUCache
+from sensu.snmp.util import split_hostname
+
+class HostnameResolver(object):
+    """
+    Resolves trap source addresses to (hostname, domain) tuples using a pool
+    of resolver threads, so a slow reverse DNS lookup never blocks the trap
+    receiver for longer than the configured timeout.
+
+    Results are cached for ttl seconds (negative_ttl seconds for failed
+    lookups). Expired entries are refreshed in the background while the
+    stale result is still returned. When a lookup misses its deadline, or
+    too many lookups are already in flight, the address itself is used.
+    """
+
+    def __init__(self, threads=4, max_pending=256, timeout=0.25, ttl=3600, negative_ttl=300, cache_size=10000):
+        self._threads = int(threads)
+        self._max_pending = int(max_pending)
+        self._timeout = float(timeout)
+        self._ttl = float(ttl)
+        self._negative_ttl = float(negative_ttl)
+
+        self._lock = threading.Lock()
+        self._cache = LRUCache(cache_size)
+        self._static = dict()
+        self._pending = dict()
+        self._requests = Queue.Queue()
+        self._workers = []
+
+        # stats
+        self.timeouts = 0
+        self.overflows = 0
+        self.failures = 0
+
+    def load_hosts_file(self, hosts_file):
+        """
+        Warm the cache from a hosts(5) style file. These entries never expire.
+        """
+        count = 0
+        fh = open(hosts_file, 'r')
+        try:
+            for line in fh:
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                fields = line.split()
+                if len(fields) < 2:
+                    continue
+                self._static[fields[0]] = split_hostname(fields[1])
+                count += 1
+        finally:
+            fh.close()
+        log.debug("HostnameResolver: Loaded %d addresses from %s" % (count, hosts_file))
+
+    def start(self):
+        for i in range(self._threads):
+            worker = threading.Thread(target=self._worker, name="%s-%d" % (self.__class__.__name__, i))
+            worker.setDaemon(True)
+            worker.start()
+            self._workers.append(worker)
+        log.debug("HostnameResolver: Started %d resolver threads" % (self._threads))
+
+    def stop(self):
+        for worker in self._workers:
+            self._requests.put(None)
+        self._workers = []
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats['pending'] = len(self._pending)
+        stats['timeouts'] = self.timeouts
+        stats['overflows'] = self.overflows
+        stats['failures'] = self.failures
+        return stats
+
+    def resolve(self, address):
+        if address in self._static:
+            return self._static[address]
+
+        now = time.time()
+        self._lock.acquire()
+        try:
+            entry = self._cache.get(address)
+            if entry is not None:
+                expires, result = entry
+                if expires <= now:
+                    # refresh in the background, keep using the stale result
+                    self._submit(address)
+                return result
+
+            event = self._submit(address)
+        finally:
+            self._lock.release()
+
+        if event is None:
+            return (address, address)
+
+        # wait for the lookup to finish
+        event.wait(self._timeout)
+
+        self._lock.acquire()
+        try:
+            entry = self._cache.pop(address)
+            if entry is not None:
+                self._cache.set(address, entry)
+                return entry[1]
+            self.timeouts += 1
+        finally:
+            self._lock.release()
+
+        log.debug("HostnameResolver: Lookup for %s timed out" % (address))
+        return (address, address)
+
+    def _submit(self, address):
+        # must be called with the lock held
+        event = self._pending.get(address)
+        if event is None:
+            if len(self._pending) >= self._max_pending:
+                self.overflows += 1
+                return None
+            event = threading.Event()
+            self._pending[address] = event
+            self._requests.put(address)
+        return event
+
+    def _lookup(self, address):
+        try:
+            hostname, aliaslist, ipaddrlist = socket.gethostbyaddr(address)
+            return split_hostname(hostname), self._ttl
+        except (socket.herror, socket.gaierror, socket.timeout):
+            self.failures += 1
+            return (address, address), self._negative_ttl
+
+    def _worker(self):
+        while True:
+            address = self._requests.get()
+            if address is None:
+                break
+
+            try:
+                result, ttl = self._lookup(address)
+            except Exception:
+                log.exception("HostnameResolver: Error resolving %s" % (address))
+                result, ttl = (address, address), self._negative_ttl
+
+            self._lock.acquire()
+            try:
+                self._cache.set(address, (time.time() + ttl, result))
+                event = self._pending.pop(address, None)
+            finally:
+                self._lock.release()
+
+            if event is not None:
+                event.set()
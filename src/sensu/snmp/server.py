@@ -1,57 +1,222 @@
+import os
 import time
-import simplejson as json
+import signal
+import socket
+import threading
+import multiprocessing
+import Queue
+
+from pysnmp.smi.error import NoSuchObjectError
 
 from sensu.snmp.log import log as LOG
+from sensu.snmp.config import load_config
 from sensu.snmp.mib import MibResolver
+from sensu.snmp.mibtable import mib_sources
+from sensu.snmp.resolver import HostnameResolver
 from sensu.snmp.handler import TrapHandler
+from sensu.snmp.handler import TrapHandlerIndex
+from sensu.snmp.bundle import trap_files
+from sensu.snmp.bundle import read_trap_files
+from sensu.snmp.bundle import bundle_key
+from sensu.snmp.bundle import load_bundle
+from sensu.snmp.bundle import save_bundle
+from sensu.snmp.coalesce import TrapEventCoalescer
+from sensu.snmp.ratelimit import TrapRateLimiter
+from sensu.snmp.event import TrapEvent
+from sensu.snmp.receiver import TrapReceiver
 from sensu.snmp.receiver import TrapReceiverThread
 from sensu.snmp.dispatcher import TrapEventDispatcherThread
+from sensu.snmp.eventloop import TrapEventLoopDispatcher
+from sensu.snmp.workers import TrapEventForwarder
+from sensu.snmp.workers import TrapReceiverWorker
+from sensu.snmp.workers import TrapReceiverWorkerStats
+from sensu.snmp.metrics import metrics
+from sensu.snmp.metrics import metric_name
+from sensu.snmp.metrics import flatten
+from sensu.snmp.metrics import to_graphite
+from sensu.snmp.metrics import MetricsServerThread
 from sensu.snmp.util import *
 
 class SensuTrapServer(object):
 
-    def __init__(self, config):
+    WAIT_INTERVAL = 1
+
+    IO_MODE_THREADS = 'threads'
+    IO_MODE_EVENT_LOOP = 'event-loop'
+    IO_MODES = (IO_MODE_THREADS, IO_MODE_EVENT_LOOP)
+
+    # sources listed by name in a rate limit summary event
+    RATE_LIMIT_SUMMARY_SOURCES = 10
+
+    def __init__(self, config, config_file=None):
         self._config = config
+        # trap handlers and MIBs are read again from here on reload
+        self._config_file = config_file
         self._run = False
+        self._stopped = threading.Event()
+        self._workers = []
+        self._traps_counter = metrics.counter('traps.handled')
+        self._unmatched_counter = metrics.counter('traps.unmatched')
+        self._events_counter = metrics.counter('events.generated')
+        self._reloads_counter = metrics.counter('reload.succeeded')
+        self._reload_errors_counter = metrics.counter('reload.failed')
+        self._reload_requested = False
+        self._reload_thread = None
+        self._reload_result = None
+        self._reload_failed = False
 
         # Configure MIBs
         self._configure_mibs()
 
-        # Initialize TrapReceiverThread
-        self._trap_receiver_thread = TrapReceiverThread(self._config, self._mibs, self._handle_trap)
+        # Configure HostnameResolver
+        self._configure_resolver()
+
+        # Configure TrapEventCoalescer
+        self._coalesce_window = float(self._config['coalesce']['window'])
+        self._coalescer = TrapEventCoalescer(self._config['coalesce']['max_entries'])
+
+        # Configure TrapRateLimiter
+        self._configure_rate_limiter()
+
+        self._io_mode = self._config['daemon']['io_mode']
+        if self._io_mode not in self.IO_MODES:
+            raise ValueError("Unknown io mode: %s" % (self._io_mode))
+
+        # Initialize TrapReceiverThread. With several workers every worker
+        # process runs its own receiver instead.
+        self._worker_count = int(self._config['daemon']['workers'])
+        self._trap_receiver = None
+        self._trap_receiver_thread = None
+        if self._worker_count > 1:
+            if self._io_mode == self.IO_MODE_EVENT_LOOP:
+                LOG.warning("SensuTrapServer: The event-loop io mode is not supported with workers. Using threads")
+                self._io_mode = self.IO_MODE_THREADS
+        elif self._io_mode == self.IO_MODE_EVENT_LOOP:
+            # receive and dispatch from the main thread
+            self._trap_receiver = TrapReceiver(self._config, self._mibs, self._handle_trap, self._resolver,
+                                               rate_limiter=self._rate_limiter)
+        else:
+            self._trap_receiver_thread = TrapReceiverThread(self._config, self._mibs, self._handle_trap, self._resolver,
+                                                            rate_limiter=self._rate_limiter)
 
         # Initialize TrapEventDispatcher
-        self._trap_event_dispatcher_thread = TrapEventDispatcherThread(self._config)
+        if self._io_mode == self.IO_MODE_EVENT_LOOP:
+            self._trap_event_dispatcher_thread = TrapEventLoopDispatcher(self._config,
+                                                                         self._trap_receiver.transport_dispatcher)
+        else:
+            self._trap_event_dispatcher_thread = TrapEventDispatcherThread(self._config)
 
         # Configure Trap Handlers
-        self._trap_handlers = self._parse_trap_handlers(self._config['daemon']['trap_file'])
+        self._trap_handler_configs, self._trap_handlers = self._load_trap_handlers(self._config['daemon'], self._mibs)
+        self._trap_handler_index = TrapHandlerIndex(self._trap_handlers, self._config['daemon']['trap_match'])
+        self._matched_counters = dict((trap_handler_id, metrics.counter(metric_name('traps', 'matched', trap_handler_id)))
+                                      for trap_handler_id in self._trap_handlers)
+
+        # Configure metrics
+        self._register_metrics()
+        self._configure_metrics_reporting()
 
         LOG.debug("SensuTrapServer: Initialized")
 
     def _configure_mibs(self):
-        self._mibs = MibResolver(self._config['mibs']['paths'], self._config['mibs']['mibs'])
+        self._mibs = MibResolver(self._config['mibs']['paths'],
+                                 self._config['mibs']['mibs'],
+                                 int(self._config['mibs']['cache_size']),
+                                 self._config['mibs']['table'])
+
+    def _configure_resolver(self):
+        resolver_config = self._config['resolver']
+        if not resolver_config['enabled']:
+            # resolve trap sources inline
+            self._resolver = None
+            return
+
+        self._resolver = HostnameResolver(resolver_config['threads'],
+                                          resolver_config['max_pending'],
+                                          resolver_config['timeout'],
+                                          resolver_config['ttl'],
+                                          resolver_config['negative_ttl'],
+                                          resolver_config['cache_size'])
+        if resolver_config['hosts_file']:
+            self._resolver.load_hosts_file(resolver_config['hosts_file'])
+
+    def _configure_rate_limiter(self):
+        rate_limit_config = self._config['rate_limit']
+        self._rate_limit_reported = False
+        self._rate_limit_summary_at = time.time() + float(rate_limit_config['summary_interval'])
+        if not rate_limit_config['enabled']:
+            self._rate_limiter = None
+            return
+
+        self._rate_limiter = TrapRateLimiter(rate_limit_config['rate'],
+                                             rate_limit_config['burst'],
+                                             rate_limit_config['max_sources'],
+                                             bool(rate_limit_config['per_trap']))
+        self._rate_limit_severity = parse_event_severity(rate_limit_config['summary_severity'])
+
+    def _register_metrics(self):
+        metrics.gauge('mib_cache', self._mibs.cache_stats)
+        metrics.gauge('coalescer', self._coalescer.stats)
+        metrics.gauge('dispatcher', self._trap_event_dispatcher_thread.stats)
+        if self._rate_limiter is not None:
+            metrics.gauge('rate_limit', self._rate_limiter.stats)
+        if self._resolver is not None:
+            metrics.gauge('resolver', self._resolver.stats)
+
+    def _configure_metrics_reporting(self):
+        stats_config = self._config['stats']
+        self._metrics_server_thread = None
+        if stats_config['enabled']:
+            self._metrics_server_thread = MetricsServerThread(stats_config['listen_address'],
+                                                              stats_config['listen_port'],
+                                                              self.stats)
+
+        # report metrics to Sensu as a metric check result
+        self._metrics_interval = float(stats_config['metrics_interval'])
+        self._metrics_reported_at = time.time()
+        self._metrics_prefix = stats_config['metrics_prefix']
+        if not self._metrics_prefix:
+            self._metrics_prefix = metric_name(socket.gethostname().split('.')[0], 'sensu-trapd')
+
+    def _load_trap_handlers(self, daemon_config, mibs, previous=None):
+        """
+        Loads the trap handlers of the trap file and trap directory. Returns
+        the trap handler definitions and the TrapHandlers. previous is the
+        (trap handler configs, trap handlers) tuple of the current table,
+        whose handlers are reused if their definition didn't change.
+        """
+        files = trap_files(daemon_config['trap_file'], daemon_config['trap_dir'])
+        trap_handler_configs, digests = read_trap_files(files)
+
+        # symbols resolved before with the same trap files and MIBs
+        bundle = daemon_config['trap_bundle']
+        resolved = None
+        if bundle:
+            key = bundle_key(digests, mibs.sources())
+            resolved = load_bundle(bundle, key)
 
-    def _parse_trap_handlers(self, trap_file):
-        # TODO: Support multiple trap files
-        LOG.debug("SensuTrapServer: Parsing trap handler file: %s" % (trap_file))
         trap_handlers = dict()
-        try:
-            fh = open(trap_file, 'r')
-            trap_file_data = json.load(fh)
-            for trap_handler_id, trap_handler_config in trap_file_data.items():
-                # Load TrapHandler
-                trap_handler = self._load_trap_handler(trap_handler_id, trap_handler_config)
-                trap_handlers[trap_handler_id] = trap_handler
-                LOG.debug("SensuTrapServer: Parsed trap handler: %s" % (trap_handler_id))
-        finally:
-            fh.close()
-        return trap_handlers
-
-    def _load_trap_handler(self, trap_handler_id, trap_handler_config):
+        for trap_handler_id, trap_handler_config in trap_handler_configs.items():
+            if previous is not None and previous[0].get(trap_handler_id) == trap_handler_config:
+                trap_handlers[trap_handler_id] = previous[1][trap_handler_id]
+                continue
+            # Load TrapHandler
+            trap_handler = self._load_trap_handler(trap_handler_id, trap_handler_config, mibs,
+                                                   resolved.get(trap_handler_id) if resolved else None)
+            trap_handlers[trap_handler_id] = trap_handler
+            LOG.debug("SensuTrapServer: Parsed trap handler: %s" % (trap_handler_id))
+
+        if bundle and resolved is None:
+            save_bundle(bundle, key, dict((trap_handler_id, (trap_handler.trap_type, trap_handler.trap_args))
+                                          for trap_handler_id, trap_handler in trap_handlers.items()))
+        LOG.info("SensuTrapServer: Loaded %d trap handlers from %d file(s)" % (len(trap_handlers), len(files)))
+        return trap_handler_configs, trap_handlers
+
+    def _resolve_trap_handler(self, trap_handler_config, mibs):
         # Parse trap type
         trap_type_module, trap_type_symbol = tuple(trap_handler_config['trap']['type'])
         # TODO: handle OIDs as trap types
-        trap_type_oid = self._mibs.lookup(trap_type_module, trap_type_symbol)
+        trap_type_oid = mibs.lookup(trap_type_module, trap_type_symbol)
 
         #LOG.debug("%s type=%s::%s (%r)" % (trap_handler_id, trap_type_module, trap_type_symbol, trap_type_oid))
 
@@ -61,7 +226,7 @@ class SensuTrapServer(object):
             for trap_arg, trap_arg_type in trap_handler_config['trap']['args'].items():
                 trap_arg_type_module, trap_arg_type_symbol = tuple(trap_arg_type)
                 # TODO: handle OIDs as trap arg type
-                trap_arg_type_oid = self._mibs.lookup(trap_arg_type_module, trap_arg_type_symbol)
+                trap_arg_type_oid = mibs.lookup(trap_arg_type_module, trap_arg_type_symbol)
                 trap_args[trap_arg_type_oid] = trap_arg
 
                 #LOG.debug("%s arg=%s type=%s::%s (%r)" % (trap_handler_id,
@@ -69,23 +234,50 @@ class SensuTrapServer(object):
                 #                                            trap_arg_type_module,
                 #                                            trap_arg_type_symbol,
                 #                                            trap_arg_type_oid))
+        return trap_type_oid, trap_args
+
+    def _load_trap_handler(self, trap_handler_id, trap_handler_config, mibs=None, resolved=None):
+        if mibs is None:
+            mibs = self._mibs
+
+        # resolved is the (trap type OID, trap args) tuple from a bundle
+        if resolved is None:
+            resolved = self._resolve_trap_handler(trap_handler_config, mibs)
+        trap_type_oid, trap_args = resolved
 
         # Parse event info
         event_name = trap_handler_config['event']['name']
         event_output = trap_handler_config['event']['output']
         event_handlers = trap_handler_config['event']['handlers']
-        event_severity = parse_event_severity(trap_handler_config['event']['severity'])
+        try:
+            event_severity = parse_event_severity(trap_handler_config['event']['severity'])
+        except ValueError, e:
+            raise ValueError("Invalid trap handler %s: %s" % (trap_handler_id, e))
+
+        # Parse priority (higher priority handlers are matched first)
+        priority = int(trap_handler_config.get('priority', 0))
+
+        # Parse coalesce window (defaults to coalesce.window)
+        coalesce_window = trap_handler_config.get('coalesce')
+        if coalesce_window is not None:
+            coalesce_window = float(coalesce_window)
 
-        # TODO: parse predicates
+        # Parse predicates (compiled by the TrapHandler)
+        predicates = trap_handler_config.get('predicates')
 
         # Initialize TrapHandler
-        trap_handler = TrapHandler(trap_type_oid,
-                                    trap_args,
-                                    event_name,
-                                    event_output,
-                                    event_handlers,
-                                    event_severity,
-                                    None)
+        try:
+            trap_handler = TrapHandler(trap_type_oid,
+                                        trap_args,
+                                        event_name,
+                                        event_output,
+                                        event_handlers,
+                                        event_severity,
+                                        predicates,
+                                        priority,
+                                        coalesce_window)
+        except ValueError, e:
+            raise ValueError("Invalid trap handler %s: %s" % (trap_handler_id, e))
         return trap_handler
 
     def _dispatch_trap_event(self, trap_event):
@@ -93,44 +285,445 @@ class SensuTrapServer(object):
 
     def _handle_trap(self, trap):
         LOG.info("SensuTrapServer: Received Trap: %s" % (trap))
+        self._traps_counter.inc()
+
+        # Find TrapHandlers for this Trap
+        trap_handlers = self._trap_handler_index.match(trap)
+        if not trap_handlers:
+            self._unmatched_counter.inc()
+            LOG.warning("No trap handler found for %r" % (trap))
+            return
 
-        # Find TrapHandler for this Trap 
-        trap_handler = None
-        for trap_handler_id, th in self._trap_handlers.items():
-            if th.handles(trap):
-                LOG.info("SensuTrapServer: %s handling trap %r" % (trap_handler_id, trap))
-                # Transform Trap
-                trap_event = th.transform(trap)
+        for trap_handler_id, trap_handler in trap_handlers:
+            LOG.info("SensuTrapServer: %s handling trap %r" % (trap_handler_id, trap))
+            self._matched_counters[trap_handler_id].inc()
+            # Transform Trap
+            trap_event = trap_handler.transform(trap)
+            self._events_counter.inc()
+
+            # Coalesce repeated TrapEvents
+            coalesce_window = trap_handler.coalesce_window
+            if coalesce_window is None:
+                coalesce_window = self._coalesce_window
+            if coalesce_window <= 0:
+                self._dispatch_trap_event(trap_event)
+                continue
+            for trap_event in self._coalescer.coalesce(trap_event, coalesce_window):
                 # Dispatch TrapEvent
                 self._dispatch_trap_event(trap_event)
-                return
-        LOG.warning("No trap handler found for %r" % (trap))
+
+    def _run_periodic_tasks(self, now=None):
+        if now is None:
+            now = time.time()
+        self._run_periodic_task(self._check_reload)
+        self._run_periodic_task(self._flush_coalescer, now)
+        if self._rate_limiter is not None and now >= self._rate_limit_summary_at:
+            self._rate_limit_summary_at = now + float(self._config['rate_limit']['summary_interval'])
+            self._run_periodic_task(self._report_rate_limit)
+        if self._metrics_interval > 0 and now - self._metrics_reported_at >= self._metrics_interval:
+            self._metrics_reported_at = now
+            self._run_periodic_task(self._report_metrics, now)
+
+    def _run_periodic_task(self, task, *args):
+        # a failing task must neither stop the main loop nor the other tasks
+        try:
+            task(*args)
+        except Exception:
+            LOG.exception("SensuTrapServer: Error running periodic task %s" % (task.__name__))
+
+    def _report_metrics(self, now):
+        stats_config = self._config['stats']
+        trap_event = TrapEvent(stats_config['metrics_name'],
+                               to_graphite(self.stats(), self._metrics_prefix, now),
+                               TrapEvent.EVENT_SEVERITY['OK'],
+                               stats_config['metrics_handlers'])
+        trap_event.type = 'metric'
+        self._dispatch_trap_event(trap_event)
+
+    def _report_rate_limit(self):
+        total, sources = self._rate_limiter.summarize()
+        if not total and not self._rate_limit_reported:
+            return
+
+        if total:
+            # report the sources with the most suppressed traps
+            reports = []
+            reported = 0
+            for source, trap_oid, count in sources[:self.RATE_LIMIT_SUMMARY_SOURCES]:
+                if trap_oid is not None:
+                    try:
+                        source = "%s (%s::%s)" % ((source,) + tuple(self._mibs.lookup_oid(trap_oid)))
+                    except NoSuchObjectError:
+                        # a trap no loaded MIB defines
+                        source = "%s (%s)" % (source, ".".join([str(i) for i in trap_oid]))
+                reports.append("%d traps from %s suppressed" % (count, source))
+                reported += count
+            if total > reported:
+                reports.append("%d traps from other sources suppressed" % (total - reported))
+            output = ", ".join(reports)
+            status = self._rate_limit_severity
+        else:
+            # resolve the previous summary
+            output = "No traps suppressed"
+            status = TrapEvent.EVENT_SEVERITY['OK']
+        self._rate_limit_reported = bool(total)
+
+        LOG.info("SensuTrapServer: Rate limit summary: %s" % (output))
+        self._dispatch_trap_event(TrapEvent(self._config['rate_limit']['summary_name'],
+                                            output,
+                                            status,
+                                            self._config['rate_limit']['summary_handlers']))
+
+    def _flush_coalescer(self, now=None, force=False):
+        # dispatch the summaries of expired coalesce windows
+        for trap_event in self._coalescer.flush(now, force):
+            self._dispatch_trap_event(trap_event)
+
+    def request_reload(self):
+        """
+        Asks for the trap handlers (and MIBs) to be reloaded. This is safe to
+        call from a signal handler, the reload is started by the periodic
+        tasks.
+        """
+        self._reload_requested = True
+
+    def _check_reload(self):
+        # swap in the trap handlers of a finished reload
+        if self._reload_thread is not None and not self._reload_thread.isAlive():
+            self._reload_thread = None
+            self._apply_reload(*self._reload_result)
+
+        if not self._reload_requested or self._reload_thread is not None:
+            return
+        self._reload_requested = False
+        if self._workers:
+            # every worker reloads its own trap handlers
+            for worker in self._workers:
+                if worker.is_alive():
+                    os.kill(worker.pid, signal.SIGHUP)
+            return
+
+        # traps are still handled by the current trap handlers while the new
+        # ones are loaded
+        LOG.info("SensuTrapServer: Reloading trap handlers")
+        self._reload_thread = threading.Thread(target=self._run_reload, name="TrapHandlerReloader")
+        self._reload_thread.setDaemon(True)
+        self._reload_thread.start()
+
+    def _run_reload(self):
+        try:
+            self._reload_result = (self._prepare_reload(), None)
+        except Exception, e:
+            LOG.debug("SensuTrapServer: Reload failed", exc_info=True)
+            self._reload_result = (None, e)
+
+    def reload(self):
+        """
+        Reloads the trap handlers and MIBs right away. Returns whether the
+        new trap handlers are in use.
+        """
+        try:
+            prepared = self._prepare_reload()
+        except Exception, e:
+            return self._apply_reload(None, e)
+        return self._apply_reload(prepared, None)
+
+    @staticmethod
+    def _mibs_added(current, sources):
+        # whether MIBs were only added, so trap handlers don't change
+        return (set(current['paths']).issubset(sources['paths']) and
+                set(current['mibs']).issubset(sources['mibs']) and
+                current['pysnmp'] == sources['pysnmp'] and
+                all(sources['files'].get(filename) == mtime for filename, mtime in current['files'].items()))
+
+    def _prepare_reload(self):
+        """
+        Loads the trap handlers (and MIBs if they changed) of the config file
+        without touching the ones in use.
+        """
+        config = self._config
+        if self._config_file is not None:
+            config = load_config(self._config_file)
+
+        mibs = self._mibs
+        previous = (self._trap_handler_configs, self._trap_handlers)
+        mibs_config = config['mibs']
+        sources = mib_sources(MibResolver.DEFAULT_MIB_PATHS + mibs_config['paths'],
+                              MibResolver.DEFAULT_MIB_LIST + mibs_config['mibs'])
+        if sources != self._mibs.sources():
+            LOG.info("SensuTrapServer: Reloading MIBs")
+            if not self._mibs_added(self._mibs.sources(), sources):
+                # loaded MIBs changed, every trap handler is loaded again
+                previous = None
+            mibs = MibResolver(mibs_config['paths'],
+                               mibs_config['mibs'],
+                               int(mibs_config['cache_size']),
+                               mibs_config['table'])
+
+        trap_handler_configs, trap_handlers = self._load_trap_handlers(config['daemon'], mibs, previous)
+        trap_handler_index = TrapHandlerIndex(trap_handlers, config['daemon']['trap_match'])
+        return config, mibs, trap_handler_configs, trap_handlers, trap_handler_index
+
+    def _apply_reload(self, prepared, error):
+        if error is not None:
+            self._reload_errors_counter.inc()
+            LOG.error("SensuTrapServer: Failed to reload trap handlers, keeping the current ones: %s" % (error))
+            self._reload_failed = True
+            self._report_reload("Failed to reload trap handlers: %s" % (error),
+                                parse_event_severity(self._config['reload']['event_severity']))
+            return False
+
+        config, mibs, trap_handler_configs, trap_handlers, trap_handler_index = prepared
+        loaded = len([trap_handler for trap_handler_id, trap_handler in trap_handlers.items()
+                      if self._trap_handlers.get(trap_handler_id) is not trap_handler])
+
+        # counters first, the receiver may match traps with the new index
+        # right away
+        for trap_handler_id in trap_handlers:
+            if trap_handler_id not in self._matched_counters:
+                self._matched_counters[trap_handler_id] = metrics.counter(metric_name('traps', 'matched', trap_handler_id))
+        if mibs is not self._mibs:
+            self._mibs = mibs
+            for trap_receiver in (self._trap_receiver, self._trap_receiver_thread):
+                if trap_receiver is not None:
+                    trap_receiver.set_mibs(mibs)
+            metrics.gauge('mib_cache', mibs.cache_stats)
+            self._config['mibs'] = config['mibs']
+        self._trap_handler_configs = trap_handler_configs
+        self._trap_handlers = trap_handlers
+        self._trap_handler_index = trap_handler_index
+        self._config['daemon']['trap_file'] = config['daemon']['trap_file']
+        self._config['daemon']['trap_dir'] = config['daemon']['trap_dir']
+        self._config['daemon']['trap_bundle'] = config['daemon']['trap_bundle']
+        self._config['daemon']['trap_match'] = config['daemon']['trap_match']
+
+        self._reloads_counter.inc()
+        LOG.info("SensuTrapServer: Reloaded %d trap handlers (%d loaded again)" % (len(trap_handlers), loaded))
+        if self._reload_failed:
+            # resolve the failure reported before
+            self._reload_failed = False
+            self._report_reload("Reloaded %d trap handlers" % (len(trap_handlers)), TrapEvent.EVENT_SEVERITY['OK'])
+        return True
+
+    def _report_reload(self, output, status):
+        self._dispatch_trap_event(TrapEvent(self._config['reload']['event_name'],
+                                            output,
+                                            status,
+                                            self._config['reload']['event_handlers']))
+
+    def stats(self):
+        """
+        Returns the metrics of this process as a flat dict, along with the
+        totals of the worker processes.
+        """
+        stats = metrics.snapshot()
+        if self._workers:
+            flatten('workers', self._worker_stats.stats()['total'], stats)
+        return stats
+
+    def worker_stats(self):
+        return self._worker_stats.stats()
+
+    def _start_workers(self):
+        self._worker_messages = multiprocessing.Queue()
+        self._worker_stop = multiprocessing.Event()
+        self._worker_stats = TrapReceiverWorkerStats()
+
+        # fork the workers before starting any threads
+        for worker_id in range(self._worker_count):
+            worker = TrapReceiverWorker(worker_id, self, self._worker_messages, self._worker_stop)
+            worker.start()
+            self._workers.append(worker)
+            LOG.info("SensuTrapServer: Started %s (pid %d)" % (worker.name, worker.pid))
+
+        self._worker_collector_thread = threading.Thread(target=self._collect_worker_messages,
+                                                         name="TrapReceiverWorkerCollector")
+        self._worker_collector_thread.setDaemon(True)
+        self._worker_collector_thread.start()
+
+    def _stop_workers(self):
+        self._worker_stop.set()
+        for worker in self._workers:
+            worker.join(float(self._config['daemon']['worker_shutdown_timeout']))
+            if worker.is_alive():
+                LOG.warning("SensuTrapServer: %s did not stop. Terminating" % (worker.name))
+                worker.terminate()
+                worker.join()
+        self._worker_collector_thread.join()
+
+    def _collect_worker_messages(self):
+        # receive events and stats from the worker processes until they have
+        # all exited and the queue is drained
+        while True:
+            try:
+                message = self._worker_messages.get(True, self.WAIT_INTERVAL)
+            except Queue.Empty:
+                if self._run or [worker for worker in self._workers if worker.is_alive()]:
+                    continue
+                break
+            except (EOFError, IOError):
+                break
+
+            message_type, worker_id, payload = message
+            if message_type == 'event':
+                self._dispatch_trap_event(payload)
+            elif message_type == 'stats':
+                self._worker_stats.update(worker_id, payload)
+
+    def _run_worker(self, worker_id, messages, stop_event):
+        """
+        Main loop of a TrapReceiverWorker process.
+        """
+        # the workers forked before this one belong to the parent process
+        self._workers = []
+
+        worker_config = dict(self._config)
+        if worker_config['snmp']['capture']['enabled']:
+            # workers can't share a capture file
+            worker_config['snmp'] = dict(self._config['snmp'])
+            worker_config['snmp']['capture'] = dict(self._config['snmp']['capture'])
+            worker_config['snmp']['capture']['path'] = "%s.worker-%d" % (worker_config['snmp']['capture']['path'],
+                                                                         worker_id)
+
+        # dispatch events in the parent process or from every worker
+        if self._config['daemon']['worker_dispatch'] == 'local':
+            worker_config['dispatcher'] = dict(self._config['dispatcher'])
+            if worker_config['dispatcher']['spool_dir']:
+                # workers can't share a spool
+                worker_config['dispatcher']['spool_dir'] = os.path.join(worker_config['dispatcher']['spool_dir'],
+                                                                         "worker-%d" % (worker_id))
+            self._trap_event_dispatcher_thread = TrapEventDispatcherThread(worker_config)
+            self._trap_event_dispatcher_thread.start()
+        else:
+            self._trap_event_dispatcher_thread = TrapEventForwarder(worker_id, messages)
+
+        # the inherited gauge reads the dispatcher of the parent process
+        if isinstance(self._trap_event_dispatcher_thread, TrapEventDispatcherThread):
+            metrics.gauge('dispatcher', self._trap_event_dispatcher_thread.stats)
+        else:
+            metrics.remove_gauge('dispatcher')
+
+        if self._resolver is not None:
+            self._resolver.start()
+
+        self._trap_receiver_thread = TrapReceiverThread(worker_config, self._mibs, self._handle_trap,
+                                                        self._resolver, reuse_port=True,
+                                                        rate_limiter=self._rate_limiter)
+        self._trap_receiver_thread.start()
+
+        # report stats until the parent stops the workers
+        stats_interval = float(self._config['daemon']['worker_stats_interval'])
+        stats_reported = time.time()
+        self._metrics_interval = 0
+        while not stop_event.is_set():
+            stop_event.wait(self.WAIT_INTERVAL)
+            self._run_periodic_tasks()
+            if time.time() - stats_reported >= stats_interval or stop_event.is_set():
+                messages.put(('stats', worker_id, self.stats()))
+                stats_reported = time.time()
+
+        self._trap_receiver_thread.stop()
+        self._trap_receiver_thread.join()
+        self._flush_coalescer(force=True)
+        if isinstance(self._trap_event_dispatcher_thread, TrapEventDispatcherThread):
+            self._trap_event_dispatcher_thread.stop()
+            self._trap_event_dispatcher_thread.join()
+        if self._resolver is not None:
+            self._resolver.stop()
+
+    def _run_event_loop(self):
+        # Start HostnameResolver
+        if self._resolver is not None:
+            self._resolver.start()
+
+        # Start MetricsServerThread
+        if self._metrics_server_thread is not None:
+            self._metrics_server_thread.start()
+
+        # Receive traps and dispatch events until stopped
+        self._trap_receiver.transport_dispatcher.registerTimerCbFun(self._run_periodic_tasks, self.WAIT_INTERVAL)
+        self._trap_receiver.run()
+        self._flush_coalescer(force=True)
+        self._trap_event_dispatcher_thread.drain()
+
+        # Stop HostnameResolver
+        if self._resolver is not None:
+            self._resolver.stop()
 
     def stop(self):
         if not self._run:
             return
         self._run = False
+        self._stopped.set()
+
+        # Stop MetricsServerThread
+        if self._metrics_server_thread is not None:
+            self._metrics_server_thread.stop()
+
+        if self._workers:
+            # Stop TrapReceiverWorkers. The TrapEventDispatcherThread is
+            # stopped once their remaining events have been collected.
+            self._worker_stop.set()
+            return
+
+        if self._trap_receiver is not None:
+            # Stop the event loop. Queued events are dispatched before run()
+            # returns.
+            self._trap_receiver.stop()
+            self._trap_event_dispatcher_thread.stop()
+            return
 
         # Stop TrapReceiverThread
         self._trap_receiver_thread.stop()
 
+        # Dispatch the summaries of all coalesce windows
+        self._flush_coalescer(force=True)
+
         # Stop TrapEventDispatcherThread
         self._trap_event_dispatcher_thread.stop()
 
+        # Stop HostnameResolver
+        if self._resolver is not None:
+            self._resolver.stop()
+
     def run(self):
         LOG.debug("SensuTrapServer: Started")
         self._run = True
 
-        # Start TrapReceiverThread
-        self._trap_receiver_thread.start()
+        if self._trap_receiver is not None:
+            self._run_event_loop()
+            LOG.debug("SensuTrapServer: Exiting")
+            return
+
+        if self._worker_count > 1:
+            # Start TrapReceiverWorkers
+            self._start_workers()
+        else:
+            # Start HostnameResolver
+            if self._resolver is not None:
+                self._resolver.start()
+
+            # Start TrapReceiverThread
+            self._trap_receiver_thread.start()
 
         # Start TrapEventDispatcherThread
         self._trap_event_dispatcher_thread.start()
 
-        while self._run:
-            time.sleep(1)
+        # Start MetricsServerThread
+        if self._metrics_server_thread is not None:
+            self._metrics_server_thread.start()
 
-        # Wait for our threads to stop
-        self._trap_receiver_thread.join()
+        # Wait until stopped. A timeout is used so the main thread is still
+        # able to handle signals while waiting.
+        while not self._stopped.isSet():
+            self._stopped.wait(self.WAIT_INTERVAL)
+            self._run_periodic_tasks()
+
+        # Wait for our threads and workers to stop
+        if self._workers:
+            self._stop_workers()
+            self._trap_event_dispatcher_thread.stop()
+        else:
+            self._trap_receiver_thread.join()
         self._trap_event_dispatcher_thread.join()
         LOG.debug("SensuTrapServer: Exiting")
@@ -0,0 +1,104 @@
+import os
+import sys
+import socket
+
+from sensu.snmp.log import log
+from sensu.snmp.metrics import metrics
+
+# the kernel's tables of UDP sockets
+PROC_NET_UDP = ('/proc/net/udp', '/proc/net/udp6')
+
+def socket_inode(sock):
+    # the inode identifies a socket in /proc/net/*
+    return os.fstat(sock.fileno()).st_ino
+
+def set_receive_buffer(sock, size, name=None):
+    """
+    Sets the receive buffer size of a socket. Returns the size the kernel
+    granted, which net.core.rmem_max may cap (logged as a warning).
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    granted = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    if sys.platform.startswith('linux'):
+        # linux doubles the size set to account for its bookkeeping overhead
+        # and reports the doubled size
+        granted //= 2
+    if granted < size:
+        log.warning("set_receive_buffer: Receive buffer of %s limited to %d of %d bytes, see net.core.rmem_max" %
+                    (name or sock.getsockname()[0], granted, size))
+    return granted
+
+def read_udp_socket_stats(paths=PROC_NET_UDP):
+    """
+    Reads the receive queue length (in bytes) and the drop count of every
+    UDP socket from /proc/net/udp and /proc/net/udp6. Returns a dict of
+    (rx_queue, drops) tuples keyed by socket inode. Missing tables are
+    skipped.
+    """
+    stats = dict()
+    for path in paths:
+        try:
+            fh = open(path, 'r')
+        except IOError:
+            continue
+        try:
+            lines = fh.readlines()
+        finally:
+            fh.close()
+        # sl local_address rem_address st tx_queue:rx_queue tr:tm->when
+        # retrnsmt uid timeout inode ref pointer drops
+        for line in lines[1:]:
+            fields = line.split()
+            if len(fields) < 13:
+                continue
+            try:
+                rx_queue = int(fields[4].split(':')[1], 16)
+                stats[int(fields[9])] = (rx_queue, int(fields[12]))
+            except (IndexError, ValueError):
+                continue
+    return stats
+
+
+class UdpSocketMonitor(object):
+    """
+    Watches the kernel counters of the receiver's UDP sockets: the bytes
+    waiting in their receive queues and the datagrams dropped because a
+    receive buffer was full, which the receiver never sees otherwise.
+    """
+
+    def __init__(self, paths=PROC_NET_UDP):
+        self._paths = paths
+        # (name, inode, receive buffer size)
+        self._sockets = []
+        self._drops = dict()
+        self._stats = dict()
+        self._drops_counter = metrics.counter('udp.kernel_drops')
+
+    def add_socket(self, name, sock):
+        rcvbuf = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        self._sockets.append((name, socket_inode(sock), rcvbuf))
+
+    def check(self, now=None):
+        """
+        Reads the counters of the sockets and counts the datagrams dropped
+        since the last check. Also a timer callback.
+        """
+        found = read_udp_socket_stats(self._paths)
+        stats = dict()
+        for name, inode, rcvbuf in self._sockets:
+            if inode not in found:
+                continue
+            rx_queue, drops = found[inode]
+            dropped = drops - self._drops.get(name, 0)
+            if dropped > 0:
+                self._drops_counter.inc(dropped)
+                log.warning("UdpSocketMonitor: Kernel dropped %d datagrams on %s, receive buffer is %d bytes" %
+                            (dropped, name, rcvbuf))
+            self._drops[name] = drops
+            stats[name] = {'rx_queue': rx_queue,
+                           'drops': drops,
+                           'rcvbuf': rcvbuf}
+        self._stats = stats
+
+    def stats(self):
+        return self._stats
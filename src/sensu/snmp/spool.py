@@ -0,0 +1,157 @@
+import os
+import re
+
+from sensu.snmp.log import log
+from sensu.snmp.event import TrapEvent
+
+class EventSpool(object):
+    """
+    Append-only on-disk spool for TrapEvents.
+
+    Events are stored as newline terminated JSON records in numbered segment
+    files. Reading the spool does not remove anything; once spooled events
+    were dispatched their position is acknowledged, which writes a
+    checkpoint and deletes fully consumed segments. After a restart the
+    spool is replayed from the last checkpoint.
+    """
+
+    SEGMENT_FORMAT = "segment-%010d.spool"
+    SEGMENT_PATTERN = re.compile(r'^segment-(\d+)\.spool$')
+    CHECKPOINT_FILE = "checkpoint"
+    DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, spool_dir, segment_size=DEFAULT_SEGMENT_SIZE):
+        self._spool_dir = spool_dir
+        self._segment_size = int(segment_size)
+        self._write_fh = None
+        self._read_fh = None
+
+        if not os.path.isdir(self._spool_dir):
+            os.makedirs(self._spool_dir)
+
+        # find existing segments
+        self._segments = sorted([int(m.group(1)) for m in
+                                 [self.SEGMENT_PATTERN.match(f) for f in os.listdir(self._spool_dir)] if m])
+        if not self._segments:
+            self._segments = [0]
+
+        # restore read position
+        self._read_segment, self._read_offset = self._read_checkpoint()
+        if self._read_segment not in self._segments:
+            self._read_segment, self._read_offset = self._segments[0], 0
+
+        self._repair()
+        log.debug("EventSpool: Opened %s at segment %d offset %d" % (self._spool_dir, self._read_segment, self._read_offset))
+
+    def _segment_path(self, segment):
+        return os.path.join(self._spool_dir, self.SEGMENT_FORMAT % (segment))
+
+    def _checkpoint_path(self):
+        return os.path.join(self._spool_dir, self.CHECKPOINT_FILE)
+
+    def _read_checkpoint(self):
+        try:
+            fh = open(self._checkpoint_path(), 'r')
+            try:
+                segment, offset = fh.read().split()
+                return int(segment), int(offset)
+            finally:
+                fh.close()
+        except (IOError, ValueError):
+            return self._segments[0], 0
+
+    def _repair(self):
+        # drop a partially written record at the end of the last segment
+        path = self._segment_path(self._segments[-1])
+        if not os.path.exists(path):
+            return
+        fh = open(path, 'rb+')
+        try:
+            data = fh.read()
+            end = data.rfind("\n") + 1
+            if end < len(data):
+                log.warning("EventSpool: Truncating partial record in %s" % (path))
+                fh.truncate(end)
+        finally:
+            fh.close()
+
+    def _write_end(self):
+        path = self._segment_path(self._segments[-1])
+        if os.path.exists(path):
+            return os.path.getsize(path)
+        return 0
+
+    def is_empty(self):
+        return self._read_segment == self._segments[-1] and self._read_offset >= self._write_end()
+
+    def append(self, event):
+        if self._write_fh is None:
+            self._write_fh = open(self._segment_path(self._segments[-1]), 'ab')
+        self._write_fh.write(event.to_json() + "\n")
+        self._write_fh.flush()
+
+        # start a new segment once this one is full
+        if self._write_fh.tell() >= self._segment_size:
+            self._write_fh.close()
+            self._write_fh = None
+            self._segments.append(self._segments[-1] + 1)
+
+    def read(self, max_count):
+        """
+        Reads up to max_count events from the current read position. Returns
+        a list of (event, position) tuples, where position can be passed to
+        acknowledge() once the event was dispatched.
+        """
+        events = []
+        while len(events) < max_count:
+            if self._read_fh is None:
+                path = self._segment_path(self._read_segment)
+                if not os.path.exists(path):
+                    break
+                self._read_fh = open(path, 'rb')
+                self._read_fh.seek(self._read_offset)
+
+            line = self._read_fh.readline()
+            if not line.endswith("\n"):
+                # end of segment. move on if a newer segment exists
+                self._read_fh.close()
+                self._read_fh = None
+                if self._read_segment == self._segments[-1]:
+                    break
+                self._read_segment = self._segments[self._segments.index(self._read_segment) + 1]
+                self._read_offset = 0
+                continue
+
+            self._read_offset += len(line)
+            try:
+                event = TrapEvent.from_json(line)
+            except ValueError:
+                log.error("EventSpool: Skipping corrupt record in segment %d" % (self._read_segment))
+                continue
+            events.append((event, (self._read_segment, self._read_offset)))
+        return events
+
+    def acknowledge(self, position):
+        segment, offset = position
+        tmp_path = self._checkpoint_path() + ".tmp"
+        fh = open(tmp_path, 'w')
+        try:
+            fh.write("%d %d\n" % (segment, offset))
+        finally:
+            fh.close()
+        os.rename(tmp_path, self._checkpoint_path())
+
+        # remove fully consumed segments
+        while self._segments[0] < segment:
+            try:
+                os.unlink(self._segment_path(self._segments.pop(0)))
+            except OSError:
+                pass
+
+    def close(self):
+        if self._write_fh is not None:
+            self._write_fh.close()
+            self._write_fh = None
+        if self._read_fh is not None:
+            self._read_fh.close()
+            self._read_fh = None
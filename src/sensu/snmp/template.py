@@ -0,0 +1,50 @@
+import string
+
+
+class EventTemplate(object):
+    """
+    A str.format style event template (e.g. "{hostname} reports {message}")
+    compiled once when trap handlers are loaded.
+
+    Templates only using plain "{field}" substitutions are rendered with a
+    single %-format operation. Templates using conversions, format specs or
+    attribute/index lookups fall back to str.format.
+    """
+
+    _formatter = string.Formatter()
+
+    def __init__(self, template):
+        self.template = template
+        self.fields = frozenset()
+        self._pattern = None
+
+        fields = set()
+        pattern = []
+        simple = True
+        for literal, field_name, format_spec, conversion in self._formatter.parse(template):
+            pattern.append(literal.replace('%', '%%'))
+            if field_name is None:
+                continue
+
+            # find the substitution a (possibly compound) field refers to
+            field = field_name.split('.', 1)[0].split('[', 1)[0]
+            if not field or field.isdigit():
+                raise ValueError("Positional substitutions are not supported in template: %s" % (template))
+            fields.add(field)
+
+            if field != field_name or format_spec or conversion or ')' in field:
+                simple = False
+            else:
+                pattern.append('%%(%s)s' % (field))
+
+        self.fields = frozenset(fields)
+        if simple:
+            self._pattern = ''.join(pattern)
+
+    def render(self, substitutions):
+        if self._pattern is not None:
+            return self._pattern % substitutions
+        return self.template.format(**substitutions)
+
+    def __repr__(self):
+        return "<EventTemplate template:'%s' >" % (self.template)
@@ -0,0 +1,217 @@
+import time
+import errno
+import select
+import socket
+import asyncore
+
+from pysnmp.carrier import error
+from pysnmp.carrier.asynsock.base import AbstractSocketTransport
+from pysnmp.carrier.asynsock.dispatch import AsynsockDispatcher
+
+from sensu.snmp.log import log
+from sensu.snmp.ber import message_length
+from sensu.snmp.ber import BerDecodeError
+from sensu.snmp.metrics import metrics
+
+# TRANSPORT-ADDRESS-MIB::transportDomainTcpIpv4 and transportDomainTcpIpv6,
+# as used by net-snmp
+TCP_DOMAIN_NAME = (1, 3, 6, 1, 2, 1, 100, 1, 5)
+TCP6_DOMAIN_NAME = (1, 3, 6, 1, 2, 1, 100, 1, 6)
+
+
+class PollingDispatcher(AsynsockDispatcher):
+    """
+    An AsynsockDispatcher waiting for its sockets with poll() rather than
+    select(), which can't wait for file descriptors above FD_SETSIZE (1024).
+    """
+
+    def runDispatcher(self, timeout=0.0):
+        if not hasattr(select, 'poll'):
+            return AsynsockDispatcher.runDispatcher(self, timeout)
+        while self.jobsArePending() or self.transportsAreWorking():
+            asyncore.poll2(timeout and timeout or self.timeout, self.getSocketMap())
+            self.handleTimerTick(time.time())
+
+
+class TcpConnection(asyncore.dispatcher):
+    """
+    A connection accepted by a TcpTransport. Received data is buffered until
+    it holds complete messages, which are passed to the transport one by one.
+    """
+
+    RECV_SIZE = 65536
+
+    def __init__(self, transport, sock, address, sock_map):
+        asyncore.dispatcher.__init__(self, sock, sock_map)
+        self.address = address
+        self.last_active = time.time()
+        self._transport = transport
+        self._in_buffer = ''
+        self._out_buffer = ''
+
+    def send_message(self, message):
+        self._out_buffer += message
+
+    # asyncore API
+    def writable(self):
+        return len(self._out_buffer) > 0
+
+    def handle_write(self):
+        sent = self.send(self._out_buffer)
+        self._out_buffer = self._out_buffer[sent:]
+
+    def handle_read(self):
+        data = self.recv(self.RECV_SIZE)
+        if not data:
+            # closed by the peer
+            return
+        self.last_active = time.time()
+        self._in_buffer += data
+
+        offset = 0
+        try:
+            while self.connected:
+                length = message_length(self._in_buffer, offset)
+                if length is None:
+                    break
+                if length > self._transport.max_message_size:
+                    raise BerDecodeError("Message of %d octets exceeds the maximum size" % (length))
+                if offset + length > len(self._in_buffer):
+                    break
+                message = self._in_buffer[offset:offset + length]
+                offset += length
+                self._transport.receive(self, message)
+        except BerDecodeError, e:
+            # the stream can't be resynchronized
+            self._transport.framing_error(self, e)
+            return
+        self._in_buffer = self._in_buffer[offset:]
+
+    def handle_close(self):
+        self._transport.connection_closed(self)
+        self.close()
+
+    def handle_error(self):
+        # a broken connection must not stop the dispatcher
+        log.exception("TcpConnection: Error on connection from %s:%s" % (self.address[0], self.address[1]))
+        self.handle_close()
+
+
+class TcpTransport(AbstractSocketTransport):
+    """
+    SNMP over TCP (RFC 3430) server transport. Messages received on the
+    accepted connections are passed to the dispatcher with the address of
+    the peer, so responses (like INFORM acknowledgements) are sent back over
+    the connection they came from.
+
+    At most max_connections connections are kept open, connections idle for
+    idle_timeout seconds are closed and a message longer than
+    max_message_size closes its connection.
+    """
+
+    sockFamily = socket.AF_INET
+    sockType = socket.SOCK_STREAM
+
+    LISTEN_BACKLOG = socket.SOMAXCONN
+
+    def __init__(self, sock=None, sockMap=None, max_connections=1024, idle_timeout=300, max_message_size=65535):
+        AbstractSocketTransport.__init__(self, sock, sockMap)
+        self.max_connections = int(max_connections)
+        self.idle_timeout = float(idle_timeout)
+        self.max_message_size = int(max_message_size)
+        self._sock_map = sockMap
+        self._connections = dict()
+
+        self._accepted_counter = metrics.counter('tcp.accepted')
+        self._refused_counter = metrics.counter('tcp.refused')
+        self._idle_counter = metrics.counter('tcp.idle_closed')
+        self._framing_errors = metrics.counter('tcp.framing_errors')
+
+    def registerSocket(self, sockMap=None):
+        # accepted connections join the socket map of the dispatcher
+        self._sock_map = sockMap
+        AbstractSocketTransport.registerSocket(self, sockMap)
+
+    def openServerMode(self, iface):
+        try:
+            self.set_reuse_addr()
+            self.socket.bind(iface)
+            self.socket.listen(self.LISTEN_BACKLOG)
+        except socket.error, e:
+            raise error.CarrierError('bind() for %s failed: %s' % (iface, e))
+        self.accepting = True
+        return self
+
+    def sendMessage(self, outgoingMessage, transportAddress):
+        connection = self._connections.get(transportAddress)
+        if connection is None:
+            log.debug("TcpTransport: Dropping message for closed connection from %s:%s" % (transportAddress[0],
+                                                                                           transportAddress[1]))
+            return
+        connection.send_message(outgoingMessage)
+
+    def closeTransport(self):
+        for connection in self._connections.values():
+            connection.close()
+        self._connections.clear()
+        AbstractSocketTransport.closeTransport(self)
+
+    def receive(self, connection, message):
+        self._cbFun(self, connection.address, message)
+
+    def framing_error(self, connection, ex):
+        self._framing_errors.inc()
+        log.warning("TcpTransport: Closing connection from %s:%s: %s" % (connection.address[0],
+                                                                         connection.address[1], ex))
+        connection.handle_close()
+
+    def connection_closed(self, connection):
+        if self._connections.get(connection.address) is connection:
+            del self._connections[connection.address]
+            log.debug("TcpTransport: Connection from %s:%s closed" % (connection.address[0], connection.address[1]))
+
+    def close_idle(self, now):
+        """
+        Timer callback closing the connections idle for idle_timeout seconds.
+        """
+        if self.idle_timeout <= 0:
+            return
+        for connection in self._connections.values():
+            if now - connection.last_active >= self.idle_timeout:
+                self._idle_counter.inc()
+                log.debug("TcpTransport: Closing idle connection from %s:%s" % (connection.address[0],
+                                                                                     connection.address[1]))
+                connection.handle_close()
+
+    def stats(self):
+        return {'connections': len(self._connections),
+                'max_connections': self.max_connections}
+
+    # asyncore API
+    def writable(self):
+        return False
+
+    def handle_accept(self):
+        try:
+            accepted = self.accept()
+        except socket.error, e:
+            if e.args[0] in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM):
+                log.warning("TcpTransport: accept() failed: %s" % (e))
+                return
+            raise
+        if accepted is None:
+            return
+        sock, address = accepted
+
+        if len(self._connections) >= self.max_connections:
+            self._refused_counter.inc()
+            log.warning("TcpTransport: Refusing connection from %s:%s, %d connections open" % (address[0],
+                                                                                              address[1],
+                                                                                              len(self._connections)))
+            sock.close()
+            return
+
+        self._accepted_counter.inc()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._connections[address] = TcpConnection(self, sock, address, self._sock_map)
+        log.debug("TcpTransport: Accepted connection from %s:%s" % (address[0], address[1]))
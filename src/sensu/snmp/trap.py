@@ -1,14 +1,19 @@
 import os
 import sys
+import time
 
 from sensu.snmp.log import log
 
 class Trap(object):
 
+    # properties set on every trap by the TrapReceiver
+    PROPERTIES = ('hostname', 'ipaddress', 'domain')
+
     def __init__(self, oid, arguments, **properties):
         self.oid = oid
         self.arguments = arguments
         self.properties = properties
+        self.received = time.time()
 
     def __repr__(self):
         return "<Trap oid:'%r' >" % (self.oid)
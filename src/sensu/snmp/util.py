@@ -1,23 +1,111 @@
 import socket
+import threading
+from collections import OrderedDict
 
 from sensu.snmp.log import log
 from sensu.snmp.event import TrapEvent
 
+class LRUCache(object):
+    """
+    A bounded least-recently-used cache with hit/miss counters. Safe to use
+    from several threads.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = int(max_size)
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        # reordering and evicting entries changes the links of the OrderedDict
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # move key to the most recently used end
+            self._data[key] = value
+            self.hits += 1
+            return value
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        self._lock.acquire()
+        try:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        finally:
+            self._lock.release()
+
+    def pop(self, key, default=None):
+        self._lock.acquire()
+        try:
+            return self._data.pop(key, default)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data.clear()
+        finally:
+            self._lock.release()
+
+    def items(self):
+        # least recently used first. doesn't count as a use
+        self._lock.acquire()
+        try:
+            return self._data.items()
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return {'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses}
+
+def split_hostname(hostname):
+    hostname_parts = hostname.split('.')
+    if len(hostname_parts) <= 2:
+        return hostname, ''
+    else:
+        return hostname_parts[0], '.'.join(hostname_parts[1:])
+
 def get_hostname_from_address(addr):
     try:
         hostname, aliaslist, ipaddrlist = socket.gethostbyaddr(addr)
         # parse hostname
-        hostname_parts = hostname.split('.')
-        if len(hostname_parts) <= 2:
-            return hostname, ''
-        else:
-            return hostname_parts[0], '.'.join(hostname_parts[1:])
+        return split_hostname(hostname)
     except socket.herror:
         return addr, addr
 
 def parse_event_severity(event_severity):
+    """
+    Returns the Sensu status of a severity name (like "WARNING") or number.
+    Raises ValueError for unknown severities.
+    """
+    if event_severity in TrapEvent.EVENT_SEVERITY:
+        return TrapEvent.EVENT_SEVERITY[event_severity]
     try:
         severity = int(event_severity)
-        assert(severity in TrapEvent.EVENT_SEVERITY.values())
-    except ValueError:
-        return TrapEvent.EVENT_SEVERITY[event_severity]
+    except (ValueError, TypeError):
+        raise ValueError("Invalid event severity: %r" % (event_severity,))
+    if severity not in TrapEvent.EVENT_SEVERITY.values():
+        raise ValueError("Invalid event severity: %r" % (event_severity,))
+    return severity
@@ -0,0 +1,74 @@
+import os
+import signal
+import multiprocessing
+
+from sensu.snmp.log import log
+
+class TrapEventForwarder(object):
+    """
+    Stands in for the TrapEventDispatcherThread inside a worker process and
+    forwards events to the dispatcher in the parent process.
+    """
+
+    def __init__(self, worker_id, messages):
+        self._worker_id = worker_id
+        self._messages = messages
+
+    def dispatch(self, event):
+        self._messages.put(('event', self._worker_id, event))
+        return True
+
+
+class TrapReceiverWorker(multiprocessing.Process):
+    """
+    A forked trap receiver process. The worker inherits the MIBs and trap
+    handlers of the SensuTrapServer it was forked from and runs its own
+    TrapReceiver bound to the shared listen address with SO_REUSEPORT.
+    """
+
+    def __init__(self, worker_id, server, messages, stop_event):
+        multiprocessing.Process.__init__(self, name="%s-%d" % (self.__class__.__name__, worker_id))
+        self.worker_id = worker_id
+        self._server = server
+        self._messages = messages
+        self._stop_event = stop_event
+
+    def _handle_signal(self, signum, frame):
+        log.info("%s: Signal Received: %d" % (self.name, signum))
+        self._stop_event.set()
+
+    def _handle_reload(self, signum, frame):
+        log.info("%s: Signal Received: %d" % (self.name, signum))
+        self._server.request_reload()
+
+    def run(self):
+        # the parent process coordinates shutdown and reloads
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        log.debug("%s: Started (pid %d)" % (self.name, os.getpid()))
+        try:
+            self._server._run_worker(self.worker_id, self._messages, self._stop_event)
+        except:
+            log.exception("%s: Unhandled error" % (self.name))
+        log.debug("%s: Exiting" % (self.name))
+
+
+class TrapReceiverWorkerStats(object):
+    """
+    Rolls up the stats reported by the worker processes.
+    """
+
+    def __init__(self):
+        self._workers = dict()
+
+    def update(self, worker_id, stats):
+        self._workers[worker_id] = stats
+
+    def stats(self):
+        total = dict()
+        for worker_id, stats in self._workers.items():
+            for k, v in stats.items():
+                if isinstance(v, (int, long, float)) and not isinstance(v, bool):
+                    total[k] = total.get(k, 0) + v
+        return {'workers': dict(self._workers), 'total': total}
@@ -0,0 +1,88 @@
+import time
+import socket
+import threading
+import simplejson as json
+
+from helpers.log import log
+
+class FakeSensuClient(threading.Thread):
+    """
+    A minimal stand-in for the Sensu client socket. Collects every event it
+    receives and optionally acknowledges each one with "ok".
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, respond=True):
+        threading.Thread.__init__(self, name=self.__class__.__name__)
+        self.setDaemon(True)
+        self.respond = respond
+        self.events = []
+        # time every event was received at
+        self.timestamps = []
+        self.connections = 0
+        self._received = threading.Condition()
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(16)
+        self.host, self.port = self._server.getsockname()
+        self._run = True
+
+    def stop(self):
+        self._run = False
+        self._server.close()
+
+    def wait_for_events(self, count, timeout=5):
+        self._received.acquire()
+        try:
+            if len(self.events) < count:
+                self._received.wait(timeout)
+            while len(self.events) < count:
+                self._received.wait(0.1)
+                timeout -= 0.1
+                if timeout <= 0:
+                    break
+            return len(self.events) >= count
+        finally:
+            self._received.release()
+
+    def run(self):
+        while self._run:
+            try:
+                conn, addr = self._server.accept()
+            except socket.error:
+                break
+            self.connections += 1
+            handler = threading.Thread(target=self._handle_connection, args=(conn,))
+            handler.setDaemon(True)
+            handler.start()
+
+    def _handle_connection(self, conn):
+        decoder = json.JSONDecoder()
+        data = ''
+        while self._run:
+            try:
+                chunk = conn.recv(65536)
+            except socket.error:
+                break
+            if not chunk:
+                break
+            data += chunk
+            while True:
+                data = data.lstrip()
+                if not data:
+                    break
+                try:
+                    event, end = decoder.raw_decode(data)
+                except ValueError:
+                    break
+                data = data[end:]
+                self._received.acquire()
+                try:
+                    self.events.append(event)
+                    self.timestamps.append(time.time())
+                    self._received.notifyAll()
+                finally:
+                    self._received.release()
+                if self.respond:
+                    conn.sendall("ok")
+        conn.close()
@@ -0,0 +1,86 @@
+import os
+import sys
+import unittest
+
+from pyasn1.codec.ber import encoder
+from pysnmp.proto import api
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.ber import decode_v2c_trap
+from sensu.snmp.ber import message_length
+from sensu.snmp.ber import BerDecodeError
+from sensu.snmp.ber import SNMP_TRAP_OID
+
+# helpers
+from helpers.log import log
+
+def encode_notification(version, pdu_type, community, var_binds):
+    proto = api.protoModules[version]
+    pdu = getattr(proto, pdu_type)()
+    proto.apiPDU.setDefaults(pdu)
+    proto.apiPDU.setVarBinds(pdu, var_binds)
+    message = proto.Message()
+    proto.apiMessage.setDefaults(message)
+    proto.apiMessage.setCommunity(message, community)
+    proto.apiMessage.setPDU(message, pdu)
+    return encoder.encode(message)
+
+class BerDecoderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        v2c = api.protoModules[api.protoVersion2c]
+        self.var_binds = [((1, 3, 6, 1, 2, 1, 1, 3, 0), v2c.TimeTicks(123456)),
+                          (SNMP_TRAP_OID, v2c.ObjectIdentifier((1, 3, 6, 1, 6, 3, 1, 1, 5, 1))),
+                          ((1, 3, 6, 1, 2, 1, 1, 5, 0), v2c.OctetString("whatup")),
+                          ((1, 3, 6, 1, 2, 1, 2, 2, 1, 1, 1), v2c.Integer(-42)),
+                          ((1, 3, 6, 1, 2, 1, 4, 20, 1, 1), v2c.IpAddress("10.0.0.1")),
+                          ((1, 3, 6, 1, 2, 1, 2, 2, 1, 10, 1), v2c.Counter32(4294967295)),
+                          ((1, 3, 6, 1, 2, 1, 31, 1, 1, 1, 6, 1), v2c.Counter64(2 ** 40)),
+                          ((1, 3, 6, 1, 4, 1, 99999, 200000), v2c.Null(''))]
+
+    def test_decode_trap(self):
+        message = encode_notification(api.protoVersion2c, 'TrapPDU', 'public', self.var_binds)
+        community, var_binds = decode_v2c_trap(message)
+        self.assertEqual(community, 'public')
+        self.assertEqual(var_binds, [((1, 3, 6, 1, 2, 1, 1, 3, 0), 123456),
+                                     (SNMP_TRAP_OID, (1, 3, 6, 1, 6, 3, 1, 1, 5, 1)),
+                                     ((1, 3, 6, 1, 2, 1, 1, 5, 0), "whatup"),
+                                     ((1, 3, 6, 1, 2, 1, 2, 2, 1, 1, 1), -42),
+                                     ((1, 3, 6, 1, 2, 1, 4, 20, 1, 1), "\x0a\x00\x00\x01"),
+                                     ((1, 3, 6, 1, 2, 1, 2, 2, 1, 10, 1), 4294967295),
+                                     ((1, 3, 6, 1, 2, 1, 31, 1, 1, 1, 6, 1), 2 ** 40),
+                                     ((1, 3, 6, 1, 4, 1, 99999, 200000), None)])
+
+    def test_decode_long_message(self):
+        v2c = api.protoModules[api.protoVersion2c]
+        var_binds = [((1, 3, 6, 1, 2, 1, 1, 5, 0), v2c.OctetString("x" * 1000))]
+        message = encode_notification(api.protoVersion2c, 'TrapPDU', 'public', var_binds)
+        community, var_binds = decode_v2c_trap(message)
+        self.assertEqual(var_binds, [((1, 3, 6, 1, 2, 1, 1, 5, 0), "x" * 1000)])
+
+    def test_decode_other_messages(self):
+        # INFORMs and SNMPv1 traps are left to the pysnmp engine
+        message = encode_notification(api.protoVersion2c, 'InformRequestPDU', 'public', self.var_binds)
+        self.assertEqual(decode_v2c_trap(message), None)
+        message = encode_notification(api.protoVersion1, 'GetRequestPDU', 'public', [])
+        self.assertEqual(decode_v2c_trap(message), None)
+
+    def test_decode_truncated(self):
+        message = encode_notification(api.protoVersion2c, 'TrapPDU', 'public', self.var_binds)
+        self.assertRaises(BerDecodeError, decode_v2c_trap, message[:-3])
+        self.assertRaises(BerDecodeError, decode_v2c_trap, "\x30")
+
+    def test_message_length(self):
+        message = encode_notification(api.protoVersion2c, 'TrapPDU', 'public', self.var_binds)
+        self.assertEqual(message_length(message), len(message))
+        self.assertEqual(message_length(message + message, len(message)), len(message))
+        # the header isn't complete yet
+        self.assertEqual(message_length(message[:1]), None)
+        self.assertEqual(message_length(""), None)
+        self.assertEqual(message_length("\x30\x82\x01"), None)
+        self.assertRaises(BerDecodeError, message_length, "\x04\x01x")
+        self.assertRaises(BerDecodeError, message_length, "\x30\x80")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import simplejson as json
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.bundle import trap_files
+from sensu.snmp.bundle import read_trap_files
+from sensu.snmp.bundle import bundle_key
+from sensu.snmp.bundle import load_bundle
+from sensu.snmp.bundle import save_bundle
+
+# helpers
+from helpers.log import log
+
+COLD_START = (1, 3, 6, 1, 6, 3, 1, 1, 5, 1)
+SYS_NAME = (1, 3, 6, 1, 2, 1, 1, 5)
+
+class TrapFilesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.trap_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.trap_dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.trap_dir, name)
+        fh = open(path, 'w')
+        fh.write(data if isinstance(data, str) else json.dumps(data))
+        fh.close()
+        return path
+
+    def test_trap_files(self):
+        trap_file = self.write("traps.conf", {})
+        self.write("b.json", {})
+        self.write("a.json", {})
+        self.write("README", "not a trap file")
+        os.mkdir(os.path.join(self.trap_dir, "c.json"))
+        self.assertEqual(trap_files(trap_file, self.trap_dir),
+                         [trap_file, os.path.join(self.trap_dir, "a.json"), os.path.join(self.trap_dir, "b.json")])
+        self.assertEqual(trap_files(None, None), [])
+
+    def test_read_trap_files(self):
+        a = self.write("a.json", {"one": {"x": 1}})
+        b = self.write("b.json", {"two": {"x": 2}, "three": {"x": 3}})
+        trap_handler_configs, digests = read_trap_files([a, b])
+        self.assertEqual(trap_handler_configs, {"one": {"x": 1}, "two": {"x": 2}, "three": {"x": 3}})
+        self.assertEqual(sorted(digests.keys()), [a, b])
+        self.assertEqual(len(digests[a]), 40)
+
+    def test_duplicate_id(self):
+        a = self.write("a.json", {"one": {"x": 1}})
+        b = self.write("b.json", {"one": {"x": 2}})
+        try:
+            read_trap_files([a, b])
+            self.fail("duplicate trap handler not detected")
+        except ValueError, e:
+            self.assertTrue(a in str(e) and b in str(e))
+
+    def test_invalid_file(self):
+        a = self.write("a.json", "{not json")
+        self.assertRaises(ValueError, read_trap_files, [a])
+        b = self.write("b.json", [])
+        self.assertRaises(ValueError, read_trap_files, [b])
+
+class BundleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.bundle_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.bundle_dir, "traps.bundle")
+        self.key = bundle_key({"traps.json": "abc"}, {"mibs": ["SNMPv2-MIB"], "files": {"x.py": 1.5}})
+
+    def tearDown(self):
+        shutil.rmtree(self.bundle_dir)
+
+    def test_round_trip(self):
+        save_bundle(self.path, self.key, {"cold": (COLD_START, {SYS_NAME: "name"}),
+                                          "noargs": (COLD_START, {})})
+        resolved = load_bundle(self.path, self.key)
+        self.assertEqual(resolved, {"cold": (COLD_START, {SYS_NAME: "name"}),
+                                    "noargs": (COLD_START, {})})
+        self.assertEqual(resolved["cold"][0].prettyPrint(), "1.3.6.1.6.3.1.1.5.1")
+
+    def test_out_of_date(self):
+        save_bundle(self.path, self.key, {"cold": (COLD_START, {})})
+        self.assertEqual(load_bundle(self.path, bundle_key({"traps.json": "def"}, self.key['mibs'])), None)
+        self.assertEqual(load_bundle(self.path, bundle_key(self.key['files'], {})), None)
+
+    def test_missing(self):
+        self.assertEqual(load_bundle(self.path, self.key), None)
+
+    def test_unreadable(self):
+        fh = open(self.path, 'w')
+        fh.write("{broken")
+        fh.close()
+        self.assertEqual(load_bundle(self.path, self.key), None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.capture import TrapCaptureWriter
+from sensu.snmp.capture import CaptureFormatError
+from sensu.snmp.capture import capture_files
+from sensu.snmp.capture import read_capture
+from sensu.snmp.capture import replay
+from sensu.snmp.capture import TRANSPORT_UDP
+
+# helpers
+from helpers.log import log
+
+class TrapCaptureTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.capture_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.capture_dir, "traps.capture")
+
+    def tearDown(self):
+        shutil.rmtree(self.capture_dir)
+
+    def test_read_write(self):
+        writer = TrapCaptureWriter(self.path)
+        writer.write(100.5, TRANSPORT_UDP, ('10.0.0.1', 162), "\x30\x01\x00")
+        writer.write(101.25, TRANSPORT_UDP, ('::1', 1620), "\x30\x00")
+        writer.close()
+        self.assertEqual(list(read_capture(self.path)),
+                         [(100.5, TRANSPORT_UDP, ('10.0.0.1', 162), "\x30\x01\x00"),
+                          (101.25, TRANSPORT_UDP, ('::1', 1620), "\x30\x00")])
+
+    def test_append(self):
+        writer = TrapCaptureWriter(self.path)
+        writer.write(100, TRANSPORT_UDP, ('10.0.0.1', 162), "first")
+        writer.close()
+        # a partial record is left behind by a crash
+        fh = open(self.path, 'ab')
+        fh.write("\x00\x01")
+        fh.close()
+        self.assertEqual(len(list(read_capture(self.path))), 1)
+
+        writer = TrapCaptureWriter(self.path)
+        writer.write(101, TRANSPORT_UDP, ('10.0.0.1', 162), "second")
+        writer.close()
+        self.assertEqual([record[3] for record in read_capture(self.path)], ["first", "second"])
+
+    def test_rotate(self):
+        writer = TrapCaptureWriter(self.path, max_size=100, max_files=2)
+        for i in range(10):
+            writer.write(100 + i, TRANSPORT_UDP, ('10.0.0.1', 162), "%040d" % (i))
+        writer.close()
+        # two records fill a file, the oldest files were removed and the
+        # last write rotated the current file
+        files = capture_files(self.path)
+        self.assertEqual(files, [self.path + ".2", self.path + ".1", self.path])
+        messages = [int(record[3]) for path in files for record in read_capture(path)]
+        self.assertEqual(messages, [6, 7, 8, 9])
+
+    def test_not_a_capture(self):
+        fh = open(self.path, 'wb')
+        fh.write("something else")
+        fh.close()
+        self.assertRaises(CaptureFormatError, list, read_capture(self.path))
+        self.assertRaises(CaptureFormatError, TrapCaptureWriter, self.path)
+
+    def test_replay(self):
+        records = [(100 + i * 0.1, TRANSPORT_UDP, ('10.0.0.1', 162), str(i)) for i in range(5)]
+        sent = []
+        # at 4x speed 0.4 seconds of traffic take 0.1 seconds
+        start = time.time()
+        self.assertEqual(replay(records, sent.append, speed=4), 5)
+        elapsed = time.time() - start
+        self.assertEqual(sent, records)
+        self.assertTrue(0.09 <= elapsed < 0.3, elapsed)
+
+        # as fast as possible
+        start = time.time()
+        replay([(100, 0, None, "a"), (1000, 0, None, "b")], sent.append, speed=0)
+        self.assertTrue(time.time() - start < 0.1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import unittest
+import simplejson as json
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.coalesce import TrapEventCoalescer
+from sensu.snmp.event import TrapEvent
+
+# helpers
+from helpers.log import log
+
+class TrapEventCoalescerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.coalescer = TrapEventCoalescer(max_entries=2)
+
+    def _event(self, name, status=2, received=None):
+        return TrapEvent(name, "output", status, ["default"], received)
+
+    def test_coalesce(self):
+        # the first event is dispatched right away, repeats are counted
+        self.assertEqual(len(self.coalescer.coalesce(self._event("a", received=100), 60, 100)), 1)
+        for i in range(9):
+            self.assertEqual(self.coalescer.coalesce(self._event("a", received=101 + i), 60, 101 + i), [])
+        self.assertEqual(self.coalescer.flush(159), [])
+
+        summary, = self.coalescer.flush(160)
+        self.assertEqual(summary.name, "a")
+        self.assertEqual((summary.trap_count, summary.trap_first_seen, summary.trap_last_seen), (10, 100, 109))
+        # Sensu filters read "occurrences" as the occurrences required before handling
+        self.assertFalse('occurrences' in json.loads(summary.to_json()))
+        self.assertEqual(json.loads(summary.to_json())['trap_count'], 10)
+        self.assertEqual(len(self.coalescer), 0)
+
+        stats = self.coalescer.stats()
+        self.assertEqual(stats['suppressed'], 9)
+        self.assertEqual(stats['summaries'], 1)
+        self.assertAlmostEqual(stats['dedup_ratio'], 0.9)
+
+    def test_coalesce_single_event(self):
+        # no summary when nothing was coalesced
+        self.coalescer.coalesce(self._event("a"), 60, 100)
+        self.assertEqual(self.coalescer.flush(200), [])
+
+    def test_coalesce_status_change(self):
+        self.coalescer.coalesce(self._event("a", 2), 60, 100)
+        self.coalescer.coalesce(self._event("a", 2), 60, 101)
+        # the summary goes out before the new status
+        events = self.coalescer.coalesce(self._event("a", 0), 60, 102)
+        self.assertEqual([(event.status, event.trap_count) for event in events], [(2, 2), (0, None)])
+
+    def test_coalesce_bounded(self):
+        self.coalescer.coalesce(self._event("a"), 60, 100)
+        self.coalescer.coalesce(self._event("a"), 60, 100)
+        self.coalescer.coalesce(self._event("b"), 60, 100)
+        events = self.coalescer.coalesce(self._event("c"), 60, 100)
+        self.assertEqual([(event.name, event.trap_count) for event in events], [("a", 2), ("c", None)])
+        self.assertEqual(len(self.coalescer), 2)
+        self.assertEqual(self.coalescer.stats()['evicted'], 1)
+
+    def test_summary_json(self):
+        self.coalescer.coalesce(self._event("a"), 60, 100)
+        self.coalescer.coalesce(self._event("a"), 60, 100)
+        summary, = self.coalescer.flush(force=True)
+        event = TrapEvent.from_json(summary.to_json())
+        self.assertEqual((event.trap_count, event.trap_first_seen, event.trap_last_seen), (2, 100, 100))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+import os
+import sys
+import time
+import socket
+import shutil
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.dispatcher import TrapEventDispatcherThread
+from sensu.snmp.dispatcher import SensuResponseReader
+from sensu.snmp.event import TrapEvent
+from sensu.snmp.spool import EventSpool
+
+# helpers
+from helpers.log import log
+from helpers.sensu import FakeSensuClient
+
+class TrapEventDispatcherThreadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sensu = FakeSensuClient()
+        self.sensu.start()
+        self.config = {
+                "dispatcher": {
+                    "host": self.sensu.host,
+                    "port": self.sensu.port,
+                    "endpoints": [],
+                    "balance": "round-robin",
+                    "standby": 1,
+                    "timeout": 5,
+                    "backoff": 10,
+                    "max_backoff": 300,
+                    "failure_threshold": 1,
+                    "check_response": True,
+                    "batch_size": 1,
+                    "batch_linger": 0,
+                    "max_queue": 10000,
+                    "overflow": "drop-oldest",
+                    "spool_dir": None,
+                    "spool_segment_size": 1024,
+                    "drain_timeout": 5
+                }
+            }
+        self.dispatcher_thread = None
+
+    def _create_dispatcher(self, **dispatcher_config):
+        self.config['dispatcher'].update(dispatcher_config)
+        self.dispatcher_thread = TrapEventDispatcherThread(self.config)
+        self.dispatcher_thread.setDaemon(1)
+        return self.dispatcher_thread
+
+    def _start_dispatcher(self, **dispatcher_config):
+        self._create_dispatcher(**dispatcher_config).start()
+
+    def tearDown(self):
+        if self.dispatcher_thread is not None and self.dispatcher_thread.isAlive():
+            self.dispatcher_thread.stop()
+            self.dispatcher_thread.join()
+        self.sensu.stop()
+
+    def _event(self, i):
+        return TrapEvent("event %d" % (i), "output", 2, ["default"])
+
+    def test_dispatch_burst(self):
+        self._start_dispatcher()
+        start = time.time()
+        for i in range(100):
+            self.dispatcher_thread.dispatch(self._event(i))
+        self.assertTrue(self.sensu.wait_for_events(100))
+        self.assertTrue(time.time() - start < 5)
+        self.assertEquals([event['name'] for event in self.sensu.events], ["event %d" % (i) for i in range(100)])
+
+    def test_dispatch_batch(self):
+        self._start_dispatcher(batch_size=50, batch_linger=0.1)
+        for i in range(120):
+            self.dispatcher_thread.dispatch(self._event(i))
+        self.assertTrue(self.sensu.wait_for_events(120))
+        self.assertEquals([event['name'] for event in self.sensu.events], ["event %d" % (i) for i in range(120)])
+        self.assertEquals(self.sensu.connections, 1)
+
+    def test_dispatch_batch_error(self):
+        self._start_dispatcher(check_response=True, timeout=1)
+        self.sensu.respond = False
+        events = [self._event(i) for i in range(3)]
+        dispatcher = self.dispatcher_thread._trap_event_dispatcher
+        self.assertEquals(dispatcher.dispatch_batch(events), 0)
+
+    def test_overflow_drop_oldest(self):
+        dispatcher_thread = self._create_dispatcher(max_queue=5, overflow="drop-oldest")
+        for i in range(8):
+            dispatcher_thread.dispatch(self._event(i))
+        self.assertEquals(dispatcher_thread.stats()['dropped_oldest'], 3)
+        self.assertEquals([event.name for event, position in dispatcher_thread._events], ["event %d" % (i) for i in range(3, 8)])
+
+    def test_overflow_drop_oldest_replayed(self):
+        spool_dir = tempfile.mkdtemp()
+        try:
+            spool = EventSpool(spool_dir)
+            for i in range(4):
+                spool.append(self._event(i))
+            spool.close()
+            dispatcher_thread = self._create_dispatcher(max_queue=5, overflow="drop-oldest", spool_dir=spool_dir)
+            # replay the spool into the queue until it is empty
+            while dispatcher_thread._spooling:
+                dispatcher_thread._load_spool()
+            for i in range(4, 8):
+                dispatcher_thread.dispatch(self._event(i))
+            # the replayed events stay in the queue, so the spool checkpoint
+            # never moves past an event which wasn't sent
+            self.assertEquals(dispatcher_thread.stats()['dropped_oldest'], 3)
+            self.assertEquals([event.name for event, position in dispatcher_thread._events],
+                              ["event %d" % (i) for i in (0, 1, 2, 3, 7)])
+            self.assertEquals([position is None for event, position in dispatcher_thread._events],
+                              [False, False, False, False, True])
+        finally:
+            shutil.rmtree(spool_dir)
+
+    def test_overflow_drop_newest(self):
+        dispatcher_thread = self._create_dispatcher(max_queue=5, overflow="drop-newest")
+        for i in range(8):
+            dispatcher_thread.dispatch(self._event(i))
+        self.assertEquals(dispatcher_thread.stats()['dropped_newest'], 3)
+        self.assertEquals([event.name for event, position in dispatcher_thread._events], ["event %d" % (i) for i in range(5)])
+
+    def test_overflow_spool(self):
+        spool_dir = tempfile.mkdtemp()
+        try:
+            dispatcher_thread = self._create_dispatcher(max_queue=5, overflow="spool", spool_dir=spool_dir)
+            for i in range(20):
+                dispatcher_thread.dispatch(self._event(i))
+            self.assertEquals(dispatcher_thread.stats()['spooled'], 15)
+            dispatcher_thread.start()
+            self.assertTrue(self.sensu.wait_for_events(20))
+            self.assertEquals([event['name'] for event in self.sensu.events], ["event %d" % (i) for i in range(20)])
+        finally:
+            self.dispatcher_thread.stop()
+            self.dispatcher_thread.join()
+            self.dispatcher_thread = None
+            shutil.rmtree(spool_dir)
+
+    def test_spool_on_stop(self):
+        spool_dir = tempfile.mkdtemp()
+        try:
+            # sensu is down. events are spooled on shutdown
+            self.sensu.stop()
+            dispatcher_thread = self._create_dispatcher(spool_dir=spool_dir, drain_timeout=0)
+            dispatcher_thread.start()
+            for i in range(3):
+                dispatcher_thread.dispatch(self._event(i))
+            dispatcher_thread.stop()
+            dispatcher_thread.join()
+
+            # and replayed on startup
+            self.sensu = FakeSensuClient()
+            self.sensu.start()
+            self._start_dispatcher(host=self.sensu.host, port=self.sensu.port)
+            self.assertTrue(self.sensu.wait_for_events(3))
+            self.assertEquals([event['name'] for event in self.sensu.events], ["event %d" % (i) for i in range(3)])
+        finally:
+            self.dispatcher_thread.stop()
+            self.dispatcher_thread.join()
+            self.dispatcher_thread = None
+            shutil.rmtree(spool_dir)
+
+    def test_failover(self):
+        # find a port nobody listens on
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        dead_port = sock.getsockname()[1]
+        sock.close()
+
+        self._start_dispatcher(endpoints=["127.0.0.1:%d" % (dead_port), "%s:%d" % (self.sensu.host, self.sensu.port)],
+                               balance="failover")
+        for i in range(10):
+            self.dispatcher_thread.dispatch(self._event(i))
+        self.assertTrue(self.sensu.wait_for_events(10))
+
+        stats = self.dispatcher_thread.stats()['endpoints']
+        self.assertEquals(stats["127.0.0.1:%d" % (dead_port)]['state'], 'open')
+        self.assertEquals(stats["%s:%d" % (self.sensu.host, self.sensu.port)]['state'], 'closed')
+        self.assertEquals(stats["%s:%d" % (self.sensu.host, self.sensu.port)]['dispatched'], 10)
+
+    def test_round_robin(self):
+        other_sensu = FakeSensuClient()
+        other_sensu.start()
+        try:
+            self._start_dispatcher(endpoints=["%s:%d" % (self.sensu.host, self.sensu.port),
+                                              {"host": other_sensu.host, "port": other_sensu.port}])
+            for i in range(10):
+                self.dispatcher_thread.dispatch(self._event(i))
+            self.assertTrue(self.sensu.wait_for_events(5))
+            self.assertTrue(other_sensu.wait_for_events(5))
+        finally:
+            other_sensu.stop()
+
+    def test_stop(self):
+        self._start_dispatcher()
+        start = time.time()
+        self.dispatcher_thread.stop()
+        self.dispatcher_thread.join(5)
+        self.assertFalse(self.dispatcher_thread.isAlive())
+        self.assertTrue(time.time() - start < 1)
+
+class SensuResponseReaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sensu_socket, self.client_socket = socket.socketpair()
+        self.reader = SensuResponseReader(self.client_socket)
+
+    def tearDown(self):
+        self.sensu_socket.close()
+        self.client_socket.close()
+
+    def test_unterminated_acks(self):
+        self.sensu_socket.sendall("okok")
+        self.assertEquals(self.reader.read(2, 1), ["ok", "ok"])
+
+    def test_newline_framed(self):
+        self.sensu_socket.sendall("ok\nok\nok\n")
+        self.assertEquals(self.reader.read(2, 1), ["ok", "ok"])
+        # the extra response is kept for the next read
+        self.assertEquals(self.reader.read(1, 1), ["ok"])
+
+    def test_split_response(self):
+        self.sensu_socket.sendall("o")
+        self.assertEquals(self.reader.read(1, 0.1), [])
+        self.sensu_socket.sendall("k")
+        self.assertEquals(self.reader.read(1, 1), ["ok"])
+
+    def test_error_response(self):
+        self.sensu_socket.sendall("ok\ninvalid\n")
+        self.assertEquals(self.reader.read(3, 1), ["ok", "invalid"])
+
+    def test_timeout(self):
+        start = time.time()
+        self.assertEquals(self.reader.read(1, 0.2), [])
+        elapsed = time.time() - start
+        self.assertTrue(0.15 < elapsed < 1, elapsed)
+
+if __name__ == "__main__":
+    unittest.main()
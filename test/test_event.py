@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import pickle
+import unittest
+import simplejson as json
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.event import TrapEvent
+
+# helpers
+from helpers.log import log
+
+class TrapEventTestCase(unittest.TestCase):
+
+    def test_to_json(self):
+        event = TrapEvent(u"h\xf6st \"quoted\"", "line\nbreak", 2, ["default", "mail"], 100.5)
+        self.assertEqual(json.loads(event.to_json()), {"name": u"h\xf6st \"quoted\"",
+                                                       "output": "line\nbreak",
+                                                       "status": 2,
+                                                       "handlers": ["default", "mail"]})
+        # utf-8 byte strings are escaped as well
+        event = TrapEvent("h\xc3\xb6st", "output", 0, [])
+        self.assertEqual(json.loads(event.to_json())['name'], u"h\xf6st")
+
+    def test_to_json_without_status(self):
+        event = TrapEvent("name", "output", None, ["default"])
+        self.assertEqual(json.loads(event.to_json())['status'], None)
+
+    def test_from_json(self):
+        event = TrapEvent("name", "output", 1, ["default"])
+        event.trap_count = 3
+        event.trap_first_seen = 100
+        event.trap_last_seen = 110
+        event.type = "metric"
+        decoded = TrapEvent.from_json(event.to_json())
+        self.assertEqual(decoded.to_json(), event.to_json())
+        self.assertEqual((decoded.trap_count, decoded.trap_first_seen, decoded.trap_last_seen, decoded.type),
+                         (3, 100, 110, "metric"))
+
+    def test_serialized_once(self):
+        event = TrapEvent("name", "output", 0, ["default"])
+        self.assertTrue(event.to_json() is event.to_json())
+
+    def test_handlers_interned(self):
+        a = TrapEvent("a", "output", 0, ["default", "mail"])
+        b = TrapEvent("b", "output", 0, ["default", "mail"])
+        self.assertTrue(a.handlers is b.handlers)
+
+    def test_pickle(self):
+        event = TrapEvent("name", "output", 2, ["default"], 100.5)
+        data = event.to_json()
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            unpickled = pickle.loads(pickle.dumps(event, protocol))
+            self.assertEqual(unpickled.to_json(), data)
+            self.assertEqual(unpickled.received, 100.5)
+            self.assertTrue(unpickled.handlers is event.handlers)
+
+if __name__ == '__main__':
+    unittest.main()
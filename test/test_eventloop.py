@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import asyncore
+import unittest
+
+from pysnmp.carrier.asynsock.dispatch import AsynsockDispatcher
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.eventloop import TrapEventLoopDispatcher
+from sensu.snmp.event import TrapEvent
+
+# helpers
+from helpers.log import log
+from helpers.sensu import FakeSensuClient
+
+class TrapEventLoopDispatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sensu = FakeSensuClient()
+        self.sensu.start()
+        self.config = {
+                "dispatcher": {
+                    "host": self.sensu.host,
+                    "port": self.sensu.port,
+                    "endpoints": [],
+                    "timeout": 1,
+                    "backoff": 10,
+                    "max_backoff": 300,
+                    "check_response": True,
+                    "max_queue": 10000,
+                    "overflow": "drop-oldest",
+                    "drain_timeout": 5
+                }
+            }
+        self.transport_dispatcher = AsynsockDispatcher()
+        self.dispatcher = None
+
+    def tearDown(self):
+        self.transport_dispatcher.closeDispatcher()
+        self.sensu.stop()
+
+    def _create_dispatcher(self, **dispatcher_config):
+        self.config['dispatcher'].update(dispatcher_config)
+        self.dispatcher = TrapEventLoopDispatcher(self.config, self.transport_dispatcher)
+        return self.dispatcher
+
+    def _run_loop(self, until, timeout=5):
+        # run the event loop the way the trap receiver does
+        deadline = time.time() + timeout
+        while not until() and time.time() < deadline:
+            asyncore.poll(0.05, self.transport_dispatcher.getSocketMap())
+            self.transport_dispatcher.handleTimerTick(time.time())
+
+    def _event(self, i):
+        return TrapEvent("event %d" % (i), "output", 2, ["default"], time.time())
+
+    def test_dispatch(self):
+        self._create_dispatcher()
+        for i in range(100):
+            self.dispatcher.dispatch(self._event(i))
+        self._run_loop(lambda: self.dispatcher.stats()['dispatched'] == 100)
+
+        self.assertEquals([event['name'] for event in self.sensu.events], ["event %d" % (i) for i in range(100)])
+        stats = self.dispatcher.stats()
+        self.assertEquals(stats['outstanding'], 0)
+        self.assertEquals(stats['connects'], 1)
+        self.assertTrue(stats['max_latency'] >= stats['last_latency'] > 0)
+
+    def test_dispatch_unavailable(self):
+        # no acknowledgements. events are sent again after reconnecting
+        self.sensu.respond = False
+        self._create_dispatcher(backoff=0.1)
+        for i in range(3):
+            self.dispatcher.dispatch(self._event(i))
+        self._run_loop(lambda: self.dispatcher.stats()['connects'] > 1, 10)
+
+        stats = self.dispatcher.stats()
+        self.assertTrue(stats['errors'] >= 1)
+        self.assertEquals(stats['dispatched'], 0)
+        self.assertEquals(stats['queued'] + stats['outstanding'], 3)
+
+    def test_drain(self):
+        self._create_dispatcher()
+        for i in range(10):
+            self.dispatcher.dispatch(self._event(i))
+        self.dispatcher.stop()
+        self.dispatcher.drain()
+        self.assertEquals(self.dispatcher.stats()['dispatched'], 10)
+        self.assertTrue(self.sensu.wait_for_events(10))
+
+    def test_overflow(self):
+        # nothing can be sent before the loop ran
+        self.config['dispatcher']['port'] = 1
+        self._create_dispatcher(max_queue=5, backoff=60)
+        for i in range(8):
+            self.dispatcher.dispatch(self._event(i))
+        stats = self.dispatcher.stats()
+        self.assertEquals(stats['queued'], 5)
+        self.assertEquals(stats['dropped_oldest'], 3)
+
+if __name__ == '__main__':
+    unittest.main()
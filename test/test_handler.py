@@ -0,0 +1,99 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.handler import TrapHandler
+from sensu.snmp.handler import TrapHandlerIndex
+from sensu.snmp.trap import Trap
+
+# helpers
+from helpers.log import log
+
+TRAP_TYPE = (1, 3, 6, 1, 4, 1, 40277, 2, 1, 0, 1)
+OTHER_TRAP_TYPE = (1, 3, 6, 1, 4, 1, 40277, 2, 1, 0, 2)
+MESSAGE_ARG = (1, 3, 6, 1, 4, 1, 40277, 2, 1, 1, 1)
+SYSUPTIME_ARG = (1, 3, 6, 1, 2, 1, 1, 3, 0)
+
+class TrapHandlerTestCase(unittest.TestCase):
+
+    def _trap(self, trap_args):
+        return Trap(TRAP_TYPE, trap_args, hostname="localhost", ipaddress="127.0.0.1", domain="")
+
+    def test_transform(self):
+        trap_handler = TrapHandler(TRAP_TYPE, {MESSAGE_ARG: "message"}, "{hostname} Event", "100% {message} ({ipaddress})", ["default"], 2)
+        trap_event = trap_handler.transform(self._trap({MESSAGE_ARG: "hi"}))
+        self.assertEquals(trap_event.name, "localhost Event")
+        self.assertEquals(trap_event.output, "100% hi (127.0.0.1)")
+        self.assertEquals(trap_event.status, 2)
+
+    def test_transform_format_spec(self):
+        trap_handler = TrapHandler(TRAP_TYPE, {MESSAGE_ARG: "message"}, "{hostname:>10}", "{message!r}", ["default"], 2)
+        trap_event = trap_handler.transform(self._trap({MESSAGE_ARG: "hi"}))
+        self.assertEquals(trap_event.name, " localhost")
+        self.assertEquals(trap_event.output, "'hi'")
+
+    def test_unknown_substitution(self):
+        self.assertRaises(ValueError, TrapHandler, TRAP_TYPE, {}, "{hostname}", "{message}", ["default"], 2)
+
+    def test_positional_substitution(self):
+        self.assertRaises(ValueError, TrapHandler, TRAP_TYPE, {}, "{hostname}", "{0}", ["default"], 2)
+
+class TrapHandlerIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.trap_handlers = {
+            "noargs": self._trap_handler(TRAP_TYPE, {}),
+            "message": self._trap_handler(TRAP_TYPE, {MESSAGE_ARG: "message"}),
+            "message-priority": self._trap_handler(TRAP_TYPE, {MESSAGE_ARG: "message"}, priority=10),
+            "other": self._trap_handler(OTHER_TRAP_TYPE, {}),
+        }
+
+    def _trap_handler(self, trap_type, trap_args, priority=0):
+        return TrapHandler(trap_type, trap_args, "{hostname}", "{oid}", ["default"], 2, None, priority)
+
+    def _trap(self, trap_type, trap_args):
+        return Trap(trap_type, trap_args, hostname="localhost", ipaddress="127.0.0.1", domain="")
+
+    def test_match_first(self):
+        index = TrapHandlerIndex(self.trap_handlers, 'first')
+        trap = self._trap(TRAP_TYPE, {SYSUPTIME_ARG: 1, MESSAGE_ARG: "hi"})
+        self.assertEquals([trap_handler_id for trap_handler_id, th in index.match(trap)], ["message-priority"])
+
+    def test_match_all(self):
+        index = TrapHandlerIndex(self.trap_handlers, 'all')
+        trap = self._trap(TRAP_TYPE, {MESSAGE_ARG: "hi"})
+        self.assertEquals([trap_handler_id for trap_handler_id, th in index.match(trap)], ["message-priority", "message"])
+
+    def test_match_noargs(self):
+        index = TrapHandlerIndex(self.trap_handlers, 'all')
+        trap = self._trap(TRAP_TYPE, {SYSUPTIME_ARG: 1})
+        self.assertEquals([trap_handler_id for trap_handler_id, th in index.match(trap)], ["message-priority", "message", "noargs"])
+
+    def test_match_unknown(self):
+        index = TrapHandlerIndex(self.trap_handlers)
+        self.assertEquals(index.match(self._trap((1, 2, 3), {})), [])
+        self.assertEquals(index.match(self._trap(None, {})), [])
+
+    def test_match_predicates(self):
+        trap_handlers = dict(self.trap_handlers)
+        trap_handlers["critical"] = TrapHandler(TRAP_TYPE, {MESSAGE_ARG: "message"}, "{hostname}", "{oid}", ["default"], 2,
+                                                {"message": {"regex": "critical"}}, 20)
+        trap_handlers["local"] = TrapHandler(TRAP_TYPE, {MESSAGE_ARG: "message"}, "{hostname}", "{oid}", ["default"], 2,
+                                             {"ipaddress": {"cidr": "127.0.0.0/8"}}, 5)
+        index = TrapHandlerIndex(trap_handlers, 'all')
+        trap = self._trap(TRAP_TYPE, {MESSAGE_ARG: "critical failure"})
+        self.assertEquals([trap_handler_id for trap_handler_id, th in index.match(trap)],
+                          ["critical", "message-priority", "local", "message"])
+        trap = self._trap(TRAP_TYPE, {MESSAGE_ARG: "all good"})
+        self.assertEquals([trap_handler_id for trap_handler_id, th in index.match(trap)],
+                          ["message-priority", "local", "message"])
+        self.assertTrue(trap_handlers["critical"].handles(self._trap(TRAP_TYPE, {MESSAGE_ARG: "critical"})))
+        self.assertFalse(trap_handlers["critical"].handles(trap))
+
+    def test_unknown_match_policy(self):
+        self.assertRaises(ValueError, TrapHandlerIndex, self.trap_handlers, 'bogus')
+
+if __name__ == "__main__":
+    unittest.main()
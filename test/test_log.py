@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import logging.handlers
+import tempfile
+import threading
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.log import AsyncLogHandler
+from sensu.snmp.log import make_async
+
+# helpers
+from helpers.log import log
+
+class BlockingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.unblocked = threading.Event()
+        self.records = []
+
+    def emit(self, record):
+        self.unblocked.wait()
+        self.records.append(record.getMessage())
+
+
+class AsyncLogHandlerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.log_dir, "events.log")
+        self.log = logging.getLogger('sensu-trapd.tests.async')
+        self.log.propagate = False
+        self.log.setLevel(logging.INFO)
+        file_handler = logging.handlers.WatchedFileHandler(self.log_file)
+        file_handler.setFormatter(logging.Formatter('%(levelname)s|%(message)s'))
+        self.log.handlers = [file_handler]
+
+    def tearDown(self):
+        for handler in self.log.handlers:
+            handler.close()
+        self.log.handlers = []
+        shutil.rmtree(self.log_dir)
+
+    def read_log(self, path=None):
+        fh = open(path or self.log_file)
+        try:
+            return fh.read().splitlines()
+        finally:
+            fh.close()
+
+    def test_write(self):
+        handler = make_async(self.log, batch_size=10, flush_interval=0.05)
+        for i in range(25):
+            self.log.info("event %d", i)
+        handler.close()
+        self.assertEqual(self.read_log(), ["INFO|event %d" % (i) for i in range(25)])
+        self.assertEqual(handler.stats()['written'], 25)
+        self.assertTrue(handler.stats()['batches'] >= 3)
+
+    def test_exception(self):
+        handler = make_async(self.log, flush_interval=0.05)
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            self.log.exception("failed")
+        handler.close()
+        lines = self.read_log()
+        self.assertEqual(lines[0], "ERROR|failed")
+        self.assertEqual(lines[-1], "ValueError: broken")
+
+    def test_rotation(self):
+        handler = make_async(self.log, flush_interval=0.05)
+        self.log.info("before")
+        deadline = time.time() + 5
+        while handler.stats()['written'] < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        # rotate the log file like logrotate does
+        os.rename(self.log_file, self.log_file + ".1")
+        self.log.info("after")
+        handler.close()
+        self.assertEqual(self.read_log(self.log_file + ".1"), ["INFO|before"])
+        self.assertEqual(self.read_log(), ["INFO|after"])
+
+    def test_drop(self):
+        blocking_handler = BlockingHandler()
+        handler = AsyncLogHandler([blocking_handler], queue_size=2, batch_size=1, flush_interval=0.05)
+        self.log.handlers = [handler]
+        for i in range(10):
+            self.log.info("event %d", i)
+        # the writer holds one record, two are queued
+        self.assertTrue(handler.stats()['dropped'] >= 7)
+        blocking_handler.unblocked.set()
+        handler.close()
+        self.assertEqual(len(blocking_handler.records), 10 - handler.stats()['dropped'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import sys
+import urllib2
+import unittest
+import simplejson as json
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.metrics import Histogram
+from sensu.snmp.metrics import MetricsRegistry
+from sensu.snmp.metrics import MetricsServerThread
+from sensu.snmp.metrics import metric_name
+from sensu.snmp.metrics import to_graphite
+
+# helpers
+from helpers.log import log
+
+class MetricsRegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter(self):
+        self.registry.counter('traps.handled').inc()
+        self.registry.counter('traps.handled').inc(2)
+        self.assertEqual(self.registry.snapshot(), {'traps.handled': 3})
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('latency', buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value)
+        snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot['latency.count'], 4)
+        self.assertAlmostEqual(snapshot['latency.sum'], 6.05)
+        # bucket counts are cumulative
+        self.assertEqual(snapshot['latency.le_0_1'], 1)
+        self.assertEqual(snapshot['latency.le_1'], 3)
+
+    def test_gauge(self):
+        self.registry.gauge('dispatcher', lambda: {'queued': 2, 'connected': True, 'endpoint': 'localhost:3030',
+                                                   'endpoints': {'localhost:3030': {'latency': 0.5}}})
+        self.assertEqual(self.registry.snapshot(), {'dispatcher.queued': 2,
+                                                    'dispatcher.connected': 1,
+                                                    'dispatcher.endpoints.localhost_3030.latency': 0.5})
+        self.registry.remove_gauge('dispatcher')
+        self.assertEqual(self.registry.snapshot(), {})
+
+    def test_gauge_error(self):
+        self.registry.gauge('broken', lambda: 1 / 0)
+        self.registry.counter('traps.handled').inc()
+        self.assertEqual(self.registry.snapshot(), {'traps.handled': 1})
+
+    def test_metric_name(self):
+        self.assertEqual(metric_name('traps', 'matched', 'link down/up'), 'traps.matched.link_down_up')
+
+    def test_to_graphite(self):
+        self.assertEqual(to_graphite({'traps.handled': 3, 'events.generated': 2}, 'host.sensu-trapd', 1000.5),
+                         "host.sensu-trapd.events.generated 2 1000\nhost.sensu-trapd.traps.handled 3 1000")
+
+
+class MetricsServerThreadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics_server_thread = MetricsServerThread('127.0.0.1', 0, lambda: {'traps.handled': 3})
+        self.metrics_server_thread.start()
+        self.url = "http://%s:%d" % self.metrics_server_thread.address
+
+    def tearDown(self):
+        self.metrics_server_thread.stop()
+        self.metrics_server_thread.join()
+
+    def test_stats(self):
+        response = urllib2.urlopen(self.url + "/stats")
+        self.assertEqual(response.info()['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.read()), {'traps.handled': 3})
+
+    def test_not_found(self):
+        try:
+            urllib2.urlopen(self.url + "/other")
+            self.fail("expected a 404")
+        except urllib2.HTTPError, e:
+            self.assertEqual(e.code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
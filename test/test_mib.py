@@ -1,6 +1,9 @@
 import os
 import sys
+import shutil
+import tempfile
 import unittest
+import threading
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 
@@ -31,9 +34,83 @@ class MibResolverTestCase(unittest.TestCase):
         snmp_trap_oid = (1, 3, 6, 1, 6, 3, 1, 1, 4, 1)
         self.assertEquals(self.mibs.lookup_oid(snmp_trap_oid), ('SNMPv2-MIB', 'snmpTrapOID'))
 
+    def test_lookup_oid_cache(self):
+        snmp_trap_oid = (1, 3, 6, 1, 6, 3, 1, 1, 4, 1)
+        self.mibs.lookup_oid(snmp_trap_oid)
+        self.assertEquals(self.mibs.lookup_oid(snmp_trap_oid), ('SNMPv2-MIB', 'snmpTrapOID'))
+        self.assertEquals(self.mibs.cache_stats()['oid']['hits'], 1)
+        self.assertEquals(self.mibs.cache_stats()['oid']['misses'], 1)
+
+    def test_lookup_oids(self):
+        sys_name = (1, 3, 6, 1, 2, 1, 1, 5, 0)
+        sys_or_descr_1 = (1, 3, 6, 1, 2, 1, 1, 9, 1, 3, 1)
+        sys_or_descr_2 = (1, 3, 6, 1, 2, 1, 1, 9, 1, 3, 2)
+        self.assertEquals(self.mibs.lookup_oids([sys_name, sys_or_descr_1, sys_or_descr_2]),
+                          [('SNMPv2-MIB', 'sysName'), ('SNMPv2-MIB', 'sysORDescr'), ('SNMPv2-MIB', 'sysORDescr')])
+
+    def test_load_mib_clears_cache(self):
+        snmp_trap_oid = (1, 3, 6, 1, 6, 3, 1, 1, 4, 1)
+        self.mibs.lookup_oid(snmp_trap_oid)
+        self.mibs.load_mib('SNMPv2-MIB')
+        self.assertEquals(self.mibs.cache_stats()['oid']['size'], 0)
+
+    def test_lookup_oid_threads(self):
+        # the receiver and the main thread share the caches
+        self.mibs = MibResolver(cache_size=4)
+        oids = [((1, 3, 6, 1, 2, 1, 1, 9, 1, 3, i), ('SNMPv2-MIB', 'sysORDescr')) for i in range(1, 9)]
+        oids.append(((1, 3, 6, 1, 2, 1, 1, 5, 0), ('SNMPv2-MIB', 'sysName')))
+        errors = []
+
+        def lookup():
+            try:
+                for i in range(200):
+                    for oid, expected in oids:
+                        self.assertEquals(self.mibs.lookup_oid(oid), expected)
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=lookup) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(errors, [])
+        self.assertEquals(self.mibs.cache_stats()['oid']['size'], 4)
+
+    def test_lookup_value(self):
+        self.assertEquals(str(self.mibs.lookup_value('SNMPv2-MIB', 'sysName', 'whatup')), 'whatup')
+        self.assertEquals(self.mibs.lookup_value('SNMPv2-MIB', 'snmpTraps', 'whatup'), None)
+
     def test_lookup_oid_unknown(self):
         unknown_oid = (1, 2, 3, 4, 5, 6)
         #self.assertRaises(NoSuchObjectError, self.mibs.lookup_oid, unknown_oid)
 
+class TableMibResolverTestCase(MibResolverTestCase):
+
+    def setUp(self):
+        self.table_dir = tempfile.mkdtemp()
+        self.table_path = os.path.join(self.table_dir, "mibs.table")
+        # compile the table, then serve lookups from it
+        MibResolver(table_path=self.table_path)
+        self.mibs = MibResolver(table_path=self.table_path)
+
+    def tearDown(self):
+        del self.mibs
+        shutil.rmtree(self.table_dir)
+
+    def test_table_used(self):
+        self.assertEquals(self.mibs._mib_builder, None)
+        snmp_trap_oid = (1, 3, 6, 1, 6, 3, 1, 1, 4, 1)
+        self.assertEquals(self.mibs.lookup_oid(snmp_trap_oid), ('SNMPv2-MIB', 'snmpTrapOID'))
+        self.assertEquals(self.mibs.lookup('SNMPv2-MIB', 'snmpTrapOID'), snmp_trap_oid)
+        self.assertEquals(str(self.mibs.lookup_value('SNMPv2-MIB', 'sysName', 'whatup')), 'whatup')
+        self.assertEquals(self.mibs._mib_builder, None)
+        self.assertEquals(self.mibs.cache_stats()['table']['fallbacks'], 0)
+
+    def test_table_miss(self):
+        self.assertRaises(Exception, self.mibs.lookup, 'SNMPv2-MIB', 'noSuchSymbol')
+        self.assertEquals(self.mibs.cache_stats()['table']['fallbacks'], 1)
+        self.assertNotEquals(self.mibs._mib_builder, None)
+
 if __name__ == "__main__":
     unittest.main()
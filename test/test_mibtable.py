@@ -0,0 +1,114 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.mib import MibResolver
+from sensu.snmp.mibtable import MibTable
+from sensu.snmp.mibtable import MibTableFormatError
+from sensu.snmp.mibtable import compile_mib_table
+from sensu.snmp.mibtable import mib_sources
+from sensu.snmp.mibtable import open_mib_table
+
+# helpers
+from helpers.log import log
+
+MIB_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../conf/mibs'))
+MIBS = ["CLOUDANT-REG-MIB", "CLOUDANT-PLATFORM-MIB", "CLOUDANT-METRICS-MIB"]
+
+class MibTableTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.table_dir = tempfile.mkdtemp()
+        self.mib_dir = os.path.join(self.table_dir, "mibs")
+        shutil.copytree(MIB_DIR, self.mib_dir)
+        self.path = os.path.join(self.table_dir, "mibs.table")
+        self.mibs = MibResolver([self.mib_dir], MIBS)
+        self.sources = mib_sources(self.mibs._mib_paths, self.mibs._mib_list)
+        compile_mib_table(self.path, self.mibs._mib_builder, self.mibs._mib_view, self.sources)
+
+    def tearDown(self):
+        shutil.rmtree(self.table_dir)
+
+    def test_lookups_match_pysnmp(self):
+        table = MibTable(self.path)
+        try:
+            for module, symbols in self.mibs._mib_builder.mibSymbols.items():
+                for symbol, mib_node in symbols.items():
+                    if not isinstance(getattr(mib_node, 'name', None), tuple):
+                        continue
+                    oid = tuple(mib_node.name)
+                    self.assertEquals(table.lookup_name(module, symbol)[0], oid)
+                    node_module, node_symbol, node_oid, column = table.lookup_oid(oid)
+                    self.assertEquals((node_module, node_symbol), self.mibs.lookup_oid(oid))
+                    self.assertEquals(column, hasattr(mib_node, 'createTest'))
+        finally:
+            table.close()
+
+    def test_values_match_pysnmp(self):
+        resolver = MibResolver([self.mib_dir], MIBS, table_path=self.path)
+        self.assertEquals(str(resolver.lookup_value('CLOUDANT-PLATFORM-MIB', 'cloudantTrapLevel', 2)),
+                          str(self.mibs.lookup_value('CLOUDANT-PLATFORM-MIB', 'cloudantTrapLevel', 2)))
+        self.assertEquals(str(resolver.lookup_value('SNMPv2-MIB', 'sysUpTime', 1234)), '1234')
+        self.assertEquals(resolver.lookup_value('SNMPv2-MIB', 'snmpTraps', 'whatup'), None)
+        self.assertEquals(resolver._mib_builder, None)
+
+    def test_object_identifier_values(self):
+        resolver = MibResolver([self.mib_dir], MIBS, table_path=self.path)
+        value = (1, 3, 6, 1, 4, 1, 8072, 3, 2, 10)
+        self.assertEquals(resolver.lookup_value('SNMPv2-MIB', 'sysObjectID', value),
+                          self.mibs.lookup_value('SNMPv2-MIB', 'sysObjectID', value))
+        self.assertEquals(resolver.cache_stats()['table']['fallbacks'], 0)
+        self.assertEquals(resolver._mib_builder, None)
+
+    def test_closest_node(self):
+        table = MibTable(self.path)
+        try:
+            # a table column resolves below its OID, other nodes don't
+            sys_or_descr = (1, 3, 6, 1, 2, 1, 1, 9, 1, 3)
+            self.assertEquals(table.lookup_oid(sys_or_descr + (7,)),
+                              ('SNMPv2-MIB', 'sysORDescr', sys_or_descr, True))
+            self.assertEquals(table.lookup_oid((1, 3, 6, 1, 2, 1, 1, 5, 0))[:2], ('SNMPv2-MIB', 'sysName'))
+            self.assertEquals(table.lookup_oid((9, 9)), None)
+        finally:
+            table.close()
+
+    def test_open_current(self):
+        table = open_mib_table(self.path, mib_sources([self.mib_dir], MibResolver.DEFAULT_MIB_LIST + MIBS))
+        self.assertNotEquals(table, None)
+        table.close()
+
+    def test_open_missing(self):
+        self.assertEquals(open_mib_table(self.path + ".missing", self.sources), None)
+
+    def test_stale_mtime(self):
+        mib_file = os.path.join(self.mib_dir, "CLOUDANT-REG-MIB.py")
+        os.utime(mib_file, (time.time() + 10, time.time() + 10))
+        sources = mib_sources(self.mibs._mib_paths, self.mibs._mib_list)
+        self.assertEquals(open_mib_table(self.path, sources), None)
+
+    def test_stale_mibs(self):
+        sources = mib_sources(self.mibs._mib_paths, self.mibs._mib_list[:-1])
+        self.assertEquals(open_mib_table(self.path, sources), None)
+
+    def test_recompile_stale(self):
+        os.utime(os.path.join(self.mib_dir, "CLOUDANT-REG-MIB.py"), (time.time() + 10, time.time() + 10))
+        resolver = MibResolver([self.mib_dir], MIBS, table_path=self.path)
+        self.assertNotEquals(resolver._mib_builder, None)
+        table = open_mib_table(self.path, mib_sources(resolver._mib_paths, resolver._mib_list))
+        self.assertNotEquals(table, None)
+        table.close()
+
+    def test_not_a_table(self):
+        fh = open(self.path, 'wb')
+        fh.write("not a MIB table, but long enough for a header")
+        fh.close()
+        self.assertRaises(MibTableFormatError, MibTable, self.path)
+        self.assertEquals(open_mib_table(self.path, self.sources), None)
+
+if __name__ == "__main__":
+    unittest.main()
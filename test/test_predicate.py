@@ -0,0 +1,117 @@
+import os
+import sys
+import random
+import unittest
+
+from pysnmp.proto.rfc1902 import Integer32
+from pysnmp.proto.rfc1902 import IpAddress
+from pysnmp.proto.rfc1902 import OctetString
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.predicate import parse_predicates
+from sensu.snmp.predicate import PredicateIndex
+from sensu.snmp.predicate import RangeIndex
+from sensu.snmp.predicate import RangePredicate
+from sensu.snmp.trap import Trap
+
+# helpers
+from helpers.log import log
+
+TRAP_TYPE = (1, 3, 6, 1, 4, 1, 40277, 2, 1, 0, 1)
+LEVEL_ARG = (1, 3, 6, 1, 4, 1, 40277, 2, 1, 1, 1)
+MESSAGE_ARG = (1, 3, 6, 1, 4, 1, 40277, 2, 1, 1, 2)
+ADDRESS_ARG = (1, 3, 6, 1, 4, 1, 40277, 2, 1, 1, 3)
+TRAP_ARGS = {LEVEL_ARG: "level", MESSAGE_ARG: "message", ADDRESS_ARG: "address"}
+
+def trap(level=None, message=None, address=None, ipaddress="10.1.2.3"):
+    arguments = dict()
+    if level is not None:
+        arguments[LEVEL_ARG] = Integer32(level)
+    if message is not None:
+        arguments[MESSAGE_ARG] = OctetString(message)
+    if address is not None:
+        arguments[ADDRESS_ARG] = IpAddress(address)
+    return Trap(TRAP_TYPE, arguments, hostname="host", ipaddress=ipaddress, domain="")
+
+def matches(predicates, trap):
+    return all(predicate.matches(trap) for predicate in parse_predicates(predicates, TRAP_ARGS))
+
+class PredicateTestCase(unittest.TestCase):
+
+    def test_equals(self):
+        self.assertTrue(matches({"level": 3}, trap(level=3)))
+        self.assertFalse(matches({"level": 3}, trap(level=4)))
+        self.assertTrue(matches({"message": {"in": ["a", "b"]}}, trap(message="b")))
+        self.assertTrue(matches({"hostname": "host"}, trap()))
+
+    def test_missing_value(self):
+        self.assertFalse(matches({"level": 3}, trap()))
+        self.assertFalse(matches({"level": {"ge": 0}}, trap()))
+
+    def test_range(self):
+        self.assertTrue(matches({"level": {"ge": 3, "lt": 5}}, trap(level=3)))
+        self.assertTrue(matches({"level": {"ge": 3, "lt": 5}}, trap(level=4)))
+        self.assertFalse(matches({"level": {"ge": 3, "lt": 5}}, trap(level=5)))
+        self.assertFalse(matches({"level": {"gt": 3}}, trap(level=3)))
+        self.assertTrue(matches({"message": {"le": 10}}, trap(message="9.5")))
+        self.assertFalse(matches({"message": {"le": 10}}, trap(message="not a number")))
+
+    def test_regex(self):
+        self.assertTrue(matches({"message": {"regex": "^disk .* full$"}}, trap(message="disk /var full")))
+        self.assertFalse(matches({"message": {"regex": "^disk"}}, trap(message="the disk")))
+
+    def test_cidr(self):
+        self.assertTrue(matches({"ipaddress": {"cidr": "10.0.0.0/8"}}, trap()))
+        self.assertFalse(matches({"ipaddress": {"cidr": ["192.168.0.0/16", "10.1.3.0/24"]}}, trap()))
+        self.assertTrue(matches({"ipaddress": {"cidr": "10.1.2.3"}}, trap()))
+        self.assertTrue(matches({"address": {"cidr": "172.16.0.0/12"}}, trap(address="172.17.0.1")))
+        self.assertTrue(matches({"ipaddress": {"cidr": "fd00::/8"}}, trap(ipaddress="fd12::1")))
+        self.assertFalse(matches({"ipaddress": {"cidr": "fd00::/8"}}, trap()))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parse_predicates, {"unknown": 1}, TRAP_ARGS)
+        self.assertRaises(ValueError, parse_predicates, {"level": {"bogus": 1}}, TRAP_ARGS)
+        self.assertRaises(ValueError, parse_predicates, {"message": {"regex": "("}}, TRAP_ARGS)
+        self.assertRaises(ValueError, parse_predicates, {"ipaddress": {"cidr": "10.0.0.0/33"}}, TRAP_ARGS)
+
+class RangeIndexTestCase(unittest.TestCase):
+
+    def test_match(self):
+        ranges = [(0, RangePredicate(None, 1, True, 5, False)),
+                  (1, RangePredicate(None, 3, False, None)),
+                  (2, RangePredicate(None, None, True, 3, True))]
+        index = RangeIndex(ranges)
+        for number in (-1, 1, 2, 3, 4, 5, 6):
+            self.assertEqual(set(index.match(number)),
+                             set(predicate_id for predicate_id, predicate in ranges if predicate.test(number)))
+
+class PredicateIndexTestCase(unittest.TestCase):
+
+    def test_matches_predicates(self):
+        # the index agrees with testing every predicate of every handler
+        rng = random.Random(42)
+        handlers = []
+        for key in range(300):
+            predicates = dict()
+            if rng.random() < 0.5:
+                predicates["level"] = rng.choice([rng.randint(0, 9), {"ge": rng.randint(0, 5), "lt": rng.randint(4, 10)}])
+            if rng.random() < 0.3:
+                predicates["message"] = {"regex": rng.choice(["^a", "b$", "c"])}
+            if rng.random() < 0.3:
+                predicates["ipaddress"] = {"cidr": rng.choice(["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24"])}
+            if not predicates:
+                predicates["hostname"] = rng.choice(["host", "other"])
+            handlers.append((key, parse_predicates(predicates, TRAP_ARGS)))
+        index = PredicateIndex(handlers)
+
+        for i in range(200):
+            t = trap(level=rng.choice([None, rng.randint(0, 10)]),
+                     message=rng.choice([None, "abc", "cab", "xyz"]),
+                     ipaddress=rng.choice(["10.1.2.3", "10.2.0.1", "192.168.1.1"]))
+            expected = set(key for key, predicates in handlers
+                           if all(predicate.matches(t) for predicate in predicates))
+            self.assertEqual(index.match(t), expected)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.ratelimit import TrapRateLimiter
+
+# helpers
+from helpers.log import log
+
+class TrapRateLimiterTestCase(unittest.TestCase):
+
+    def test_allow(self):
+        limiter = TrapRateLimiter(rate=10, burst=5)
+        # the burst is allowed right away
+        self.assertEqual([limiter.allow("10.0.0.1", now=100) for i in range(7)], [True] * 5 + [False] * 2)
+        # other sources have their own bucket
+        self.assertTrue(limiter.allow("10.0.0.2", now=100))
+        # the bucket refills at rate tokens per second
+        self.assertEqual([limiter.allow("10.0.0.1", now=100.25) for i in range(3)], [True, True, False])
+        self.assertEqual((limiter.allowed, limiter.suppressed), (8, 3))
+
+    def test_allow_per_trap(self):
+        limiter = TrapRateLimiter(rate=1, burst=1, per_trap=True)
+        self.assertTrue(limiter.allow("10.0.0.1", (1, 3, 6, 1, 1), now=100))
+        self.assertTrue(limiter.allow("10.0.0.1", (1, 3, 6, 1, 2), now=100))
+        self.assertFalse(limiter.allow("10.0.0.1", (1, 3, 6, 1, 1), now=100))
+
+    def test_summarize(self):
+        limiter = TrapRateLimiter(rate=1, burst=1)
+        for i in range(4):
+            limiter.allow("10.0.0.1", now=100)
+        for i in range(2):
+            limiter.allow("10.0.0.2", now=100)
+        self.assertEqual(limiter.summarize(), (4, [("10.0.0.1", None, 3), ("10.0.0.2", None, 1)]))
+        # counts are reset by a summary
+        self.assertEqual(limiter.summarize(), (0, []))
+
+    def test_bounded(self):
+        limiter = TrapRateLimiter(rate=1, burst=1, max_sources=2)
+        for i in range(10):
+            limiter.allow("10.0.0.%d" % (i), now=100)
+            limiter.allow("10.0.0.%d" % (i), now=100)
+        self.assertEqual(limiter.stats()['size'], 2)
+        # suppressed traps of evicted sources are still counted
+        total, sources = limiter.summarize()
+        self.assertEqual(total, 10)
+        self.assertEqual(len(sources), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,25 @@
 import time
 import os
 import sys
+import shutil
+import socket
+import tempfile
 import unittest
 import logging
 from mock import Mock
 from mock import patch
 
+from pyasn1.codec.ber import encoder
+from pyasn1.codec.ber import decoder
 from pysnmp.entity.rfc3413.oneliner import ntforg
+from pysnmp.proto import api
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 
 from sensu.snmp.mib import MibResolver
 from sensu.snmp.receiver import TrapReceiverThread
+from sensu.snmp.ratelimit import TrapRateLimiter
+from sensu.snmp.capture import read_capture
 
 # helpers
 from helpers.log import log, configure_log
@@ -24,13 +32,22 @@ class TrapReceiverTestCase(unittest.TestCase):
                     "transport": {
                         "listen_address": "127.0.0.1",
                         "listen_port": 1620,
+                        "listen": [],
                         "udp": {
-                            "enabled": True
+                            "enabled": True,
+                            "rcvbuf": None,
+                            "stats_interval": 10
                         },
                         "tcp": {
                             "enabled": False 
                         }
                     },
+                    "fast_path": {
+                        "enabled": False
+                    },
+                    "capture": {
+                        "enabled": False
+                    },
                     "auth": {
                         "version2": {
                             "community": "public",
@@ -44,12 +61,19 @@ class TrapReceiverTestCase(unittest.TestCase):
                     }
                 }
             }
+        self._configure()
         self.mibs = MibResolver()
         self.traps = []
-        self.trap_receiver_thread = TrapReceiverThread(self.config, self.mibs, self._trap_receiver_callback)
+        self.trap_receiver_thread = self._create_trap_receiver_thread()
         self.trap_receiver_thread.setDaemon(1)
         self.trap_receiver_thread.start()
 
+    def _configure(self):
+        pass
+
+    def _create_trap_receiver_thread(self):
+        return TrapReceiverThread(self.config, self.mibs, self._trap_receiver_callback)
+
     def tearDown(self):
         self.traps = []
         self.trap_receiver_thread.stop()
@@ -117,6 +141,138 @@ class TrapReceiverTestCase(unittest.TestCase):
         # make sure we got it
         self.assertTrapReceived(('SNMPv2-MIB', 'coldStart'), {('SNMPv2-MIB', 'sysName'): "whatup"})
 
+class FastPathTrapReceiverTestCase(TrapReceiverTestCase):
+
+    def _configure(self):
+        self.config['snmp']['fast_path']['enabled'] = True
+
+    def test_receive_inform(self):
+        # INFORMs are handled by the pysnmp engine
+        self.send_inform(('SNMPv2-MIB', 'coldStart'), {('SNMPv2-MIB', 'sysName'): "whatup"})
+        self.assertTrapReceived(('SNMPv2-MIB', 'coldStart'), {('SNMPv2-MIB', 'sysName'): "whatup"})
+
+class RateLimitedTrapReceiverTestCase(TrapReceiverTestCase):
+
+    def _create_trap_receiver_thread(self):
+        self.rate_limiter = TrapRateLimiter(0.001, 1)
+        return TrapReceiverThread(self.config, self.mibs, self._trap_receiver_callback,
+                                  rate_limiter=self.rate_limiter)
+
+    def test_receive_trap_rate_limited(self):
+        self.send_trap(('SNMPv2-MIB', 'coldStart'), {('SNMPv2-MIB', 'sysName'): "first"})
+        self.send_trap(('SNMPv2-MIB', 'coldStart'), {('SNMPv2-MIB', 'sysName'): "second"})
+        self.assertEqual(len(self.traps), 1)
+        self.assertEqual(self.rate_limiter.summarize(), (1, [("127.0.0.1", None, 1)]))
+
+class CapturingTrapReceiverTestCase(TrapReceiverTestCase):
+
+    def _configure(self):
+        self.capture_dir = tempfile.mkdtemp()
+        self.config['snmp']['capture'] = {"enabled": True,
+                                          "path": os.path.join(self.capture_dir, "traps.capture"),
+                                          "max_size": 0,
+                                          "max_files": 0}
+
+    def tearDown(self):
+        TrapReceiverTestCase.tearDown(self)
+        shutil.rmtree(self.capture_dir)
+
+    def test_capture(self):
+        self.send_trap(('SNMPv2-MIB', 'coldStart'), {('SNMPv2-MIB', 'sysName'): "captured"})
+        self.trap_receiver_thread.stop()
+        self.trap_receiver_thread.join()
+        records = list(read_capture(self.config['snmp']['capture']['path']))
+        self.assertEqual(len(records), 1)
+        timestamp, transport, address, message = records[0]
+        self.assertEqual(address[0], "127.0.0.1")
+        self.assertTrue("captured" in message)
+
+class TcpTrapReceiverTestCase(TrapReceiverTestCase):
+
+    def _configure(self):
+        self.config['snmp']['transport']['tcp'] = {"enabled": True,
+                                                   "max_connections": 16,
+                                                   "idle_timeout": 300,
+                                                   "max_message_size": 65535}
+
+    def _encode_notification(self, pdu_type, text):
+        v2c = api.protoModules[api.protoVersion2c]
+        pdu = getattr(v2c, pdu_type)()
+        v2c.apiPDU.setDefaults(pdu)
+        v2c.apiPDU.setVarBinds(pdu, [((1, 3, 6, 1, 2, 1, 1, 3, 0), v2c.TimeTicks(0)),
+                                     ((1, 3, 6, 1, 6, 3, 1, 1, 4, 1, 0), v2c.ObjectIdentifier((1, 3, 6, 1, 6, 3, 1, 1, 5, 1))),
+                                     ((1, 3, 6, 1, 2, 1, 1, 5, 0), v2c.OctetString(text))])
+        message = v2c.Message()
+        v2c.apiMessage.setDefaults(message)
+        v2c.apiMessage.setCommunity(message, self.config['snmp']['auth']['version2']['community'])
+        v2c.apiMessage.setPDU(message, pdu)
+        return encoder.encode(message)
+
+    def _connect(self):
+        client = socket.create_connection((self.config['snmp']['transport']['listen_address'],
+                                           self.config['snmp']['transport']['listen_port']))
+        client.settimeout(5)
+        return client
+
+    def test_receive_tcp_traps(self):
+        client = self._connect()
+        try:
+            # two traps in one segment, the second split across segments
+            stream = self._encode_notification('TrapPDU', "first") + self._encode_notification('TrapPDU', "second")
+            client.sendall(stream[:-5])
+            time.sleep(0.2)
+            client.sendall(stream[-5:])
+            time.sleep(1)
+        finally:
+            client.close()
+        self.assertEqual(sorted(str(trap.arguments.values()[0]) for trap in self.traps), ["first", "second"])
+        self.assertEqual(self.traps[0].properties['ipaddress'], "127.0.0.1")
+
+    def test_receive_tcp_inform(self):
+        client = self._connect()
+        try:
+            client.sendall(self._encode_notification('InformRequestPDU', "inform"))
+            # the acknowledgement comes back over the connection
+            response, rest = decoder.decode(client.recv(65535), asn1Spec=api.protoModules[api.protoVersion2c].Message())
+        finally:
+            client.close()
+        pdu = api.protoModules[api.protoVersion2c].apiMessage.getPDU(response)
+        self.assertTrue(isinstance(pdu, api.protoModules[api.protoVersion2c].ResponsePDU))
+        self.assertEqual([str(trap.arguments.values()[0]) for trap in self.traps], ["inform"])
+
+class MultipleEndpointsTrapReceiverTestCase(TcpTrapReceiverTestCase):
+
+    def _configure(self):
+        TcpTrapReceiverTestCase._configure(self)
+        self.config['snmp']['transport']['listen'] = [{"address": "127.0.0.1", "rcvbuf": 262144},
+                                                      {"address": "::1", "port": 1621}]
+
+    def test_receive_ipv6_traps(self):
+        message = self._encode_notification('TrapPDU', "udp6")
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        try:
+            sock.sendto(message, ("::1", 1621))
+        finally:
+            sock.close()
+        client = socket.create_connection(("::1", 1621))
+        try:
+            client.sendall(self._encode_notification('TrapPDU', "tcp6"))
+            time.sleep(1)
+        finally:
+            client.close()
+        self.assertEqual(sorted(str(trap.arguments.values()[0]) for trap in self.traps), ["tcp6", "udp6"])
+        self.assertEqual([trap.properties['ipaddress'] for trap in self.traps], ["::1", "::1"])
+
+    def test_udp_socket_stats(self):
+        # stopping the receiver before it runs is racy
+        time.sleep(1)
+        if not os.path.exists("/proc/net/udp"):
+            return
+        stats = self.trap_receiver_thread._trap_receiver._udp_monitor.stats()
+        self.assertEqual(sorted(stats), ["127.0.0.1:1620", "::1:1621"])
+        self.assertTrue(stats["127.0.0.1:1620"]['rcvbuf'] >= 262144)
+        self.assertEqual(stats["127.0.0.1:1620"]['drops'], 0)
+
 if __name__ == "__main__":
     configure_log(logging.getLogger('sensu-trapd'))
     unittest.main()
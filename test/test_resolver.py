@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import socket
+import tempfile
+import unittest
+from mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.resolver import HostnameResolver
+
+# helpers
+from helpers.log import log
+
+def slow_gethostbyaddr(address):
+    time.sleep(0.5)
+    return ("slow.example.com", [], [address])
+
+def failing_gethostbyaddr(address):
+    raise socket.herror(1, "Unknown host")
+
+class HostnameResolverTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.resolver = HostnameResolver(threads=2, max_pending=1, timeout=0.1)
+        self.resolver.start()
+
+    def tearDown(self):
+        self.resolver.stop()
+
+    def test_hosts_file(self):
+        fd, hosts_file = tempfile.mkstemp()
+        try:
+            os.write(fd, "# comment\n10.0.0.1  switch01.example.com switch01\n10.0.0.2 localhost\n")
+            os.close(fd)
+            self.resolver.load_hosts_file(hosts_file)
+        finally:
+            os.unlink(hosts_file)
+        self.assertEquals(self.resolver.resolve("10.0.0.1"), ("switch01", "example.com"))
+        self.assertEquals(self.resolver.resolve("10.0.0.2"), ("localhost", ""))
+
+    @patch('socket.gethostbyaddr', slow_gethostbyaddr)
+    def test_timeout(self):
+        self.assertEquals(self.resolver.resolve("10.0.0.3"), ("10.0.0.3", "10.0.0.3"))
+        self.assertEquals(self.resolver.stats()['timeouts'], 1)
+        # a second lookup can't be started while the first is in flight
+        self.assertEquals(self.resolver.resolve("10.0.0.4"), ("10.0.0.4", "10.0.0.4"))
+        self.assertEquals(self.resolver.stats()['overflows'], 1)
+        # once the lookup finishes the result is cached
+        time.sleep(0.6)
+        self.assertEquals(self.resolver.resolve("10.0.0.3"), ("slow", "example.com"))
+
+    @patch('socket.gethostbyaddr', failing_gethostbyaddr)
+    def test_negative_cache(self):
+        self.assertEquals(self.resolver.resolve("10.0.0.5"), ("10.0.0.5", "10.0.0.5"))
+        self.assertEquals(self.resolver.resolve("10.0.0.5"), ("10.0.0.5", "10.0.0.5"))
+        self.assertEquals(self.resolver.stats()['failures'], 1)
+
+if __name__ == "__main__":
+    unittest.main()
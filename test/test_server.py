@@ -0,0 +1,197 @@
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+import simplejson as json
+from mock import Mock
+from pysnmp.proto.rfc1902 import ObjectName
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.config import DEFAULT_CONFIG
+from sensu.snmp.config import _merge_config
+from sensu.snmp.server import SensuTrapServer
+from sensu.snmp.trap import Trap
+
+# helpers
+from helpers.log import log
+
+COLD_START = ObjectName((1, 3, 6, 1, 6, 3, 1, 1, 5, 1))
+WARM_START = ObjectName((1, 3, 6, 1, 6, 3, 1, 1, 5, 2))
+
+def trap_handler(trap_type, name):
+    return {
+        "trap": {"type": ["SNMPv2-MIB", trap_type]},
+        "event": {"name": name, "output": "{oid}", "handlers": ["default"], "severity": "WARNING"}
+    }
+
+class SensuTrapServerReloadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config_dir = tempfile.mkdtemp()
+        self.trap_file = os.path.join(self.config_dir, "traps.json")
+        self.config_file = os.path.join(self.config_dir, "config.json")
+        self.write_trap_file({"cold": trap_handler("coldStart", "cold"),
+                              "warm": trap_handler("warmStart", "warm")})
+        self.write_config_file([])
+        config = _merge_config(DEFAULT_CONFIG, json.load(open(self.config_file)))
+        self.server = SensuTrapServer(config, self.config_file)
+        self.events = []
+        self.server._dispatch_trap_event = self.events.append
+
+    def tearDown(self):
+        self.server._trap_receiver_thread._trap_receiver.transport_dispatcher.closeDispatcher()
+        shutil.rmtree(self.config_dir)
+
+    def write_trap_file(self, trap_handlers):
+        fh = open(self.trap_file, 'w')
+        fh.write(json.dumps(trap_handlers))
+        fh.close()
+
+    def write_config_file(self, mibs):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        fh = open(self.config_file, 'w')
+        fh.write(json.dumps({
+            "daemon": {"trap_file": self.trap_file},
+            "mibs": {"paths": [os.path.abspath(os.path.join(os.path.dirname(__file__), '../conf/mibs'))],
+                     "mibs": mibs},
+            "resolver": {"enabled": False},
+            "snmp": {"transport": {"listen_address": "127.0.0.1", "listen_port": port}}
+        }))
+        fh.close()
+
+    def handle(self, trap_oid):
+        self.server._handle_trap(Trap(trap_oid, {}))
+        return [event.name for event in self.events if event.name != "sensu-trapd-reload"]
+
+    def test_reload_changed_handlers(self):
+        warm = self.server._trap_handlers['warm']
+        self.write_trap_file({"cold": trap_handler("coldStart", "cold-changed"),
+                              "warm": trap_handler("warmStart", "warm")})
+        self.assertTrue(self.server.reload())
+        # unchanged handlers are kept
+        self.assertTrue(self.server._trap_handlers['warm'] is warm)
+        self.assertEqual(self.handle(COLD_START), ["cold-changed"])
+
+    def test_reload_added_and_removed_handlers(self):
+        self.write_trap_file({"cold-2": trap_handler("coldStart", "cold-2")})
+        self.assertTrue(self.server.reload())
+        self.assertEqual(sorted(self.server._trap_handlers.keys()), ["cold-2"])
+        self.assertEqual(self.handle(WARM_START), [])
+        self.assertEqual(self.handle(COLD_START), ["cold-2"])
+
+    def test_reload_error_keeps_handlers(self):
+        trap_handlers = self.server._trap_handlers
+        fh = open(self.trap_file, 'w')
+        fh.write("{not json")
+        fh.close()
+        self.assertFalse(self.server.reload())
+        self.assertTrue(self.server._trap_handlers is trap_handlers)
+        self.assertEqual(self.handle(COLD_START), ["cold"])
+        self.assertEqual([(event.name, event.status) for event in self.events],
+                         [("sensu-trapd-reload", 1), ("cold", 1)])
+
+        # the next successful reload resolves the failure
+        self.write_trap_file({"cold": trap_handler("coldStart", "cold")})
+        self.assertTrue(self.server.reload())
+        self.assertEqual((self.events[-1].name, self.events[-1].status), ("sensu-trapd-reload", 0))
+
+    def test_reload_unknown_symbol(self):
+        self.write_trap_file({"cold": trap_handler("noSuchTrap", "cold")})
+        self.assertFalse(self.server.reload())
+        self.assertEqual(self.handle(COLD_START), ["cold"])
+
+    def test_numeric_severity(self):
+        cold = trap_handler("coldStart", "cold")
+        cold['event']['severity'] = 2
+        self.write_trap_file({"cold": cold})
+        self.assertTrue(self.server.reload())
+        self.assertEqual(self.handle(COLD_START), ["cold"])
+        self.assertEqual(json.loads(self.events[-1].to_json())['status'], 2)
+
+    def test_reload_invalid_severity(self):
+        for severity in ("BOGUS", 7):
+            cold = trap_handler("coldStart", "cold")
+            cold['event']['severity'] = severity
+            self.write_trap_file({"cold": cold})
+            self.assertFalse(self.server.reload())
+
+    def test_reload_added_mibs(self):
+        mibs = self.server._mibs
+        cold = self.server._trap_handlers['cold']
+        self.write_config_file(["CLOUDANT-REG-MIB"])
+        self.assertTrue(self.server.reload())
+        self.assertFalse(self.server._mibs is mibs)
+        self.assertTrue(self.server._trap_receiver_thread._trap_receiver._mibs is self.server._mibs)
+        # adding MIBs doesn't change the existing trap handlers
+        self.assertTrue(self.server._trap_handlers['cold'] is cold)
+        self.assertTrue(self.server._mibs.lookup('CLOUDANT-REG-MIB', 'cloudant'))
+
+    def test_trap_dir(self):
+        trap_dir = os.path.join(self.config_dir, "trap.d")
+        os.mkdir(trap_dir)
+        fh = open(os.path.join(trap_dir, "warm.json"), 'w')
+        fh.write(json.dumps({"warm-2": trap_handler("warmStart", "warm-2")}))
+        fh.close()
+        daemon_config = dict(self.server._config['daemon'], trap_dir=trap_dir)
+        trap_handler_configs, trap_handlers = self.server._load_trap_handlers(daemon_config, self.server._mibs)
+        self.assertEqual(sorted(trap_handlers.keys()), ["cold", "warm", "warm-2"])
+
+        # an id defined twice is an error
+        fh = open(os.path.join(trap_dir, "cold.json"), 'w')
+        fh.write(json.dumps({"cold": trap_handler("coldStart", "cold")}))
+        fh.close()
+        self.assertRaises(ValueError, self.server._load_trap_handlers, daemon_config, self.server._mibs)
+
+    def test_trap_bundle(self):
+        bundle = os.path.join(self.config_dir, "traps.bundle")
+        daemon_config = dict(self.server._config['daemon'], trap_bundle=bundle)
+        mibs = self.server._mibs
+        self.server._load_trap_handlers(daemon_config, mibs)
+        self.assertTrue(os.path.exists(bundle))
+
+        # unchanged trap files and MIBs don't resolve any symbols
+        mibs.lookup = Mock(side_effect=AssertionError("symbol resolved"))
+        trap_handler_configs, trap_handlers = self.server._load_trap_handlers(daemon_config, mibs)
+        self.assertEqual(trap_handlers['cold'].trap_type, COLD_START)
+
+        # a changed trap file does
+        self.write_trap_file({"cold": trap_handler("coldStart", "cold-changed")})
+        self.assertRaises(AssertionError, self.server._load_trap_handlers, daemon_config, mibs)
+
+    def test_request_reload(self):
+        self.write_trap_file({"cold": trap_handler("coldStart", "cold-changed")})
+        self.server.request_reload()
+        self.server._run_periodic_tasks()
+        # the handlers are loaded in the background and swapped in later
+        deadline = time.time() + 5
+        while self.server._reload_thread is not None and time.time() < deadline:
+            time.sleep(0.01)
+            self.server._run_periodic_tasks()
+        self.assertEqual(self.handle(COLD_START), ["cold-changed"])
+
+    def test_rate_limit_summary_unknown_trap(self):
+        self.server._config['rate_limit'].update(enabled=True, per_trap=True, rate=0.001, burst=1)
+        self.server._configure_rate_limiter()
+        # a trap no loaded MIB defines is reported by its OID
+        enterprise_trap = (1, 3, 6, 1, 4, 1, 99999, 0, 1)
+        for i in range(3):
+            self.server._rate_limiter.allow("127.0.0.1", enterprise_trap)
+        for i in range(2):
+            self.server._rate_limiter.allow("127.0.0.1", tuple(COLD_START))
+        # and a failing task doesn't stop the others
+        self.server._flush_coalescer = Mock(side_effect=ValueError("flush failed"))
+        self.server._flush_coalescer.__name__ = "_flush_coalescer"
+        self.server._run_periodic_tasks(time.time() + 3600)
+        self.assertEqual(len(self.events), 1)
+        self.assertEqual(self.events[0].output, "2 traps from 127.0.0.1 (1.3.6.1.4.1.99999.0.1) suppressed, "
+                                                "1 traps from 127.0.0.1 (SNMPv2-MIB::coldStart) suppressed")
+
+if __name__ == "__main__":
+    unittest.main()
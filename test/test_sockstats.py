@@ -0,0 +1,89 @@
+import os
+import sys
+import socket
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.sockstats import read_udp_socket_stats
+from sensu.snmp.sockstats import socket_inode
+from sensu.snmp.sockstats import UdpSocketMonitor
+from sensu.snmp.sockstats import set_receive_buffer
+from sensu.snmp.metrics import metrics
+
+# helpers
+from helpers.log import log
+
+PROC_NET_UDP_HEADER = "   sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode ref pointer drops\n"
+PROC_NET_UDP_LINE = "  %d: 0100007F:0654 00000000:0000 07 00000000:%08X 00:00000000 00000000     0        0 %d 2 ffff8800b6a4c000 %d\n"
+
+class UdpSocketStatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.proc_dir = tempfile.mkdtemp()
+        self.proc_net_udp = os.path.join(self.proc_dir, "udp")
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        metrics.clear()
+
+    def tearDown(self):
+        self.sock.close()
+        shutil.rmtree(self.proc_dir)
+        metrics.clear()
+
+    def write_proc_net_udp(self, sockets):
+        fh = open(self.proc_net_udp, 'w')
+        try:
+            fh.write(PROC_NET_UDP_HEADER)
+            for i, (inode, rx_queue, drops) in enumerate(sockets):
+                fh.write(PROC_NET_UDP_LINE % (i, rx_queue, inode, drops))
+        finally:
+            fh.close()
+
+    def test_read_udp_socket_stats(self):
+        self.write_proc_net_udp([(1234, 0x200, 7), (5678, 0, 0)])
+        stats = read_udp_socket_stats((self.proc_net_udp, os.path.join(self.proc_dir, "missing")))
+        self.assertEqual(stats, {1234: (0x200, 7), 5678: (0, 0)})
+
+    def test_read_proc_net_udp(self):
+        if not os.path.exists("/proc/net/udp"):
+            return
+        self.assertEqual(read_udp_socket_stats()[socket_inode(self.sock)], (0, 0))
+
+    def test_set_receive_buffer(self):
+        with patch('sensu.snmp.sockstats.log') as log_mock:
+            self.assertEqual(set_receive_buffer(self.sock, 65536), 65536)
+        self.assertFalse(log_mock.warning.called)
+
+    def test_set_receive_buffer_limited(self):
+        if not os.path.exists("/proc/sys/net/core/rmem_max"):
+            return
+        rmem_max = int(open("/proc/sys/net/core/rmem_max").read())
+        # linux reports up to twice rmem_max, which must still be noticed
+        with patch('sensu.snmp.sockstats.log') as log_mock:
+            self.assertEqual(set_receive_buffer(self.sock, rmem_max + rmem_max // 2), rmem_max)
+        self.assertTrue(log_mock.warning.called)
+
+    def test_monitor(self):
+        monitor = UdpSocketMonitor((self.proc_net_udp,))
+        monitor.add_socket("127.0.0.1:1620", self.sock)
+        rcvbuf = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        inode = socket_inode(self.sock)
+
+        self.write_proc_net_udp([(inode, 0, 0)])
+        monitor.check()
+        self.assertEqual(monitor.stats(), {"127.0.0.1:1620": {'rx_queue': 0, 'drops': 0, 'rcvbuf': rcvbuf}})
+
+        # only the drops since the last check are counted
+        self.write_proc_net_udp([(inode, 4096, 5)])
+        monitor.check()
+        self.write_proc_net_udp([(inode, 0, 7)])
+        monitor.check()
+        self.assertEqual(monitor.stats()["127.0.0.1:1620"]['drops'], 7)
+        self.assertEqual(metrics.snapshot()['udp.kernel_drops'], 7)
+
+if __name__ == "__main__":
+    unittest.main()
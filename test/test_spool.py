@@ -0,0 +1,73 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.event import TrapEvent
+from sensu.snmp.spool import EventSpool
+
+# helpers
+from helpers.log import log
+
+class EventSpoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_dir)
+
+    def _event(self, i):
+        return TrapEvent("event %d" % (i), "output", 2, ["default"])
+
+    def _segments(self):
+        return sorted([f for f in os.listdir(self.spool_dir) if f.endswith('.spool')])
+
+    def test_append_read(self):
+        spool = EventSpool(self.spool_dir, 256)
+        self.assertTrue(spool.is_empty())
+        for i in range(10):
+            spool.append(self._event(i))
+        self.assertFalse(spool.is_empty())
+        self.assertTrue(len(self._segments()) > 1)
+        entries = spool.read(100)
+        self.assertEquals([event.name for event, position in entries], ["event %d" % (i) for i in range(10)])
+        self.assertTrue(spool.is_empty())
+        spool.acknowledge(entries[-1][1])
+        self.assertEquals(len(self._segments()), 1)
+        spool.close()
+
+    def test_replay_from_checkpoint(self):
+        spool = EventSpool(self.spool_dir, 256)
+        for i in range(10):
+            spool.append(self._event(i))
+        entries = spool.read(4)
+        spool.acknowledge(entries[-1][1])
+        spool.read(2)
+        spool.close()
+
+        # unacknowledged events are replayed
+        spool = EventSpool(self.spool_dir, 256)
+        entries = spool.read(100)
+        self.assertEquals([event.name for event, position in entries], ["event %d" % (i) for i in range(4, 10)])
+        spool.close()
+
+    def test_partial_record(self):
+        spool = EventSpool(self.spool_dir)
+        spool.append(self._event(0))
+        spool.close()
+        fh = open(os.path.join(self.spool_dir, self._segments()[-1]), 'ab')
+        fh.write('{"name": "trunc')
+        fh.close()
+
+        spool = EventSpool(self.spool_dir)
+        spool.append(self._event(1))
+        entries = spool.read(100)
+        self.assertEquals([event.name for event, position in entries], ["event 0", "event 1"])
+        spool.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import socket
+import asyncore
+import unittest
+
+from pyasn1.codec.ber import encoder
+from pysnmp.proto import api
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sensu.snmp.transport import PollingDispatcher
+from sensu.snmp.transport import TcpTransport
+from sensu.snmp.transport import TCP_DOMAIN_NAME
+
+# helpers
+from helpers.log import log
+
+def encode_trap(community, text):
+    v2c = api.protoModules[api.protoVersion2c]
+    pdu = v2c.TrapPDU()
+    v2c.apiPDU.setDefaults(pdu)
+    v2c.apiPDU.setVarBinds(pdu, [((1, 3, 6, 1, 2, 1, 1, 5, 0), v2c.OctetString(text))])
+    message = v2c.Message()
+    v2c.apiMessage.setDefaults(message)
+    v2c.apiMessage.setCommunity(message, community)
+    v2c.apiMessage.setPDU(message, pdu)
+    return encoder.encode(message)
+
+class TcpTransportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.messages = []
+        self.dispatcher = PollingDispatcher()
+        self.dispatcher.registerRecvCbFun(self._receive_message)
+        self.transport = TcpTransport(max_connections=2, idle_timeout=60, max_message_size=1024)
+        self.dispatcher.registerTransport(TCP_DOMAIN_NAME, self.transport.openServerMode(('127.0.0.1', 0)))
+        self.address = self.transport.socket.getsockname()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.dispatcher.closeDispatcher()
+
+    def _receive_message(self, transport_dispatcher, transport_domain, transport_address, message):
+        self.messages.append((transport_domain, transport_address, message))
+
+    def _connect(self):
+        client = socket.create_connection(self.address)
+        client.settimeout(2)
+        self.clients.append(client)
+        self._poll()
+        return client
+
+    def _poll(self, count=5):
+        for i in range(count):
+            asyncore.poll2(0.05, self.dispatcher.getSocketMap())
+
+    def _closed(self, client):
+        try:
+            return client.recv(1) == ''
+        except socket.error:
+            return True
+
+    def test_framing(self):
+        client = self._connect()
+        first = encode_trap("public", "first")
+        second = encode_trap("public", "second" * 50)
+        stream = first + second
+        # a message and a half, then the rest
+        client.sendall(stream[:len(first) + 3])
+        self._poll()
+        self.assertEqual(len(self.messages), 1)
+        client.sendall(stream[len(first) + 3:])
+        self._poll()
+        self.assertEqual([message for domain, address, message in self.messages], [first, second])
+        transport_domain, transport_address, message = self.messages[0]
+        self.assertEqual(transport_domain, TCP_DOMAIN_NAME)
+        self.assertEqual(transport_address, client.getsockname())
+
+    def test_send_message(self):
+        client = self._connect()
+        client.sendall(encode_trap("public", "request"))
+        self._poll()
+        transport_domain, transport_address, message = self.messages[0]
+        self.dispatcher.sendMessage("response", transport_domain, transport_address)
+        self._poll()
+        self.assertEqual(client.recv(100), "response")
+
+    def test_max_connections(self):
+        self._connect()
+        self._connect()
+        refused = self._connect()
+        self.assertTrue(self._closed(refused))
+        self.assertEqual(self.transport.stats(), {'connections': 2, 'max_connections': 2})
+
+    def test_framing_error(self):
+        client = self._connect()
+        client.sendall("not a SNMP message")
+        self._poll()
+        self.assertTrue(self._closed(client))
+        self.assertEqual(self.transport.stats()['connections'], 0)
+
+    def test_max_message_size(self):
+        client = self._connect()
+        client.sendall(encode_trap("public", "x" * 2000)[:100])
+        self._poll()
+        self.assertTrue(self._closed(client))
+        self.assertEqual(self.messages, [])
+
+    def test_idle_timeout(self):
+        idle = self._connect()
+        active = self._connect()
+        # both connections were opened half a minute ago
+        for connection in self.transport._connections.values():
+            connection.last_active -= 30
+        self.transport.close_idle(time.time())
+        self.assertEqual(self.transport.stats()['connections'], 2)
+        active.sendall(encode_trap("public", "active"))
+        self._poll()
+        self.transport.close_idle(time.time() + 45)
+        self._poll()
+        self.assertTrue(self._closed(idle))
+        self.assertEqual(self.transport.stats()['connections'], 1)
+
+    def test_peer_close(self):
+        client = self._connect()
+        client.close()
+        self._poll()
+        self.assertEqual(self.transport.stats()['connections'], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import os
+import sys
+import unittest
+import multiprocessing
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from helpers.log import log
+
+from sensu.snmp.workers import TrapEventForwarder
+from sensu.snmp.workers import TrapReceiverWorkerStats
+
+class TrapEventForwarderTestCase(unittest.TestCase):
+
+    def test_dispatch(self):
+        messages = multiprocessing.Queue()
+        forwarder = TrapEventForwarder(3, messages)
+        self.assertTrue(forwarder.dispatch("some-event"))
+        self.assertEqual(messages.get(True, 1), ('event', 3, "some-event"))
+
+class TrapReceiverWorkerStatsTestCase(unittest.TestCase):
+
+    def test_stats(self):
+        worker_stats = TrapReceiverWorkerStats()
+        worker_stats.update(0, {'traps': 5, 'events': 4, 'mib_cache': {'size': 10}})
+        worker_stats.update(1, {'traps': 2, 'events': 1, 'mib_cache': {'size': 3}})
+        # the latest report of a worker replaces the previous one
+        worker_stats.update(1, {'traps': 3, 'events': 2, 'mib_cache': {'size': 3}})
+
+        stats = worker_stats.stats()
+        self.assertEqual(sorted(stats['workers'].keys()), [0, 1])
+        self.assertEqual(stats['total'], {'traps': 8, 'events': 6})
+
+if __name__ == '__main__':
+    unittest.main()